@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'archive_system.settings')
+# Настройки (CONN_MAX_AGE) знают, что работают под ASGI
+os.environ.setdefault('DOCUGUARD_ASGI', '1')
 
 application = get_asgi_application()
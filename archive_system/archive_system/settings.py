@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -19,13 +20,20 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
 
+# Для боевого сервера все три задаются переменными окружения:
+#   DOCUGUARD_SECRET_KEY=... DOCUGUARD_DEBUG=0 DOCUGUARD_ALLOWED_HOSTS=docs.example.com
+# Без них — настройки для локальной разработки, как раньше.
+
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = 'django-insecure-2p%7@uq)h$1v=+kae40%n8)&=j1l29t2au&=xe0z3e(+(fd*$h'
+SECRET_KEY = os.environ.get(
+    'DOCUGUARD_SECRET_KEY',
+    'django-insecure-2p%7@uq)h$1v=+kae40%n8)&=j1l29t2au&=xe0z3e(+(fd*$h',
+)
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.environ.get('DOCUGUARD_DEBUG', '1') == '1'
 
-ALLOWED_HOSTS = ['*']
+ALLOWED_HOSTS = os.environ.get('DOCUGUARD_ALLOWED_HOSTS', '*').split(',')
 
 
 # Application definition
@@ -73,12 +81,70 @@ WSGI_APPLICATION = 'archive_system.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DOCUGUARD_DB=sqlite (по умолчанию) — один сервер, файл базы рядом с проектом.
+# DOCUGUARD_DB=postgres — несколько воркеров/серверов; нужен psycopg[pool]
+# (pip install "psycopg[binary,pool]"). Полнотекстовый поиск по содержимому
+# файлов есть только на SQLite (core/search.py), на Postgres — по названию.
+#
+# Соединение с базой живет DOCUGUARD_CONN_MAX_AGE секунд, а не открывается
+# заново на каждый запрос. Под ASGI (uvicorn, archive_system/asgi.py) по
+# умолчанию 0: там запросы выполняются в разных потоках, и постоянные
+# соединения копятся по одному на поток.
+# Проверить настройки под нагрузкой: python manage.py benchmark_db --test-db <файл>
+
+if os.environ.get('DOCUGUARD_DB', 'sqlite') == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DOCUGUARD_PG_NAME', 'docuguard'),
+            'USER': os.environ.get('DOCUGUARD_PG_USER', 'docuguard'),
+            'PASSWORD': os.environ.get('DOCUGUARD_PG_PASSWORD', ''),
+            'HOST': os.environ.get('DOCUGUARD_PG_HOST', 'localhost'),
+            'PORT': os.environ.get('DOCUGUARD_PG_PORT', '5432'),
+            # Пул соединений в процессе (psycopg_pool) вместо CONN_MAX_AGE
+            'CONN_MAX_AGE': 0,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.environ.get('DOCUGUARD_PG_POOL_MIN', '2')),
+                    'max_size': int(os.environ.get('DOCUGUARD_PG_POOL_MAX', '10')),
+                    'timeout': 10,
+                },
+            },
+        }
     }
-}
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DOCUGUARD_SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': int(os.environ.get(
+                'DOCUGUARD_CONN_MAX_AGE',
+                '0' if os.environ.get('DOCUGUARD_ASGI') == '1' else '60',
+            )),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+    }
+    # DOCUGUARD_SQLITE_TUNING=0 — настройки SQLite по умолчанию (для сравнения в benchmark_db)
+    if os.environ.get('DOCUGUARD_SQLITE_TUNING', '1') == '1':
+        DATABASES['default']['OPTIONS'] = {
+            # WAL: чтение не ждет записи, а запись — чтения; synchronous=NORMAL
+            # в режиме WAL не теряет целостность, только последние коммиты при сбое питания
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA temp_store=MEMORY;'
+                'PRAGMA cache_size=-20000;'      # 20 МБ кэша страниц на соединение
+                'PRAGMA mmap_size=134217728;'    # 128 МБ файла базы читаются через mmap
+            ),
+            # Сколько секунд ждать, пока другой писатель отпустит базу (PRAGMA busy_timeout),
+            # вместо мгновенного "database is locked"
+            'timeout': 20,
+            # Транзакция сразу берет блокировку записи. Иначе (DEFERRED) транзакция,
+            # начавшая с чтения, при первой записи получает "database is locked",
+            # не дожидаясь busy_timeout
+            'transaction_mode': 'IMMEDIATE',
+        }
 
 
 # Password validation
@@ -123,7 +189,6 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # 2. В самый конец файла добавь настройки медиа (для загрузки файлов)
-import os
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
@@ -162,4 +227,168 @@ X_FRAME_OPTIONS = 'ALLOWALL'
 
 # 3. Разрешаем куки и CSRF через безопасное соединение
 CSRF_COOKIE_SECURE = True
-SESSION_COOKIE_SECURE = True
\ No newline at end of file
+SESSION_COOKIE_SECURE = True
+
+# Сколько документов показывать на одной странице списка
+DOCUMENTS_PAGE_SIZE = 50
+
+# Полнотекстовый поиск (core/search.py)
+SEARCH_MAX_RESULTS = 500         # сколько лучших совпадений берем из индекса
+SEARCH_MAX_TEXT_LENGTH = 1000000  # сколько символов текста файла индексируем
+SEARCH_SNIPPET_WORDS = 12         # длина фрагмента с подсветкой
+
+# Отдача файлов (core/delivery.py)
+# Cache-Control по грифу документа: открытые браузер может держать час,
+# служебные — перепроверяет каждый раз (дешевый 304), секретные не кэшируются вовсе
+DOCUMENT_CACHE_CONTROL = {
+    'public': 'private, max-age=3600',
+    'internal': 'private, no-cache',
+    'secret': 'private, no-store',
+}
+DOCUMENT_MAX_RANGES = 16  # больше кусков в одном Range-запросе — отдаем файл целиком
+
+# Кто копирует байты файла клиенту: 'python' | 'nginx' | 'sendfile' (см. core/delivery.py)
+DOCUMENT_DELIVERY_BACKEND = os.environ.get('DOCUGUARD_DELIVERY_BACKEND', 'python')
+# internal-location в nginx, смотрящий на MEDIA_ROOT (только для 'nginx')
+DOCUMENT_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+
+# Предпросмотр на сервере (core/previews.py)
+PREVIEW_CACHE_MAX_BYTES = 512 * 1024 * 1024  # кэш превью в MEDIA_ROOT/previews, сверх — вытеснение по LRU
+PREVIEW_THUMBNAIL_SIZE = 256
+PREVIEW_THUMBNAIL_FORMAT = 'WEBP'            # 'WEBP' или 'PNG'
+PREVIEW_DOCX_PARAGRAPHS_PER_PAGE = 60
+PREVIEW_DOCX_MAX_PAGES = 50
+PREVIEW_TABLE_ROWS = 100
+PREVIEW_TABLE_COLUMNS = 50
+
+# Фоновые задачи (core/tasks.py, воркер: python manage.py run_worker)
+TASKS_RUN_EAGERLY = False        # True — выполнять задачи сразу в процессе (без воркера)
+TASKS_RETRY_DELAY_SECONDS = 30   # задержка перед повтором, растет вдвое с каждой попыткой
+TASKS_STALE_AFTER_SECONDS = 600  # аренду задачи не продлевали дольше этого — воркер упал, задачу возвращаем в очередь
+TASKS_KEEP_DONE_DAYS = 7         # сколько хранить выполненные задачи...
+TASKS_KEEP_FAILED_DAYS = 30      # ...и упавшие (last_error для разбора)
+
+# Докачиваемая загрузка (core/uploads.py)
+UPLOAD_MAX_BYTES = 4 * 1024 * 1024 * 1024       # 4 ГБ на файл
+UPLOAD_CHUNK_MAX_BYTES = 64 * 1024 * 1024       # максимум на один PATCH
+UPLOAD_LOCK_TIMEOUT_SECONDS = 300
+UPLOAD_SESSION_MAX_AGE_HOURS = 24               # брошенные сеансы старше — удаляются
+
+# Журнал аудита (core/audit.py): запись пачками в фоне через файл-журнал
+AUDIT_SYNC = False                                # True — писать сразу в базу (для тестов)
+AUDIT_BATCH_SIZE = 200                            # сбрасывать в базу, когда накопилось столько записей...
+AUDIT_FLUSH_INTERVAL = 1.0                        # ...или раз в столько секунд
+AUDIT_JOURNAL_DIR = BASE_DIR / 'audit_journal'    # несброшенные записи; не удалять вручную!
+AUDIT_JOURNAL_STALE_SECONDS = 300                 # журнал, не обновлявшийся дольше, считается брошенным
+AUDIT_LOG_PAGE_SIZE = 100                         # записей на странице журнала
+
+# Срок хранения журнала аудита (python manage.py cleanup_logs, core/retention.py)
+AUDIT_RETENTION_DAYS = 90
+AUDIT_RETENTION_BATCH_SIZE = 1000      # записей на одну короткую транзакцию удаления
+AUDIT_RETENTION_BATCH_PAUSE = 0.05     # пауза (сек) между пачками, чтобы не мешать загрузкам
+AUDIT_ARCHIVE_DIR = None               # например BASE_DIR / 'audit_archive' — gzip JSONL по месяцам перед удалением
+
+# Планировщик (python manage.py run_scheduler, core/scheduler.py).
+# Здесь можно поменять расписание задания (cron: "мин час день мес день_недели") или отключить его: None
+SCHEDULER_JOBS = {
+    'cleanup_logs': '*/20 * * * *',
+    'recover_audit_journal': '*/5 * * * *',
+    'cleanup_upload_sessions': '15 * * * *',
+    'purge_finished_tasks': '45 3 * * *',
+    'enforce_preview_cache_limit': '*/5 * * * *',
+    'optimize_search_index': '30 3 * * *',
+}
+
+# Доступ к документам по грифу (core/access.py)
+ACCESS_DEFAULT_CLEARANCE = 'internal'  # допуск сотрудника без особых групп: общие + служебные
+ACCESS_CLEARANCE_GROUPS = {            # группа Django -> допуск (берется максимальный)
+    'Секретный допуск': 'secret',
+    'Внешние пользователи': 'public',
+}
+ACCESS_CACHE_SECONDS = 300             # сколько держать допуск пользователя в кэше
+
+# Кэш (core/caching.py, core/access.py). Кэш прав доступа и фрагментов страниц
+# сбрасывается сигналами в том процессе, где поменялись данные, поэтому он
+# должен быть общим для всех процессов:
+# DOCUGUARD_CACHE_BACKEND=file  -> общий для процессов одного сервера кэш в папке cache/
+# DOCUGUARD_CACHE_BACKEND=redis -> общий для нескольких серверов (DOCUGUARD_REDIS_URL; pip install redis)
+# Память процесса (по умолчанию) — только для одного процесса веб-сервера:
+# при WEB_CONCURRENCY > 1 manage.py check выдаст ошибку
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', '1'))  # процессов веб-сервера (gunicorn/uvicorn берут его же)
+CACHE_BACKEND = os.environ.get('DOCUGUARD_CACHE_BACKEND', 'locmem')
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('DOCUGUARD_REDIS_URL', 'redis://localhost:6379/0'),
+        }
+    }
+elif CACHE_BACKEND == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': BASE_DIR / 'cache',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 5000},
+        }
+    }
+CACHE_FRAGMENT_SECONDS = 300  # сколько живут кэшированные фрагменты страниц
+
+# Массовая загрузка (core/bulk.py)
+BULK_UPLOAD_MAX_FILES = 500                     # файлов в одном запросе (больше — через ZIP)
+DATA_UPLOAD_MAX_NUMBER_FILES = BULK_UPLOAD_MAX_FILES
+BULK_ZIP_MAX_MEMBERS = 10000                    # файлов в одном архиве
+BULK_ZIP_MAX_BYTES = 20 * 1024 * 1024 * 1024    # суммарный размер после распаковки (защита от zip-бомб)
+DOWNLOAD_ZIP_MAX_FILES = 5000                   # "Скачать все (ZIP)": максимум документов в архиве
+
+# Публичные ссылки (core/sharing.py)
+SHARE_LINK_TTL_DAYS = 7           # срок действия новой ссылки (None — бессрочно)
+SHARE_LINK_MAX_DOWNLOADS = 100    # скачиваний по одной ссылке (None — без лимита)
+SHARE_LINK_RATE = 30              # скачиваний в минуту по одной ссылке (None — не ограничивать)
+SHARE_LINK_BURST = 10             # сколько скачиваний подряд можно до ограничения частоты
+SHARE_LINK_CACHE_SECONDS = 60     # сколько держать найденную ссылку в кэше
+SHARE_LINK_FLUSH_INTERVAL = 5.0   # как часто писать счетчики скачиваний в базу, секунд
+
+# Холодное хранилище (core/storage.py, core/tiering.py). None — все файлы только на локальном диске.
+#   {'BACKEND': 'filesystem', 'LOCATION': '/mnt/cold'}
+#   {'BACKEND': 's3', 'BUCKET': 'docuguard', 'PREFIX': '', 'ENDPOINT_URL': 'http://minio:9000',
+#    'ACCESS_KEY': '...', 'SECRET_KEY': '...', 'REGION': None}   (нужен boto3)
+DOCUMENT_COLD_STORAGE = None
+TIERING_DEMOTE_AFTER_DAYS = 90       # не открывали столько дней — убираем с локального диска
+TIERING_REPLICATE_UPLOADS = True     # сразу копировать новые файлы в холодное хранилище (фоновой задачей)
+TIERING_BATCH_SIZE = 200             # файлов за одну пачку вытеснения
+TIERING_TOUCH_INTERVAL = 3600        # как часто (секунд) записывать время открытия одного файла
+
+# Осиротевшие файлы (core/orphans.py, manage.py collect_orphans)
+ORPHAN_SCAN_DIRS = ['documents', 'docs', 'blobs', 'avatars']  # подкаталоги MEDIA_ROOT (previews и uploads чистятся отдельно)
+ORPHAN_GRACE_HOURS = 24                        # файлы моложе не трогаем — загрузка может быть еще не дописана
+ORPHAN_ACTION = 'quarantine'                   # 'quarantine' — перенести в ORPHAN_QUARANTINE_DIR, 'delete' — удалить
+ORPHAN_QUARANTINE_DIR = BASE_DIR / 'quarantine'
+ORPHAN_QUARANTINE_DAYS = 30                    # через сколько дней карантин очищается
+ORPHAN_BATCH_SIZE = 500                        # файлов на одну проверку в базе
+
+# Удаление категории вместе с документами (фоновая задача delete_category)
+CATEGORY_DELETE_BATCH_SIZE = 500   # документов за одну транзакцию
+
+# Аватарки (core/avatars.py): оригинал хранится, страницы показывают копии
+AVATAR_SIZES = [32, 64, 256]                 # стороны квадратных копий, px (32 и 64 — шапка, 256 — профиль)
+AVATAR_QUALITY = 82                          # качество WebP/JPEG
+AVATAR_MAX_UPLOAD_BYTES = 20 * 1024 * 1024
+AVATAR_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+
+# Пользователь сессии загружается вместе с профилем одним запросом (core/backends.py).
+# ModelBackend оставлен для сессий, открытых до перехода, — они работают до следующего входа
+AUTHENTICATION_BACKENDS = [
+    'core.backends.ProfileBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+# Сколько секунд только что сохраненный blob защищен от удаления, пока на него
+# не сослался документ (StoredBlob.pin); брошенные — убирает collect_orphans
+BLOB_PIN_SECONDS = 3600
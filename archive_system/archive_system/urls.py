@@ -15,8 +15,17 @@ urlpatterns = [
     path('login/', login_view, name='login'),
     path('logout/', logout_view, name='logout'),
     path('upload/', upload_document, name='upload'),
+    # Докачиваемая загрузка больших файлов (кусками)
+    path('upload/sessions/', views.upload_session_create, name='upload_session_create'),
+    path('upload/sessions/<uuid:session_id>/', views.upload_session_detail, name='upload_session'),
+    path('upload/sessions/<uuid:session_id>/finalize/', views.upload_session_finalize, name='upload_session_finalize'),
+    # Массовые операции: папка/ZIP и действия над отмеченными документами
+    path('upload/bulk/', views.bulk_upload, name='bulk_upload'),
+    path('documents/bulk/', views.bulk_action, name='bulk_action'),
     path('delete/<int:doc_id>/', delete_document, name='delete_document'),
     path('profile/', profile_view, name='profile'),
+    # Уменьшенные копии аватарок (имя зависит от содержимого — кэшируются навсегда)
+    path('avatar/<str:key>/<str:filename>', views.avatar_variant, name='avatar_variant'),
     path('categories/', manage_categories, name='manage_categories'),
     path('categories/delete/<int:cat_id>/', delete_category, name='delete_category'),
     path('edit/<int:doc_id>/', edit_document, name='edit_document'),
@@ -29,6 +38,9 @@ urlpatterns = [
     path('s/<uuid:token>/', public_download, name='public_download'),
 
     path('document/<int:doc_id>/open/', views.open_file, name='open_file'),
+    # Все документы по текущим фильтрам одним ZIP
+    path('documents/download.zip', views.download_zip, name='download_zip'),
+    path('document/<int:doc_id>/preview/<str:variant>/', views.document_preview, name='document_preview'),
 ]
 
 if settings.DEBUG:
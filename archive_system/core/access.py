@@ -0,0 +1,167 @@
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import Document
+
+
+# ==========================================
+# ПРАВА ДОСТУПА К ДОКУМЕНТАМ
+# ==========================================
+# Уровень допуска пользователя (clearance) — один из Document.SECURITY_CHOICES:
+#   - суперпользователь видит все;
+#   - состоит в группах из ACCESS_CLEARANCE_GROUPS — максимальный уровень этих групп;
+#   - иначе — ACCESS_DEFAULT_CLEARANCE.
+# Свои документы автор видит всегда, каким бы ни был гриф.
+#
+# Фильтр по допуску накладывается в SQL (visible_documents), а не
+# проверкой каждой строки. Допуск и группы пользователя кэшируются
+# (ACCESS_CACHE_SECONDS) и сбрасываются при изменении пользователя,
+# его групп или самих групп.
+
+# От открытого к секретному
+LEVELS = [code for code, label in Document.SECURITY_CHOICES]
+
+
+def _cache_key(user_id):
+    return f"access:user:{user_id}"
+
+
+def _clearance_for(groups):
+    mapped = [settings.ACCESS_CLEARANCE_GROUPS[name] for name in groups if name in settings.ACCESS_CLEARANCE_GROUPS]
+    if not mapped:
+        return settings.ACCESS_DEFAULT_CLEARANCE
+    return max(mapped, key=LEVELS.index)
+
+
+def get_access(user):
+    """{'clearance': уровень, 'groups': frozenset названий групп} — из кэша, если есть."""
+    if not user.is_authenticated:
+        return {'clearance': None, 'groups': frozenset()}
+
+    # В пределах запроса — атрибут на объекте пользователя, без обращения к кэшу
+    access = getattr(user, '_access', None)
+    if access is not None:
+        return access
+
+    access = cache.get(_cache_key(user.pk))
+    if access is None:
+        groups = frozenset(user.groups.values_list('name', flat=True))
+        access = {'clearance': _clearance_for(groups), 'groups': groups}
+        cache.set(_cache_key(user.pk), access, settings.ACCESS_CACHE_SECONDS)
+    user._access = access
+    return access
+
+
+async def aget_access(user):
+    """get_access для асинхронных представлений: кэш и группы — без блокировки event loop."""
+    if not user.is_authenticated:
+        return {'clearance': None, 'groups': frozenset()}
+
+    access = getattr(user, '_access', None)
+    if access is not None:
+        return access
+
+    access = await cache.aget(_cache_key(user.pk))
+    if access is None:
+        groups = frozenset([name async for name in user.groups.values_list('name', flat=True)])
+        access = {'clearance': _clearance_for(groups), 'groups': groups}
+        await cache.aset(_cache_key(user.pk), access, settings.ACCESS_CACHE_SECONDS)
+    user._access = access
+    return access
+
+
+def allowed_levels(user):
+    """Грифы, которые пользователь видит в чужих документах."""
+    if user.is_superuser:
+        return list(LEVELS)
+    clearance = get_access(user)['clearance']
+    if clearance is None:
+        return []
+    return LEVELS[:LEVELS.index(clearance) + 1]
+
+
+def in_group(user, name):
+    return name in get_access(user)['groups']
+
+
+# ------------------------------------------
+# 1. ПРОВЕРКИ
+# ------------------------------------------
+
+def visible_documents(user, queryset=None):
+    """Документы, которые пользователь может видеть (фильтр в SQL)."""
+    queryset = Document.objects.all() if queryset is None else queryset
+    if not user.is_authenticated:
+        return queryset.none()
+
+    levels = allowed_levels(user)
+    if len(levels) == len(LEVELS):
+        return queryset
+    return queryset.filter(Q(security_level__in=levels) | Q(uploaded_by=user))
+
+
+async def avisible_documents(user, queryset=None):
+    """visible_documents для асинхронных представлений (допуск читается через aget_access)."""
+    await aget_access(user)
+    return visible_documents(user, queryset)
+
+
+def manageable_documents(user, queryset=None):
+    """Документы, которыми пользователь может управлять (см. can_manage), — фильтр в SQL."""
+    queryset = Document.objects.all() if queryset is None else queryset
+    if not user.is_authenticated:
+        return queryset.none()
+    if user.is_superuser:
+        return queryset
+    return queryset.filter(uploaded_by=user)
+
+
+def can_view(user, doc):
+    if not user.is_authenticated:
+        return False
+    return doc.uploaded_by_id == user.pk or doc.security_level in allowed_levels(user)
+
+
+def can_manage(user, doc):
+    """Редактировать, удалять и делиться может автор или администратор."""
+    return user.is_authenticated and (user.is_superuser or doc.uploaded_by_id == user.pk)
+
+
+# ------------------------------------------
+# 2. СБРОС КЭША
+# ------------------------------------------
+
+def invalidate(*user_ids):
+    cache.delete_many([_cache_key(user_id) for user_id in user_ids])
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_access(sender, instance, update_fields=None, **kwargs):
+    # Вход в систему сохраняет только last_login — на допуск это не влияет
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    invalidate(instance.pk)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_group_membership(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        # user.groups.add(...) / remove / clear
+        if action.startswith('post_'):
+            invalidate(instance.pk)
+    elif action == 'pre_clear':
+        # group.user_set.clear() — кого очистили, после уже не узнать
+        invalidate(*instance.user_set.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove') and pk_set:
+        invalidate(*pk_set)
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def invalidate_group_members(sender, instance, **kwargs):
+    # Переименование или удаление группы меняет допуск всех ее участников
+    invalidate(*instance.user_set.values_list('pk', flat=True))
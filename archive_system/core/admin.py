@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Category, Document
+from .models import Category, Document, ScheduledJob, ShareLink, Task
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -10,4 +10,23 @@ class DocumentAdmin(admin.ModelAdmin):
     # Исправили поля на те, что реально есть в модели
     list_display = ['title', 'category', 'security_level', 'uploaded_at', 'uploaded_by']
     list_filter = ['category', 'security_level', 'uploaded_at']
-    search_fields = ['title']
\ No newline at end of file
+    search_fields = ['title']
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ['name', 'document', 'status', 'attempts', 'created_at', 'finished_at']
+    list_filter = ['status', 'name']
+    raw_id_fields = ['document']
+
+@admin.register(ShareLink)
+class ShareLinkAdmin(admin.ModelAdmin):
+    list_display = ['document', 'created_at', 'expires_at', 'download_count', 'max_downloads']
+    readonly_fields = ['token', 'created_at']
+    raw_id_fields = ['document']
+
+@admin.register(ScheduledJob)
+class ScheduledJobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'schedule', 'next_run_at', 'last_started_at', 'last_duration', 'last_status', 'run_count', 'failure_count']
+    list_filter = ['last_status']
+    readonly_fields = ['locked_by', 'locked_until', 'last_started_at', 'last_duration', 'last_status',
+                       'last_result', 'last_error', 'run_count', 'failure_count']
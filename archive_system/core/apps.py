@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        # Сигналы сброса кэша прав доступа, версий кэша страниц и публичных ссылок
+        from . import access, caching, sharing  # noqa: F401
+        # Проверки настроек для manage.py check
+        from . import checks  # noqa: F401
@@ -0,0 +1,283 @@
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DataError, IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import AuditLog
+
+logger = logging.getLogger(__name__)
+
+
+# ==========================================
+# ЖУРНАЛ АУДИТА: ЗАПИСЬ ПАЧКАМИ В ФОНЕ
+# ==========================================
+# audit.log(...) не ходит в базу: запись дописывается строкой в
+# файл-журнал процесса (AUDIT_JOURNAL_DIR/audit-<pid>.jsonl), а фоновый
+# поток раз в AUDIT_FLUSH_INTERVAL секунд (или когда накопилось
+# AUDIT_BATCH_SIZE записей) переносит журнал в базу одним bulk_create.
+#
+# Журнал и есть защита от потери: перед записью в базу он
+# переименовывается в *.flushing и удаляется только после коммита.
+# Если процесс упал, его файлы подберет следующий запуск или задание
+# планировщика. Живой процесс раз в AUDIT_FLUSH_INTERVAL обновляет время
+# изменения своих файлов, поэтому брошенным считается файл, который не
+# трогали дольше AUDIT_JOURNAL_STALE_SECONDS. По номеру процесса этого не
+# понять: номер мог достаться новому процессу, а у соседнего контейнера
+# с общим каталогом журналов номера свои.
+# Чужой файл recover() сначала забирает себе переименованием в
+# *.claimed-<uuid> (os.replace атомарен), и только потом пишет в базу:
+# два процесса, подбирающие журналы одновременно, не запишут одну пачку
+# дважды — проигравший просто не найдет файл.
+# Гарантия "хотя бы один раз": при падении ровно между коммитом и
+# удалением файла пачка может записаться повторно.
+#
+# Пачка, которую база не принимает из-за самих данных (битая запись,
+# слишком длинное поле), откладывается в *.failed с записью в лог и
+# не задерживает следующие. Такие файлы разбираются вручную.
+#
+# AUDIT_SYNC = True — старое поведение (сразу в базу), для тестов.
+
+
+# Действия, которые пишут представления (для фильтра в журнале)
+ACTIONS = ("Загрузка файла", "Редактирование", "Удаление файла", "Удаление категории")
+
+
+def _is_abandoned(path):
+    try:
+        age = time.time() - os.stat(path).st_mtime
+    except FileNotFoundError:
+        return False
+    return age > settings.AUDIT_JOURNAL_STALE_SECONDS
+
+
+# Ошибки в данных пачки: повтор не поможет. Остальные (база недоступна) — повторяем позже
+_BATCH_ERRORS = (DataError, IntegrityError, KeyError, TypeError, ValueError)
+
+
+def _write_entries(entries):
+    # Пользователя могли удалить, пока запись ждала в журнале: запись
+    # остается, как и у AuditLog.user с SET_NULL
+    user_ids = {entry['user_id'] for entry in entries} - {None}
+    existing = set(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+    objs = [
+        AuditLog(
+            user_id=entry['user_id'] if entry['user_id'] in existing else None,
+            action=entry['action'],
+            document_title=entry['document_title'],
+            timestamp=parse_datetime(entry['timestamp']),
+        )
+        for entry in entries
+    ]
+    with transaction.atomic():
+        AuditLog.objects.bulk_create(objs, batch_size=500)
+
+
+def _read_journal(path):
+    entries = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # Недописанная последняя строка (процесс убили посреди записи)
+                logger.warning("Пропущена битая строка в журнале аудита %s", path)
+    return entries
+
+
+def replay_file(path):
+    """Переносит записи из файла журнала в базу и удаляет файл. Возвращает число записей."""
+    entries = _read_journal(path)
+    if entries:
+        _write_entries(entries)
+    os.remove(path)
+    return len(entries)
+
+
+def _replay_or_set_aside(path):
+    """replay_file, но пачка с негодными данными уходит в *.failed, а не ломает остальные."""
+    try:
+        return replay_file(path)
+    except _BATCH_ERRORS:
+        logger.exception("Пачка аудита %s не записывается в базу, отложена в .failed", path)
+        os.replace(path, path + '.failed')
+        return 0
+
+
+class AuditWriter:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        # Сбрасывает в базу только один поток за раз (фоновый или atexit)
+        self._flush_lock = threading.Lock()
+        self._pending = 0
+        self._journal = None
+        self._thread = None
+        self._pid = None
+
+    # --- пути ---
+
+    @property
+    def journal_dir(self):
+        return str(settings.AUDIT_JOURNAL_DIR)
+
+    def _journal_path(self):
+        return os.path.join(self.journal_dir, f"audit-{self._pid}.jsonl")
+
+    def _own_files(self):
+        return glob.glob(os.path.join(self.journal_dir, f"audit-{self._pid}.jsonl*"))
+
+    # --- запись ---
+
+    def log(self, user, action, document_title):
+        self.log_many(user, action, [document_title])
+
+    def log_many(self, user, action, document_titles):
+        """Одно действие над многими документами: одна запись на документ, одной пачкой."""
+        user_id = user.pk if user is not None and user.is_authenticated else None
+        timestamp = timezone.now().isoformat()
+        entries = [
+            {'user_id': user_id, 'action': action, 'document_title': title, 'timestamp': timestamp}
+            for title in document_titles
+        ]
+        if not entries:
+            return
+        if settings.AUDIT_SYNC:
+            _write_entries(entries)
+            return
+
+        lines = ''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries)
+        with self._lock:
+            self._ensure_started()
+            if self._journal is None:
+                # Прошлый сброс не смог открыть свежий файл — пробуем снова
+                self._journal = open(self._journal_path(), 'a', encoding='utf-8')
+            self._journal.write(lines)
+            self._journal.flush()
+            self._pending += len(entries)
+            if self._pending >= settings.AUDIT_BATCH_SIZE:
+                self._wakeup.notify()
+
+    def _ensure_started(self):
+        # После fork (gunicorn --preload) у дочернего процесса свой журнал и свой поток
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        self._pid = os.getpid()
+        os.makedirs(self.journal_dir, exist_ok=True)
+        self._journal = open(self._journal_path(), 'a', encoding='utf-8')
+        self._pending = 0
+        self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+        self._thread.start()
+
+    # --- сброс в базу ---
+
+    def _run(self):
+        self.recover()
+        while True:
+            with self._lock:
+                self._wakeup.wait(timeout=settings.AUDIT_FLUSH_INTERVAL)
+            try:
+                self._touch()
+                self.flush()
+            except Exception:
+                logger.exception("Не удалось записать журнал аудита, повторим позже")
+            finally:
+                close_old_connections()
+
+    def _touch(self):
+        # Отметка "процесс жив" для recover() в других процессах
+        for path in self._own_files():
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+
+    def flush(self):
+        """Переносит накопленные записи этого процесса в базу. Возвращает число записей."""
+        with self._lock:
+            if self._journal is not None and self._pending:
+                # Текущий журнал уходит на запись, новые записи идут в свежий файл.
+                # Не удалось переименовать — записи остаются в журнале до следующего
+                # сброса, но писать дальше есть куда в любом случае
+                self._journal.close()
+                self._journal = None
+                try:
+                    os.replace(self._journal_path(), self._journal_path() + f".{time.time_ns()}.flushing")
+                    self._pending = 0
+                finally:
+                    self._journal = open(self._journal_path(), 'a', encoding='utf-8')
+            pid = self._pid
+
+        if pid is None:
+            return 0
+        written = 0
+        with self._flush_lock:
+            # Заодно дописываем пачки, которые не удалось записать в прошлый раз
+            for path in sorted(glob.glob(os.path.join(self.journal_dir, f"audit-{pid}.jsonl.*.flushing"))):
+                written += _replay_or_set_aside(path)
+        return written
+
+    def recover(self, force=False):
+        """
+        Подбирает журналы упавших процессов (не обновлялись дольше AUDIT_JOURNAL_STALE_SECONDS).
+        force=True — все чужие журналы (только когда приложение остановлено).
+        """
+        recovered = 0
+        for path in sorted(glob.glob(os.path.join(self.journal_dir, 'audit-*.jsonl*'))):
+            if path.endswith('.failed'):
+                continue
+            try:
+                pid = int(os.path.basename(path).split('-', 1)[1].split('.', 1)[0])
+            except ValueError:
+                continue
+            if pid == self._pid or (not force and not _is_abandoned(path)):
+                continue
+            claimed = f"{path}.claimed-{uuid.uuid4().hex}"
+            try:
+                os.replace(path, claimed)
+            except FileNotFoundError:
+                continue  # успел подобрать другой процесс
+            # Свежее время изменения: пока пишем, файл не считается брошенным
+            os.utime(claimed)
+            recovered += _replay_or_set_aside(claimed)
+        if recovered:
+            logger.warning("Восстановлено записей аудита из журналов: %s", recovered)
+        return recovered
+
+
+writer = AuditWriter()
+
+
+def log(user, action, document_title):
+    """Записать действие в журнал аудита (в базу попадет в фоне, пачкой)."""
+    writer.log(user, action, document_title)
+
+
+def log_many(user, action, document_titles):
+    """Записать одно действие над многими документами (массовые операции)."""
+    writer.log_many(user, action, document_titles)
+
+
+def flush():
+    return writer.flush()
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        writer.flush()
+    except Exception:
+        logger.exception("Журнал аудита не записан при выходе — будет восстановлен при следующем запуске")
@@ -0,0 +1,138 @@
+import hashlib
+import io
+import re
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from PIL import Image, ImageOps
+
+
+# ==========================================
+# АВАТАРЫ: УМЕНЬШЕННЫЕ КОПИИ
+# ==========================================
+# Оригинал аватарки (фото с телефона на 5–10 МБ) хранится как есть, но на
+# страницы не попадает. При загрузке он один раз декодируется и режется
+# в квадратные копии AVATAR_SIZES в WebP и JPEG (для старых браузеров):
+#   MEDIA_ROOT/avatars/<хэш>/32.webp, 32.jpg, 64.webp, ...
+# <хэш> — от содержимого оригинала и настроек нарезки, поэтому новая
+# аватарка всегда получает новые адреса, а старые можно кэшировать в
+# браузере навсегда (AVATAR_CACHE_CONTROL, представление avatar_variant).
+# В Profile.avatar_variants — каталог копий; старые каталоги после смены
+# аватарки убирает сборщик осиротевших файлов (core/orphans.py).
+
+# Поднять, если поменялся способ нарезки, — копии пересоберет manage.py rebuild_avatars
+AVATAR_VERSION = 1
+
+FORMATS = {'webp': ('WEBP', 'image/webp'), 'jpg': ('JPEG', 'image/jpeg')}
+
+_VARIANT_DIR_RE = re.compile(r'^avatars/[0-9a-f]{20}$')
+_VARIANT_FILE_RE = re.compile(r'^(\d+)\.(webp|jpg)$')
+
+
+class AvatarError(Exception):
+    pass
+
+
+def _digest(data):
+    settings_key = f"{sorted(settings.AVATAR_SIZES)}:{settings.AVATAR_QUALITY}:{AVATAR_VERSION}"
+    return hashlib.sha256(data + settings_key.encode()).hexdigest()[:20]
+
+
+def _decode(data):
+    """Квадрат со стороной max(AVATAR_SIZES) из исходного файла."""
+    largest = max(settings.AVATAR_SIZES)
+    with Image.open(io.BytesIO(data)) as source:
+        # Для JPEG декодер сразу уменьшает в 2/4/8 раз — 12-мегапиксельное
+        # фото не разворачивается в память целиком
+        source.draft('RGB', (largest * 2, largest * 2))
+        image = ImageOps.exif_transpose(source)
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    return ImageOps.fit(image, (largest, largest), Image.LANCZOS)
+
+
+def _encode(image, extension):
+    pil_format, _ = FORMATS[extension]
+    if pil_format == 'JPEG' and image.mode == 'RGBA':
+        # У JPEG нет прозрачности — кладем на белый фон
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    output = io.BytesIO()
+    if pil_format == 'JPEG':
+        image.save(output, format='JPEG', quality=settings.AVATAR_QUALITY, optimize=True, progressive=True)
+    else:
+        image.save(output, format='WEBP', quality=settings.AVATAR_QUALITY, method=4)
+    return output.getvalue()
+
+
+def build_variants(profile):
+    """
+    Режет аватарку профиля на копии и записывает каталог в profile.avatar_variants.
+    Без аватарки — очищает поле. AvatarError — файл не удалось прочитать как картинку.
+    """
+    if not profile.avatar:
+        profile.avatar_variants = ''
+        return profile
+
+    storage = profile.avatar.storage
+    with profile.avatar.open('rb') as f:
+        data = f.read()
+    directory = f"avatars/{_digest(data)}"
+
+    try:
+        image = _decode(data)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise AvatarError(f"Не удалось обработать изображение: {e}") from e
+
+    # От большей копии к меньшей: каждая уменьшается из предыдущей
+    for size in sorted(settings.AVATAR_SIZES, reverse=True):
+        image = image.resize((size, size), Image.LANCZOS)
+        for extension in FORMATS:
+            name = f"{directory}/{size}.{extension}"
+            if not storage.exists(name):
+                storage.save(name, ContentFile(_encode(image, extension)))
+
+    profile.avatar_variants = directory
+    return profile
+
+
+def process(profile):
+    """Пересобирает копии и сохраняет профиль (только поле avatar_variants)."""
+    build_variants(profile)
+    profile.save(update_fields=['avatar_variants'])
+    return profile
+
+
+def urls(profile, size, retina_size=None):
+    """
+    Адреса копий для <picture>: {'webp', 'jpg'} и, если задан retina_size, {'webp_2x', 'jpg_2x'}.
+    None — копий еще нет (шаблон покажет оригинал).
+    """
+    if not profile.avatar_variants:
+        return None
+    key = profile.avatar_variants.rsplit('/', 1)[-1]
+    result = {}
+    for extension in FORMATS:
+        result[extension] = reverse('avatar_variant', args=[key, f"{size}.{extension}"])
+        if retina_size:
+            result[f"{extension}_2x"] = reverse('avatar_variant', args=[key, f"{retina_size}.{extension}"])
+    return result
+
+
+def variant_path(key, filename):
+    """(путь к файлу копии, MIME-тип) или None, если такой копии быть не может."""
+    match = _VARIANT_FILE_RE.match(filename)
+    directory = f"avatars/{key}"
+    if match is None or int(match.group(1)) not in settings.AVATAR_SIZES or not _VARIANT_DIR_RE.match(directory):
+        return None
+    return default_storage.path(f"{directory}/{filename}"), FORMATS[match.group(2)][1]
+
+
+def reference_name(name):
+    """Для сборщика осиротевших файлов: копия аватарки принадлежит своему каталогу."""
+    directory = name.rsplit('/', 1)[0]
+    return directory if _VARIANT_DIR_RE.match(directory) else name
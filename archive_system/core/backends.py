@@ -0,0 +1,27 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+
+class ProfileBackend(ModelBackend):
+    """
+    ModelBackend, который достает пользователя сессии вместе с профилем
+    (select_related, один JOIN): шапка каждой страницы показывает аватарку,
+    и request.user.profile не должен стоить отдельного запроса.
+    """
+
+    def _users(self):
+        return get_user_model()._default_manager.select_related('profile')
+
+    def get_user(self, user_id):
+        try:
+            user = self._users().get(pk=user_id)
+        except get_user_model().DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        try:
+            user = await self._users().aget(pk=user_id)
+        except get_user_model().DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
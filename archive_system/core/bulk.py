@@ -0,0 +1,241 @@
+import os
+import zipfile
+import zlib
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.db import transaction
+from django.db.models import ProtectedError
+from django.utils import timezone
+
+from . import audit, caching, search
+from .models import Category, Document, StoredBlob, Task, UploadSession
+from .storage import get_document_storage
+
+
+# ==========================================
+# МАССОВЫЕ ОПЕРАЦИИ С ДОКУМЕНТАМИ
+# ==========================================
+# Загрузка папки/архива и удаление/перемещение многих документов:
+# один bulk_create / UPDATE / DELETE в одной транзакции и одна пачка
+# записей в журнал аудита вместо запроса на каждый файл.
+
+# Служебный мусор из архивов macOS/Windows
+_SKIP_NAMES = {'.ds_store', 'thumbs.db', 'desktop.ini'}
+
+
+class BulkError(Exception):
+    pass
+
+
+def _zip_member_name(info):
+    # Архивы из "Проводника" Windows пишут русские имена в cp866 без флага UTF-8,
+    # а zipfile читает их как cp437 — возвращаем правильную кодировку
+    if info.flag_bits & 0x800:
+        return info.filename
+    try:
+        return info.filename.encode('cp437').decode('cp866')
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return info.filename
+
+
+def _is_junk(path):
+    name = os.path.basename(path)
+    return not name or name.lower() in _SKIP_NAMES or name.startswith('._') or '__MACOSX/' in path
+
+
+# Что zipfile бросает на отдельном файле архива: RuntimeError — зашифрован
+# паролем, NotImplementedError — неизвестный метод сжатия, BadZipFile —
+# испорченные данные или не сошлась CRC (проверяется при дочитывании)
+_MEMBER_ERRORS = (RuntimeError, NotImplementedError, zipfile.BadZipFile, EOFError, zlib.error)
+
+
+def _member_error(name, error):
+    if isinstance(error, RuntimeError) and 'encrypted' in str(error):
+        return BulkError(f'Файл «{name}» в архиве защищен паролем')
+    if isinstance(error, NotImplementedError):
+        return BulkError(f'Файл «{name}» сжат неподдерживаемым методом')
+    return BulkError(f'Файл «{name}» в архиве поврежден')
+
+
+class _ZipMember:
+    """Файл из архива для store_files: ошибки распаковки — BulkError с понятным текстом."""
+
+    def __init__(self, name, member):
+        self.name = name
+        self._member = member
+
+    def read(self, size=-1):
+        try:
+            return self._member.read(size)
+        except _MEMBER_ERRORS as e:
+            raise _member_error(self.name, e) from e
+
+
+def iter_zip_files(uploaded):
+    """
+    (имя файла, файловый объект) для каждого файла в ZIP.
+    Архив читается с диска по одному файлу, целиком в память не распаковывается.
+    """
+    try:
+        archive = zipfile.ZipFile(uploaded)
+    except zipfile.BadZipFile:
+        raise BulkError('Файл не похож на ZIP-архив')
+
+    with archive:
+        members = [info for info in archive.infolist() if not info.is_dir()]
+        members = [info for info in members if not _is_junk(_zip_member_name(info))]
+        if len(members) > settings.BULK_ZIP_MAX_MEMBERS:
+            raise BulkError(f'В архиве больше {settings.BULK_ZIP_MAX_MEMBERS} файлов')
+        # Защита от "zip-бомбы": считаем распакованный размер до распаковки
+        if sum(info.file_size for info in members) > settings.BULK_ZIP_MAX_BYTES:
+            raise BulkError('Архив слишком большой после распаковки')
+
+        for info in members:
+            name = os.path.basename(_zip_member_name(info))
+            try:
+                member = archive.open(info)
+            except _MEMBER_ERRORS as e:
+                raise _member_error(name, e) from e
+            with member:
+                yield name, _ZipMember(name, member)
+
+
+def store_files(files):
+    """
+    Кладет файлы в хранилище (потоком, с дедупликацией).
+    files — пары (имя, файловый объект). Возвращает [(имя, имя в хранилище)].
+    """
+    storage = get_document_storage()
+    stored = []
+    for name, fileobj in files:
+        stored.append((name, storage.save(name, File(fileobj, name=name))))
+    return stored
+
+
+# ------------------------------------------
+# 1. СОЗДАНИЕ
+# ------------------------------------------
+
+def create_documents(user, stored, category=None, security_level='public'):
+    """Создает документы для уже сохраненных файлов одним bulk_create. Возвращает список."""
+    docs = []
+    for filename, storage_name in stored:
+        doc = Document(
+            title=os.path.splitext(filename)[0][:200] or filename[:200],
+            category=category,
+            security_level=security_level,
+            file=storage_name,
+            uploaded_by=user,
+        )
+        doc.fill_file_info()
+        docs.append(doc)
+    if not docs:
+        return []
+
+    # bulk_create не вызывает save() и сигналы — то, что делают сигналы
+    # для одного документа, здесь делается пачкой
+    storage = get_document_storage()
+    with transaction.atomic():
+        docs = Document.objects.bulk_create(docs, batch_size=500)
+        search.index_titles(docs)
+        StoredBlob.acquire_many(Counter(doc.file.name for doc in docs), storage)
+        Task.enqueue_many('index_document', docs)
+        Task.enqueue_many('generate_previews', docs)
+
+    caching.bump_version('documents')
+    audit.log_many(user, "Загрузка файла", [doc.title for doc in docs])
+    return docs
+
+
+# ------------------------------------------
+# 2. УДАЛЕНИЕ И ИЗМЕНЕНИЕ
+# ------------------------------------------
+# queryset уже должен быть отфильтрован по правам (access.manageable_documents)
+
+def delete_documents(user, queryset):
+    """Удаляет документы одной транзакцией. Возвращает число удаленных."""
+    with transaction.atomic():
+        titles = list(queryset.values_list('title', flat=True))
+        # Django удаляет пачками (DELETE ... WHERE id IN), вместе со связанными
+        # задачами и ссылками; сигналы снимают документы с индекса и освобождают файлы
+        queryset.delete()
+
+    audit.log_many(user, "Удаление файла", titles)
+    return len(titles)
+
+
+def update_documents(user, queryset, **fields):
+    """Один UPDATE для всех документов (категория, гриф). Возвращает число измененных."""
+    with transaction.atomic():
+        titles = list(queryset.values_list('title', flat=True))
+        queryset.update(**fields)
+
+    # update() не вызывает сигналы — версию кэша списка поднимаем сами
+    caching.bump_version('documents')
+    audit.log_many(user, "Редактирование", titles)
+    return len(titles)
+
+
+# ------------------------------------------
+# 3. УДАЛЕНИЕ КАТЕГОРИИ
+# ------------------------------------------
+# Документы категории либо переносятся (в другую категорию или "без
+# категории") одним UPDATE, либо удаляются фоновой задачей пачками по
+# CATEGORY_DELETE_BATCH_SIZE — каждая пачка в своей короткой транзакции,
+# чтобы не держать базу заблокированной, пока удаляются 100 тысяч документов.
+
+def reassign_category(user, category, target=None):
+    """Переносит документы в target (None — без категории) и удаляет категорию. Возвращает число документов."""
+    with transaction.atomic():
+        count = Document.objects.filter(category=category).update(category=target)
+        UploadSession.objects.filter(category=category).update(category=target)
+        category.delete()
+
+    caching.bump_version('documents')
+    audit.log(user, "Удаление категории", f"{category.name} → {target.name if target else 'без категории'} ({count})")
+    return count
+
+
+def deletion_tasks():
+    """{id категории: задача} для категорий, которые сейчас удаляются вместе с документами."""
+    tasks = Task.objects.filter(name='delete_category', status__in=['pending', 'running'])
+    return {task.payload['category']: task for task in tasks}
+
+
+def start_category_deletion(user, category):
+    """Ставит в очередь удаление категории вместе с документами. Повторный вызов вернет ту же задачу."""
+    task = deletion_tasks().get(category.pk)
+    if task is None:
+        task = Task.enqueue(
+            'delete_category', category=category.pk, user=user.pk,
+            total=Document.objects.filter(category=category).count(), deleted=0,
+        )
+        audit.log(user, "Удаление категории", f"{category.name} (вместе с документами)")
+    return task
+
+
+def delete_category_documents(task):
+    """Обработчик задачи delete_category: удаляет документы пачками, затем саму категорию."""
+    payload = dict(task.payload)
+    category = Category.objects.filter(pk=payload['category']).first()
+    if category is None:
+        return
+    user = User.objects.filter(pk=payload.get('user')).first()
+    batch_size = settings.CATEGORY_DELETE_BATCH_SIZE
+
+    while True:
+        ids = list(Document.objects.filter(category=category).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            try:
+                with transaction.atomic():
+                    category.delete()
+                break
+            except ProtectedError:
+                continue  # пока удаляли, в категорию загрузили еще документ
+
+        payload['deleted'] = payload.get('deleted', 0) + delete_documents(user, Document.objects.filter(pk__in=ids))
+        # Прогресс для страницы категорий; started_at — чтобы долгую задачу не сочли зависшей
+        Task.objects.filter(pk=task.pk).update(payload=payload, started_at=timezone.now())
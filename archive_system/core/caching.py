@@ -0,0 +1,117 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Category, Document
+
+
+# ==========================================
+# КЭШ СТРАНИЦ И ФРАГМЕНТОВ
+# ==========================================
+# Ключи версионные: к ключу приписывается номер версии данных
+# ("categories", "documents"). Изменилась категория или документ —
+# сигнал увеличивает версию, и все старые ключи просто перестают
+# использоваться (сами уйдут по CACHE_FRAGMENT_SECONDS), ничего не
+# нужно искать и удалять.
+#
+# С locmem-кэшем у каждого процесса свой кэш: сигнал увеличит версию
+# только в том процессе, где изменились данные. Поэтому при нескольких
+# процессах веб-сервера (WEB_CONCURRENCY > 1) нужен общий кэш —
+# DOCUGUARD_CACHE_BACKEND=file или redis, иначе не пройдет manage.py check
+# (core/checks.py). Фоновые задачи (run_worker) без общего кэша видны
+# в списке не позже чем через CACHE_FRAGMENT_SECONDS.
+
+
+def get_version(name):
+    key = f"version:{name}"
+    version = cache.get(key)
+    if version is None:
+        # Начинаем с текущего времени (мс), а не с 1: если счетчик вытеснили из
+        # кэша, новая версия не совпадет ни с одной из старых
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key)
+    return version
+
+
+async def aget_version(name):
+    key = f"version:{name}"
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, int(time.time() * 1000), None)
+        version = await cache.aget(key)
+    return version
+
+
+def bump_version(name):
+    try:
+        cache.incr(f"version:{name}")
+    except ValueError:
+        # Счетчика нет — любая новая версия и так "свежая"
+        get_version(name)
+
+
+# ------------------------------------------
+# 1. КАТЕГОРИИ
+# ------------------------------------------
+
+def get_categories():
+    """Все категории (список), из кэша. Меняются редко — несколько раз в неделю."""
+    key = f"categories:list:{get_version('categories')}"
+    categories = cache.get(key)
+    if categories is None:
+        categories = list(Category.objects.all())
+        cache.set(key, categories, settings.CACHE_FRAGMENT_SECONDS)
+    return categories
+
+
+async def aget_categories():
+    key = f"categories:list:{await aget_version('categories')}"
+    categories = await cache.aget(key)
+    if categories is None:
+        categories = [category async for category in Category.objects.all()]
+        await cache.aset(key, categories, settings.CACHE_FRAGMENT_SECONDS)
+    return categories
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, **kwargs):
+    bump_version('categories')
+
+
+# ------------------------------------------
+# 2. СПИСОК ДОКУМЕНТОВ
+# ------------------------------------------
+
+def _table_key(request, access_info, documents_version, categories_version):
+    params = '&'.join(
+        f"{name}={request.GET.get(name, '')}" for name in ('category', 'type', 'sort', 'cursor')
+    )
+    digest = hashlib.md5(params.encode(), usedforsecurity=False).hexdigest()
+    user = request.user
+    return (f"documents:table:{documents_version}:{categories_version}:"
+            f"{user.pk}:{int(user.is_superuser)}:{access_info['clearance']}:{digest}")
+
+
+def document_table_key(request, access_info):
+    """
+    Ключ таблицы документов для набора фильтров.
+    В таблице есть кнопки "своих" документов и документы по допуску,
+    поэтому в ключ входят пользователь и его допуск. От категорий таблица
+    тоже зависит (фильтр по категории), поэтому в ключе и их версия.
+    """
+    return _table_key(request, access_info, get_version('documents'), get_version('categories'))
+
+
+async def adocument_table_key(request, access_info):
+    return _table_key(request, access_info, await aget_version('documents'), await aget_version('categories'))
+
+
+@receiver(post_save, sender=Document)
+@receiver(post_delete, sender=Document)
+def document_changed(sender, **kwargs):
+    bump_version('documents')
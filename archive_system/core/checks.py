@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+
+# ==========================================
+# ПРОВЕРКИ НАСТРОЕК (python manage.py check)
+# ==========================================
+
+LOCMEM_CACHE = 'django.core.cache.backends.locmem.LocMemCache'
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    # Кэш прав доступа и таблиц документов сбрасывается сигналами только в том
+    # процессе, где поменялись данные: с кэшем в памяти остальные процессы
+    # показывали бы документы по старому допуску до ACCESS_CACHE_SECONDS
+    backend = settings.CACHES['default']['BACKEND']
+    if settings.WEB_CONCURRENCY > 1 and backend == LOCMEM_CACHE:
+        return [Error(
+            f'WEB_CONCURRENCY={settings.WEB_CONCURRENCY}, а кэш — в памяти процесса',
+            hint='Нужен общий кэш: DOCUGUARD_CACHE_BACKEND=file (один сервер) или redis (несколько серверов)',
+            id='core.E001',
+        )]
+    return []
@@ -0,0 +1,422 @@
+import asyncio
+import hashlib
+import mimetypes
+import os
+import uuid
+import zipfile
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.encoding import escape_uri_path
+from django.utils.http import http_date, parse_http_date_safe
+
+from . import tiering
+
+
+# ==========================================
+# ОТДАЧА ФАЙЛОВ: ETag, 304, Range (206)
+# ==========================================
+# Браузер получает валидаторы (ETag + Last-Modified) и при повторном
+# открытии получает 304 без тела. PDF-просмотрщик может докачивать
+# файл кусками через Range, не скачивая сотни мегабайт целиком.
+#
+# Сами байты может отдавать не Django, а веб-сервер перед ним
+# (DOCUMENT_DELIVERY_BACKEND):
+#   'python'   — читаем файл в воркере (по умолчанию, для runserver);
+#   'nginx'    — X-Accel-Redirect на internal-location, например:
+#                    location /protected-media/ { internal; alias /path/to/media/; }
+#   'sendfile' — X-Sendfile (Apache mod_xsendfile, lighttpd).
+#
+# Под ASGI (uvicorn) файл читается асинхронно (aserve_document): каждый
+# кусок — в потоке, а пока медленный клиент принимает байты, поток не
+# занят и воркер держит тысячи одновременных скачиваний.
+# Права доступа и Content-Disposition всегда проверяет/формирует Django.
+
+CHUNK_SIZE = 64 * 1024
+
+
+def file_validators(path):
+    """
+    Возвращает (etag, last_modified, size) по метаданным файла на диске.
+    ETag сильный: меняется при любом изменении размера или времени записи.
+    """
+    try:
+        stat = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404("Файл не найден")
+
+    fingerprint = f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode()
+    etag = f'"{hashlib.sha1(fingerprint).hexdigest()[:20]}"'
+    return etag, int(stat.st_mtime), stat.st_size
+
+
+def parse_range_header(header, size):
+    """
+    Разбирает заголовок Range.
+    Возвращает список (start, end) включительно, [] если ни один диапазон
+    не попадает в файл (-> 416), или None если заголовок надо проигнорировать.
+    """
+    if not header or not header.startswith('bytes=') or size == 0:
+        return None
+
+    ranges = []
+    for spec in header[len('bytes='):].split(','):
+        spec = spec.strip()
+        start, sep, end = spec.partition('-')
+        if not sep:
+            return None
+        try:
+            if start:
+                start = int(start)
+                end = int(end) if end else None
+                if end is not None and end < start:
+                    return None
+                if start >= size:
+                    continue
+                ranges.append((start, size - 1 if end is None else min(end, size - 1)))
+            else:
+                # "-500" — последние 500 байт
+                suffix = int(end)
+                if suffix > 0:
+                    ranges.append((max(0, size - suffix), size - 1))
+        except ValueError:
+            return None
+
+    # Склеиваем пересекающиеся и соседние куски, чтобы "bytes=0-0,0-0,..."
+    # не превращался в ответ в тысячу раз больше файла
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+
+    if len(merged) > settings.DOCUMENT_MAX_RANGES:
+        return None
+    return merged
+
+
+def _if_range_matches(request, etag, last_modified):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def _read_range(path, start, end):
+    # Файл открывается лениво и закрывается, когда ответ дочитан или клиент отвалился
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _multipart_parts(ranges, size, content_type, boundary):
+    for start, end in ranges:
+        header = (
+            f"--{boundary}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+        ).encode()
+        yield header, start, end
+
+
+def _stream_multipart(path, ranges, size, content_type, boundary):
+    for header, start, end in _multipart_parts(ranges, size, content_type, boundary):
+        yield header
+        yield from _read_range(path, start, end)
+        yield b"\r\n"
+    yield f"--{boundary}--\r\n".encode()
+
+
+async def _aread_range(path, start, end):
+    # Как _read_range, но event loop не ждет диск: open/read — в потоке
+    f = await asyncio.to_thread(open, path, 'rb')
+    try:
+        await asyncio.to_thread(f.seek, start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await asyncio.to_thread(f.read, min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+async def _astream_multipart(path, ranges, size, content_type, boundary):
+    for header, start, end in _multipart_parts(ranges, size, content_type, boundary):
+        yield header
+        async for chunk in _aread_range(path, start, end):
+            yield chunk
+        yield b"\r\n"
+    yield f"--{boundary}--\r\n".encode()
+
+
+def cache_control_for(doc):
+    """Политика кэширования зависит от грифа документа (см. DOCUMENT_CACHE_CONTROL)."""
+    policies = settings.DOCUMENT_CACHE_CONTROL
+    return policies.get(doc.security_level, policies['secret'])
+
+
+def serve_file(request, path, content_type, content_disposition, cache_control,
+               validators=None, async_body=False):
+    """
+    Ответ с файлом: 304, 416, 206 (один или несколько диапазонов) или 200.
+    validators — готовый результат file_validators(path);
+    async_body — тело асинхронным генератором (для ASGI, см. aserve_document).
+    """
+    etag, last_modified, size = validators or file_validators(path)
+    read_range = _aread_range if async_body else _read_range
+    stream_multipart = _astream_multipart if async_body else _stream_multipart
+
+    def with_headers(response):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        response['Cache-Control'] = cache_control
+        response['Accept-Ranges'] = 'bytes'
+        if content_disposition:
+            response['Content-Disposition'] = content_disposition
+        return response
+
+    # 1. If-None-Match / If-Modified-Since -> 304 (и If-Match -> 412).
+    # Если условие не сработало, Django возвращает переданную заготовку как есть
+    stub = with_headers(HttpResponse())
+    conditional = get_conditional_response(request, etag=etag, last_modified=last_modified, response=stub)
+    if conditional is not stub:
+        return conditional
+
+    # 2. Range-запрос
+    ranges = None
+    if request.method in ('GET', 'HEAD') and _if_range_matches(request, etag, last_modified):
+        ranges = parse_range_header(request.META.get('HTTP_RANGE'), size)
+
+    if ranges == []:
+        response = with_headers(HttpResponse(status=416))
+        response['Content-Range'] = f"bytes */{size}"
+        return response
+
+    if ranges and len(ranges) == 1:
+        start, end = ranges[0]
+        body = read_range(path, start, end) if request.method != 'HEAD' else []
+        response = with_headers(StreamingHttpResponse(body, status=206, content_type=content_type))
+        response['Content-Range'] = f"bytes {start}-{end}/{size}"
+        response['Content-Length'] = str(end - start + 1)
+        return response
+
+    if ranges:
+        boundary = uuid.uuid4().hex
+        length = sum(
+            len(header) + (end - start + 1) + 2
+            for header, start, end in _multipart_parts(ranges, size, content_type, boundary)
+        ) + len(f"--{boundary}--\r\n")
+        body = stream_multipart(path, ranges, size, content_type, boundary) if request.method != 'HEAD' else []
+        response = with_headers(StreamingHttpResponse(
+            body, status=206, content_type=f"multipart/byteranges; boundary={boundary}",
+        ))
+        response['Content-Length'] = str(length)
+        return response
+
+    # 3. Обычная отдача целиком
+    if request.method == 'HEAD':
+        response = with_headers(HttpResponse(content_type=content_type))
+    elif async_body:
+        response = with_headers(StreamingHttpResponse(read_range(path, 0, size - 1), content_type=content_type))
+    else:
+        response = with_headers(FileResponse(open(path, 'rb'), content_type=content_type))
+    response['Content-Length'] = str(size)
+    return response
+
+
+def _offload_response(content_type, content_disposition, cache_control, header, value):
+    # Тело пустое: файл, Range и 304 обслуживает веб-сервер по заголовку
+    response = HttpResponse(content_type=content_type)
+    response[header] = value
+    response['Cache-Control'] = cache_control
+    if content_disposition:
+        response['Content-Disposition'] = content_disposition
+    return response
+
+
+def _media_relative_path(path):
+    # None — файл лежит вне MEDIA_ROOT, его веб-сервер не увидит
+    relative = os.path.relpath(os.path.abspath(path), os.path.abspath(settings.MEDIA_ROOT))
+    if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+        return None
+    return relative.replace(os.sep, '/')
+
+
+def _serve_accel_redirect(request, path, content_type, content_disposition, cache_control):
+    relative = _media_relative_path(path)
+    if relative is None:
+        return serve_file(request, path, content_type, content_disposition, cache_control)
+    location = settings.DOCUMENT_ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + quote(relative)
+    return _offload_response(content_type, content_disposition, cache_control, 'X-Accel-Redirect', location)
+
+
+def _serve_sendfile(request, path, content_type, content_disposition, cache_control):
+    # mod_xsendfile сам раскодирует %XX (XSendFileUnescape), а заголовок обязан быть latin-1
+    location = quote(os.path.abspath(path))
+    return _offload_response(content_type, content_disposition, cache_control, 'X-Sendfile', location)
+
+
+DELIVERY_BACKENDS = {
+    'python': serve_file,
+    'nginx': _serve_accel_redirect,
+    'sendfile': _serve_sendfile,
+}
+
+
+def serve_document(request, doc, content_disposition):
+    """Отдает файл документа с валидаторами, Range и политикой кэша по грифу."""
+    # Файл из холодного хранилища сначала возвращается на локальный диск
+    path = tiering.hot_path(doc)
+    if not os.path.isfile(path):
+        raise Http404("Файл не найден")
+
+    content_type, _ = mimetypes.guess_type(path)
+    backend = DELIVERY_BACKENDS[settings.DOCUMENT_DELIVERY_BACKEND]
+    return backend(
+        request, path,
+        content_type=content_type or 'application/octet-stream',
+        content_disposition=content_disposition,
+        cache_control=cache_control_for(doc),
+    )
+
+
+async def aserve_document(request, doc, content_disposition):
+    """
+    serve_document для асинхронных представлений.
+    Под ASGI файл читается кусками в потоках и не занимает поток, пока
+    клиент качает; под WSGI (runserver, gunicorn) — обычный serve_document.
+    """
+    if settings.DOCUMENT_DELIVERY_BACKEND != 'python' or not isinstance(request, ASGIRequest):
+        # Файл не читаем вовсе (отдаст веб-сервер) или запрос все равно
+        # занимает свой поток до конца — обычная отдача в потоке запроса
+        return await sync_to_async(serve_document)(request, doc, content_disposition)
+
+    # Возврат из холодного хранилища и отметка об обращении пишут в базу — в потоке запроса
+    path = await sync_to_async(tiering.hot_path)(doc)
+    if not await asyncio.to_thread(os.path.isfile, path):
+        raise Http404("Файл не найден")
+    validators = await asyncio.to_thread(file_validators, path)
+
+    content_type, _ = mimetypes.guess_type(path)
+    return serve_file(
+        request, path,
+        content_type=content_type or 'application/octet-stream',
+        content_disposition=content_disposition,
+        cache_control=cache_control_for(doc),
+        validators=validators,
+        async_body=True,
+    )
+
+
+# ==========================================
+# ZIP НА ЛЕТУ (скачать все найденные документы)
+# ==========================================
+# Архив собирается прямо в ответ: zipfile пишет в буфер, буфер
+# отдается клиенту после каждого куска и очищается. В памяти — один
+# кусок, а не весь архив; временных файлов нет. Уже сжатые форматы
+# (PDF, картинки, DOCX/XLSX — это тоже ZIP) кладутся без сжатия.
+
+STORED_EXTENSIONS = {
+    '.pdf', '.docx', '.xlsx', '.pptx', '.odt', '.ods',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp',
+    '.zip', '.rar', '.7z', '.gz',
+}
+
+
+class _ZipStreamBuffer:
+    # "Файл" только для записи и без seek: zipfile тогда пишет размеры
+    # после данных (data descriptor) и не возвращается назад
+    def __init__(self):
+        self._chunks = []
+        self._size = 0
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._size += len(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def pending(self):
+        return self._size
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        self._size = 0
+        return data
+
+
+def download_filename(doc):
+    """Имя файла для пользователя: "Название документа" + расширение файла."""
+    return f"{doc.title}{os.path.splitext(doc.file.name)[1]}"
+
+
+def _unique_arcname(name, used):
+    # В архиве не может быть "/" в имени и двух одинаковых имен
+    name = name.replace('/', '_').replace('\\', '_').strip() or 'document'
+    base, ext = os.path.splitext(name)
+    candidate, n = name, 1
+    while candidate.lower() in used:
+        n += 1
+        candidate = f"{base} ({n}){ext}"
+    used.add(candidate.lower())
+    return candidate
+
+
+def _zip_chunks(docs):
+    buffer = _ZipStreamBuffer()
+    used = set()
+    with zipfile.ZipFile(buffer, mode='w') as archive:
+        for doc in docs:
+            # Файлы из холодного хранилища — через временную копию, на диск не возвращаем
+            with tiering.readable_path(doc) as path:
+                if path is None:
+                    continue  # файл пропал — архив не обрываем
+
+                info = zipfile.ZipInfo.from_file(path, _unique_arcname(download_filename(doc), used))
+                info.compress_type = (zipfile.ZIP_STORED if doc.extension in STORED_EXTENSIONS
+                                      else zipfile.ZIP_DEFLATED)
+                with open(path, 'rb') as src, archive.open(info, 'w') as dst:
+                    for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+                        dst.write(chunk)
+                        if buffer.pending() >= CHUNK_SIZE:
+                            yield buffer.drain()
+            yield buffer.drain()
+    # Оглавление архива (central directory) пишется при закрытии
+    yield buffer.drain()
+
+
+def serve_zip(docs, filename):
+    """Потоковый ZIP из документов (итератор моделей Document)."""
+    response = StreamingHttpResponse(
+        (chunk for chunk in _zip_chunks(docs) if chunk),
+        content_type='application/zip',
+    )
+    response['Content-Disposition'] = f"attachment; filename*=UTF-8''{escape_uri_path(filename)}"
+    # Архив собирается под пользователя и его фильтры — не кэшируем
+    response['Cache-Control'] = 'private, no-store'
+    return response
@@ -1,5 +1,8 @@
+import re
+
 from django import forms
-from .models import Document, Profile
+from django.conf import settings
+from .models import Category, Document, Profile, UploadSession
 
 
 class DocumentForm(forms.ModelForm):
@@ -25,4 +28,76 @@ class DocumentForm(forms.ModelForm):
 class ProfileForm(forms.ModelForm):
     class Meta:
         model = Profile
-        fields = ['avatar']
\ No newline at end of file
+        fields = ['avatar']
+
+    def clean_avatar(self):
+        avatar = self.cleaned_data.get('avatar')
+        if avatar and avatar.size > settings.AVATAR_MAX_UPLOAD_BYTES:
+            raise forms.ValidationError('Файл слишком большой для аватарки.')
+        return avatar
+
+# 👇 Начало докачиваемой загрузки (сам файл придет кусками)
+class UploadSessionForm(forms.ModelForm):
+    class Meta:
+        model = UploadSession
+        fields = ['title', 'category', 'security_level', 'filename', 'size', 'sha256']
+
+    def clean_size(self):
+        size = self.cleaned_data['size']
+        if size <= 0:
+            raise forms.ValidationError('Пустой файл.')
+        if size > settings.UPLOAD_MAX_BYTES:
+            raise forms.ValidationError('Файл слишком большой.')
+        return size
+
+    def clean_sha256(self):
+        value = self.cleaned_data['sha256'].lower()
+        if value and not re.fullmatch(r'[0-9a-f]{64}', value):
+            raise forms.ValidationError('Некорректный SHA-256.')
+        return value
+
+# 👇 Массовая загрузка: общие для всех файлов категория и гриф
+class BulkUploadForm(forms.Form):
+    category = forms.ModelChoiceField(queryset=Category.objects.all(), required=False)
+    security_level = forms.ChoiceField(choices=Document.SECURITY_CHOICES, initial='public')
+
+# 👇 Действие над отмеченными документами
+class BulkActionForm(forms.Form):
+    ACTION_CHOICES = [
+        ('delete', 'Удалить'),
+        ('move', 'Переместить в категорию'),
+        ('security', 'Сменить гриф'),
+    ]
+
+    action = forms.ChoiceField(choices=ACTION_CHOICES)
+    ids = forms.TypedMultipleChoiceField(coerce=int)
+    category = forms.ModelChoiceField(queryset=Category.objects.all(), required=False)
+    security_level = forms.ChoiceField(choices=Document.SECURITY_CHOICES, required=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # id приходят из отмеченных строк — любые числа, права проверяет представление
+        self.fields['ids'].choices = [(value, value) for value in self.data.getlist('ids')]
+
+    def clean(self):
+        cleaned = super().clean()
+        if cleaned.get('action') == 'security' and not cleaned.get('security_level'):
+            self.add_error('security_level', 'Выберите гриф.')
+        return cleaned
+
+# 👇 Что делать с документами удаляемой категории
+class CategoryDeleteForm(forms.Form):
+    MODE_CHOICES = [
+        ('reassign', 'Перенести документы в другую категорию'),
+        ('null', 'Оставить документы без категории'),
+        ('delete', 'Удалить вместе с документами'),
+    ]
+
+    mode = forms.ChoiceField(choices=MODE_CHOICES)
+    target = forms.ModelChoiceField(queryset=Category.objects.all(), required=False)
+
+    def clean(self):
+        cleaned = super().clean()
+        if cleaned.get('mode') == 'reassign' and not cleaned.get('target'):
+            self.add_error('target', 'Выберите категорию, куда перенести документы.')
+        return cleaned
@@ -0,0 +1,231 @@
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+
+from core import audit, bulk
+from core.models import AuditLog, Document
+
+
+# Нагрузочный тест базы: несколько процессов (как воркеры gunicorn)
+# одновременно загружают документы, меняют их (bulk.update_documents —
+# чтение и запись в одной транзакции) и пишут пачки журнала аудита
+# (как фоновый сброс audit.py), а отдельные процессы читают список
+# документов. Сначала замер с одним пишущим процессом, потом с
+# --writers: по соотношению видно, как писатели делят базу, а по
+# "ошибок блокировки" — получают ли они "database is locked".
+#
+# Замер создает тысячи записей и нагружает базу, поэтому по умолчанию идет
+# на отдельной базе: --test-db — путь к файлу SQLite (создается миграциями)
+# или имя заранее созданной базы Postgres. На рабочую базу из настроек —
+# только явно, с --allow-production.
+#
+# Сравнить с настройками SQLite по умолчанию:
+#   DOCUGUARD_SQLITE_TUNING=0 python manage.py benchmark_db --test-db /tmp/bench.sqlite3
+#   python manage.py benchmark_db --test-db /tmp/bench.sqlite3
+# Все созданные записи и файлы после замера удаляются.
+
+WRITE_OPERATIONS = ('upload', 'edit', 'audit')
+AUDIT_BATCH = 50
+START_DELAY = 3  # секунд на запуск процессов — замер у всех начинается одновременно
+# Метка для процессов, запущенных с --test-db: их база из настроек — отдельная
+TEST_DB_ENV = 'DOCUGUARD_BENCHMARK_DB'
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def _ms(value):
+    return '—' if value is None else f'{value * 1000:.1f} мс'
+
+
+class _Worker:
+    """Один процесс замера: крутит свои операции до deadline."""
+
+    def __init__(self, prefix, user, writer):
+        self.prefix = prefix
+        self.user = user
+        self.operations = WRITE_OPERATIONS if writer else ('read',)
+        self.latencies = {name: [] for name in (*WRITE_OPERATIONS, 'read')}
+        self.locked = 0
+        self.docs = []
+        self.counter = 0
+
+    def run(self, start_at, deadline):
+        time.sleep(max(0, start_at - time.time()))
+        while time.time() < deadline:
+            name = self.operations[self.counter % len(self.operations)]
+            self.counter += 1
+            started = time.monotonic()
+            try:
+                getattr(self, name)()
+            except OperationalError as e:
+                if 'locked' not in str(e) and 'busy' not in str(e):
+                    raise
+                self.locked += 1
+                continue
+            self.latencies[name].append(time.monotonic() - started)
+        return {'latencies': self.latencies, 'locked': self.locked}
+
+    def upload(self):
+        # Содержимое уникальное — иначе дедупликация сведет все к одному файлу
+        name = f'{self.prefix}-{uuid.uuid4().hex}.txt'
+        stored = bulk.store_files([(name, io.BytesIO(name.encode()))])
+        self.docs.extend(bulk.create_documents(self.user, stored))
+
+    def edit(self):
+        if not self.docs:
+            return self.upload()
+        doc = self.docs[self.counter % len(self.docs)]
+        bulk.update_documents(self.user, Document.objects.filter(pk=doc.pk), title=f'{self.prefix}-{self.counter}')
+
+    def audit(self):
+        AuditLog.objects.bulk_create([
+            AuditLog(user=self.user, action='Редактирование', document_title=f'{self.prefix}-audit')
+            for _ in range(AUDIT_BATCH)
+        ])
+
+    def read(self):
+        list(Document.objects.select_related('uploaded_by', 'category').order_by('-uploaded_at', '-id')[:50])
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный тест базы: параллельные загрузки, правки и запись аудита плюс чтение списка'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8,
+                            help='Сколько процессов пишут одновременно')
+        parser.add_argument('--readers', type=int, default=2,
+                            help='Сколько процессов все это время читают список документов')
+        parser.add_argument('--duration', type=float, default=10,
+                            help='Длительность каждого замера, секунд')
+        parser.add_argument('--test-db', metavar='NAME',
+                            help='Отдельная база для замера: путь к файлу SQLite или имя базы Postgres')
+        parser.add_argument('--allow-production', action='store_true',
+                            help='Разрешить замер на базе из настроек (рабочей)')
+        # Служебное: так команда запускает сама себя в процессах-участниках
+        parser.add_argument('--worker', choices=['writer', 'reader'], help='(служебный)')
+        parser.add_argument('--prefix', help='(служебный)')
+        parser.add_argument('--start-at', type=float, help='(служебный)')
+
+    def handle(self, *args, **options):
+        if options['worker']:
+            return self._worker(options)
+        if options['test_db']:
+            return self._run_on_test_db(options)
+        if not options['allow_production'] and os.environ.get(TEST_DB_ENV) != '1':
+            raise CommandError(
+                'Замер пишет в базу тысячи записей и нагружает ее. Укажите отдельную базу '
+                '(--test-db <файл SQLite или имя базы Postgres>) или --allow-production'
+            )
+
+        self._describe_database()
+        prefix = f'benchmark-db-{uuid.uuid4().hex[:8]}'
+        User.objects.create(username=prefix)
+        try:
+            single = self._run(prefix, 1, options['readers'], options['duration'])
+            parallel = self._run(prefix, options['writers'], options['readers'], options['duration'])
+        finally:
+            self._cleanup(prefix)
+
+        if single['writes']:
+            speedup = parallel['writes'] / single['writes']
+            self.stdout.write(self.style.SUCCESS(
+                f"\nЗаписей в секунду: {options['writers']} процессов / 1 процесс = {speedup:.2f}x"
+            ))
+
+    def _run_on_test_db(self, options):
+        # Та же команда в новом процессе, но база из настроек подменена на --test-db
+        variable = 'DOCUGUARD_PG_NAME' if connection.vendor == 'postgresql' else 'DOCUGUARD_SQLITE_PATH'
+        env = {**os.environ, variable: options['test_db'], TEST_DB_ENV: '1'}
+        manage = [sys.executable, sys.argv[0]]
+        subprocess.run([*manage, 'migrate', '--noinput', '-v', '0'], cwd=settings.BASE_DIR, env=env, check=True)
+        result = subprocess.run(
+            [*manage, 'benchmark_db', '--writers', str(options['writers']),
+             '--readers', str(options['readers']), '--duration', str(options['duration'])],
+            cwd=settings.BASE_DIR, env=env, stdout=subprocess.PIPE, text=True,
+        )
+        self.stdout.write(result.stdout, ending='')
+        if result.returncode != 0:
+            raise CommandError(f'Замер на {options["test_db"]} завершился с кодом {result.returncode}')
+
+    def _worker(self, options):
+        user = User.objects.get(username=options['prefix'])
+        worker = _Worker(options['prefix'], user, writer=options['worker'] == 'writer')
+        result = worker.run(options['start_at'], options['start_at'] + options['duration'])
+        self.stdout.write(json.dumps(result))
+
+    def _describe_database(self):
+        db = settings.DATABASES['default']
+        line = f"База: {connection.vendor}, CONN_MAX_AGE={db.get('CONN_MAX_AGE', 0)}"
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                pragmas = {
+                    name: cursor.execute(f'PRAGMA {name}').fetchone()[0]
+                    for name in ('journal_mode', 'synchronous', 'busy_timeout')
+                }
+            line += (f", journal_mode={pragmas['journal_mode']}, synchronous={pragmas['synchronous']}, "
+                     f"busy_timeout={pragmas['busy_timeout']} мс, "
+                     f"transaction_mode={db['OPTIONS'].get('transaction_mode') or 'DEFERRED'}")
+        elif db['OPTIONS'].get('pool'):
+            line += f", пул соединений {db['OPTIONS']['pool']}"
+        self.stdout.write(line)
+
+    def _run(self, prefix, writers, readers, duration):
+        # Каждый участник — отдельный процесс со своим соединением, как воркеры веб-сервера
+        connections.close_all()
+        start_at = time.time() + START_DELAY
+        roles = ['writer'] * writers + ['reader'] * readers
+        processes = [
+            subprocess.Popen(
+                [sys.executable, sys.argv[0], 'benchmark_db', '--worker', role, '--prefix', prefix,
+                 '--start-at', str(start_at), '--duration', str(duration)],
+                cwd=settings.BASE_DIR, stdout=subprocess.PIPE, text=True,
+            )
+            for role in roles
+        ]
+        results = []
+        for process in processes:
+            output, _ = process.communicate()
+            if process.returncode != 0:
+                raise CommandError(f'Процесс замера завершился с кодом {process.returncode}')
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f'\nПишущих процессов: {writers}, читающих: {readers}'))
+        writes = 0
+        for name in (*WRITE_OPERATIONS, 'read'):
+            latencies = [value for result in results for value in result['latencies'][name]]
+            if name != 'read':
+                writes += len(latencies) / duration
+            self.stdout.write(
+                f"  {name:<7} {len(latencies):>6} операций ({len(latencies) / duration:.0f}/с), "
+                f"p50 {_ms(_percentile(latencies, 0.5))}, p95 {_ms(_percentile(latencies, 0.95))}, "
+                f"max {_ms(max(latencies) if latencies else None)}"
+            )
+        locked = sum(result['locked'] for result in results)
+        style = self.style.ERROR if locked else self.style.SUCCESS
+        self.stdout.write(style(f'  ошибок блокировки ("database is locked"): {locked}'))
+        return {'writes': writes}
+
+    def _cleanup(self, prefix):
+        # Документы удаляются пачками через bulk — вместе с файлами, задачами и индексом
+        user = User.objects.get(username=prefix)
+        docs = Document.objects.filter(uploaded_by=user)
+        while docs.exists():
+            bulk.delete_documents(None, Document.objects.filter(pk__in=list(docs.values_list('pk', flat=True)[:500])))
+        # Загрузки, правки и удаления попали в журнал аудита — сбрасываем его и убираем записи замера
+        audit.flush()
+        AuditLog.objects.filter(document_title__startswith=prefix).delete()
+        user.delete()
@@ -1,17 +1,40 @@
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from django.utils import timezone
 from datetime import timedelta
-from core.models import AuditLog
+from core.retention import purge_audit_log
 
 
 class Command(BaseCommand):
-    help = 'Удаляет записи журнала старше 2 часов'
+    help = 'Удаляет записи журнала старше срока хранения (AUDIT_RETENTION_DAYS)'
 
-    def handle(self, *args, **kwargs):
-        # Вычисляем время: "сейчас минус 2 часа"
-        time_threshold = timezone.now() - timedelta(hours=2)
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=None,
+                            help='Срок хранения в днях (по умолчанию AUDIT_RETENTION_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Сколько записей удалять за одну транзакцию')
+        parser.add_argument('--archive-dir', default=None,
+                            help='Сохранить удаляемые записи в gzip-архивы по месяцам (по умолчанию AUDIT_ARCHIVE_DIR)')
+        parser.add_argument('--no-archive', action='store_true',
+                            help='Не архивировать, даже если задан AUDIT_ARCHIVE_DIR')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только посчитать, сколько записей будет удалено')
 
-        # Удаляем все записи, которые были созданы РАНЬШЕ этого времени
-        deleted_count, _ = AuditLog.objects.filter(timestamp__lt=time_threshold).delete()
+    def handle(self, *args, **options):
+        days = options['days'] if options['days'] is not None else settings.AUDIT_RETENTION_DAYS
+        archive_dir = None if options['no_archive'] else (options['archive_dir'] or settings.AUDIT_ARCHIVE_DIR)
 
-        self.stdout.write(self.style.SUCCESS(f'Очистка завершена. Удалено записей: {deleted_count}'))
\ No newline at end of file
+        stats = purge_audit_log(
+            older_than=timedelta(days=days),
+            batch_size=options['batch_size'],
+            archive_dir=archive_dir,
+            dry_run=options['dry_run'],
+        )
+
+        if options['dry_run']:
+            self.stdout.write(f'Будет удалено записей старше {days:g} дн.: {stats["deleted"]}')
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Очистка завершена. Удалено записей: {stats["deleted"]} '
+            f'(в архив: {stats["archived"]}, пачек: {stats["batches"]}, за {stats["seconds"]:.2f} с)'
+        ))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from core.orphans import collect_orphans
+
+
+class Command(BaseCommand):
+    help = 'Находит файлы в MEDIA_ROOT, на которые не ссылается база, и убирает их (удаление или карантин)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только посчитать, сколько места освободится')
+        parser.add_argument('--action', choices=['delete', 'quarantine'], default=None,
+                            help='Удалить сразу или перенести в карантин (по умолчанию ORPHAN_ACTION)')
+        parser.add_argument('--grace-hours', type=float, default=None,
+                            help='Не трогать файлы моложе стольких часов (по умолчанию ORPHAN_GRACE_HOURS)')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Сколько файлов перепроверять в базе одним запросом')
+
+    def handle(self, *args, **options):
+        stats = collect_orphans(
+            dry_run=options['dry_run'],
+            action=options['action'],
+            grace_hours=options['grace_hours'],
+            batch_size=options['batch_size'],
+        )
+
+        self.stdout.write(f'Просмотрено файлов: {stats["scanned"]}, без ссылок: {stats["orphans"]} '
+                          f'({stats["bytes"] / 1024 / 1024:.1f} МБ)')
+        for directory, size in sorted(stats['by_dir'].items()):
+            self.stdout.write(f'  {directory}/: {size / 1024 / 1024:.1f} МБ')
+        if options['dry_run']:
+            self.stdout.write('Пробный запуск — ничего не удалено')
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово. Убрано файлов: {stats["removed"]} за {stats["seconds"]:.1f} с'
+        ))
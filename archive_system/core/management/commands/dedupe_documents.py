@@ -0,0 +1,76 @@
+import os
+import shutil
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from core.models import Document, StoredBlob
+from core.storage import BLOB_PREFIX, blob_name, get_document_storage, hash_file
+
+
+class Command(BaseCommand):
+    help = 'Переносит старые файлы документов в хранилище по хэшу и удаляет дубликаты'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только посчитать, сколько места освободится')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        storage = get_document_storage()
+
+        moved = duplicates = missing = 0
+        reclaimed = 0
+        seen = set()  # для --dry-run: хэши, которые уже "перенесли" в этом прогоне
+
+        # Имена файлов, а не документы: несколько строк могут ссылаться на один файл
+        old_names = (Document.objects
+                     .exclude(file__startswith=BLOB_PREFIX)
+                     .order_by('file')
+                     .values_list('file', flat=True)
+                     .distinct()
+                     .iterator(chunk_size=500))
+
+        for old_name in old_names:
+            old_path = storage.path(old_name)
+            if not os.path.exists(old_path):
+                missing += 1
+                self.stdout.write(self.style.WARNING(f'Нет файла: {old_name}'))
+                continue
+
+            size = os.path.getsize(old_path)
+            with open(old_path, 'rb') as f:
+                digest = hash_file(f)
+            new_name = blob_name(digest, os.path.splitext(old_name)[1].lower())
+            new_path = storage.path(new_name)
+            is_duplicate = new_name in seen or os.path.exists(new_path)
+            seen.add(new_name)
+
+            if is_duplicate:
+                duplicates += 1
+                reclaimed += size
+            else:
+                moved += 1
+            if dry_run:
+                continue
+
+            # 1. Сначала blob появляется на новом месте (жесткая ссылка, иначе копия)...
+            if not is_duplicate:
+                os.makedirs(os.path.dirname(new_path), exist_ok=True)
+                try:
+                    os.link(old_path, new_path)
+                except OSError:
+                    shutil.copy2(old_path, new_path)
+
+            # 2. ...потом документы переключаются на него...
+            with transaction.atomic():
+                count = Document.objects.filter(file=old_name).update(file=new_name)
+                StoredBlob.acquire(new_name, storage, count)
+
+            # 3. ...и только после коммита удаляется старый файл
+            os.remove(old_path)
+
+        prefix = 'Можно освободить' if dry_run else 'Освобождено'
+        self.stdout.write(self.style.SUCCESS(
+            f'Перенесено файлов: {moved}, дубликатов: {duplicates}, не найдено: {missing}. '
+            f'{prefix}: {reclaimed / 1024 / 1024:.1f} МБ'
+        ))
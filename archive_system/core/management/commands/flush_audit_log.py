@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from core import audit
+
+
+class Command(BaseCommand):
+    help = 'Переносит в базу записи аудита, оставшиеся в файлах-журналах упавших процессов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Забрать все журналы, даже недавно обновлявшиеся '
+                                 '(только при остановленном приложении!)')
+
+    def handle(self, *args, **options):
+        recovered = audit.writer.recover(force=options['force'])
+        self.stdout.write(self.style.SUCCESS(f'✅ Перенесено записей аудита: {recovered}'))
@@ -0,0 +1,248 @@
+import asyncio
+import shutil
+import socket
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Document, ShareLink
+
+
+# Нагрузочный тест "много медленных скачиваний": N клиентов одновременно
+# качают документ по публичным ссылкам со скоростью --rate байт/с (как
+# браузеры на плохом канале), а отдельный зонд раз в полсекунды
+# открывает страницу входа. Для каждого сервера печатается, сколько
+# клиентов вообще получили ответ, за сколько, и как долго отвечала
+# страница входа, пока идут скачивания. У каждого клиента своя ссылка
+# без срока и лимита (частота ограничивается на ссылку, SHARE_LINK_RATE);
+# после замера ссылки удаляются.
+#
+# Серверы можно запустить самому и передать --wsgi-url / --asgi-url,
+# или дать команде поднять их на этой же машине (--spawn):
+#   gunicorn, 1 воркер с --wsgi-threads потоками  — archive_system.wsgi
+#   uvicorn, 1 воркер                           — archive_system.asgi
+# (pip install gunicorn uvicorn). Честное сравнение — только с
+# DOCUMENT_DELIVERY_BACKEND = 'python': иначе байты отдает nginx.
+
+PROBE_PATH = '/login/'
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def _ms(value):
+    return '—' if value is None else f'{value * 1000:.0f} мс'
+
+
+async def _request(host, port, path, rcvbuf=None, limit=64 * 1024):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if rcvbuf:
+        # Маленький буфер приема: медленный клиент быстро "упирается",
+        # и сервер действительно ждет его, а не сбрасывает файл в ядро
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    sock.setblocking(False)
+    await asyncio.get_running_loop().sock_connect(sock, (host, port))
+    reader, writer = await asyncio.open_connection(sock=sock, limit=limit)
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: close\r\n\r\n'.encode())
+    await writer.drain()
+    head = await reader.readuntil(b'\r\n\r\n')
+    status = int(head.split(b' ', 2)[1])
+    return reader, writer, status
+
+
+async def _slow_client(host, port, path, rate, result):
+    started = time.monotonic()
+    writer = None
+    try:
+        reader, writer, result['status'] = await _request(host, port, path, rcvbuf=max(rate // 4, 4096))
+        result['ttfb'] = time.monotonic() - started
+        chunk = max(rate // 10, 1024)
+        while True:
+            data = await reader.read(chunk)
+            if not data:
+                break
+            result['bytes'] += len(data)
+            await asyncio.sleep(len(data) / rate)
+        result['done'] = True
+    except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError, IndexError):
+        result['error'] = True
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+async def _probe(host, port, latencies, stop):
+    while not stop.is_set():
+        started = time.monotonic()
+        try:
+            reader, writer, _ = await asyncio.wait_for(_request(host, port, PROBE_PATH), timeout=10)
+            await reader.read()
+            writer.close()
+            latencies.append(time.monotonic() - started)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError):
+            latencies.append(None)
+        await asyncio.sleep(0.5)
+
+
+async def _run_load(base_url, paths, rate, duration):
+    parts = urlsplit(base_url)
+    host, port = parts.hostname, parts.port or 80
+    results = [{'status': None, 'ttfb': None, 'bytes': 0, 'done': False, 'error': False} for _ in paths]
+    latencies = []
+    stop = asyncio.Event()
+
+    probe = asyncio.create_task(_probe(host, port, latencies, stop))
+    tasks = [asyncio.create_task(_slow_client(host, port, path, rate, result)) for path, result in zip(paths, results)]
+    started = time.monotonic()
+    await asyncio.wait(tasks, timeout=duration)
+    elapsed = time.monotonic() - started
+
+    stop.set()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await probe
+    return results, latencies, elapsed
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port, process, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise CommandError(f'Сервер завершился при запуске (код {process.returncode})')
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise CommandError(f'Сервер не открыл порт {port} за {timeout} с')
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный тест: сколько медленных скачиваний одновременно держат WSGI и ASGI'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--document', type=int, required=True,
+                            help='id документа, который будут качать (берите файл побольше, от 20 МБ)')
+        parser.add_argument('--clients', type=int, default=200,
+                            help='Сколько клиентов качают одновременно')
+        parser.add_argument('--rate', type=int, default=64 * 1024,
+                            help='Скорость одного клиента, байт/с')
+        parser.add_argument('--duration', type=float, default=20,
+                            help='Длительность замера, секунд')
+        parser.add_argument('--wsgi-url', default=None,
+                            help='Адрес уже запущенного WSGI-сервера, например http://127.0.0.1:8000')
+        parser.add_argument('--asgi-url', default=None,
+                            help='Адрес уже запущенного ASGI-сервера')
+        parser.add_argument('--spawn', action='store_true',
+                            help='Запустить gunicorn и uvicorn на этой машине самому')
+        parser.add_argument('--wsgi-threads', type=int, default=8,
+                            help='Потоков у воркера gunicorn при --spawn')
+
+    def handle(self, *args, **options):
+        if settings.DOCUMENT_DELIVERY_BACKEND != 'python':
+            self.stdout.write(self.style.WARNING(
+                f"DOCUMENT_DELIVERY_BACKEND = '{settings.DOCUMENT_DELIVERY_BACKEND}': "
+                f"файл отдает веб-сервер, разницы WSGI/ASGI в отдаче видно не будет"
+            ))
+
+        try:
+            doc = Document.objects.get(pk=options['document'])
+        except Document.DoesNotExist:
+            raise CommandError(f"Документ {options['document']} не найден")
+        size = doc.file.size
+        self.stdout.write(
+            f"Файл {doc.file.name}: {size / 1024 / 1024:.1f} МБ; {options['clients']} клиентов "
+            f"по {options['rate'] // 1024} КБ/с, {options['duration']:g} с"
+        )
+        if size / options['rate'] < options['duration']:
+            self.stdout.write(self.style.WARNING(
+                'Клиент скачает файл быстрее, чем идет замер — возьмите файл больше или уменьшите --rate'
+            ))
+
+        targets = []
+        if options['wsgi_url']:
+            targets.append(('WSGI', options['wsgi_url'], None))
+        if options['asgi_url']:
+            targets.append(('ASGI', options['asgi_url'], None))
+        if options['spawn']:
+            targets.extend(self._spawn_targets(options['wsgi_threads']))
+        if not targets:
+            raise CommandError('Укажите --wsgi-url и/или --asgi-url, или --spawn')
+
+        links = ShareLink.objects.bulk_create([ShareLink(document=doc) for _ in range(options['clients'])])
+        paths = [f'/s/{link.token}/' for link in links]
+        try:
+            self._run_targets(targets, paths, options)
+        finally:
+            ShareLink.objects.filter(pk__in=[link.pk for link in links]).delete()
+
+    def _run_targets(self, targets, paths, options):
+        for label, base_url, command in targets:
+            # Серверы запускаются по одному, перед своим замером, чтобы не делить процессор
+            process = None
+            try:
+                if command is not None:
+                    process = subprocess.Popen(
+                        command, cwd=settings.BASE_DIR, stdout=subprocess.DEVNULL, stderr=sys.stderr,
+                    )
+                    _wait_for_port(urlsplit(base_url).port, process)
+                results, latencies, elapsed = asyncio.run(_run_load(
+                    base_url, paths, options['rate'], options['duration'],
+                ))
+            finally:
+                if process is not None:
+                    process.terminate()
+                    process.wait(timeout=10)
+            self._report(label, base_url, results, latencies, elapsed)
+
+    def _spawn_targets(self, threads):
+        gunicorn, uvicorn = shutil.which('gunicorn'), shutil.which('uvicorn')
+        if not gunicorn or not uvicorn:
+            raise CommandError('Для --spawn нужны gunicorn и uvicorn: pip install gunicorn uvicorn')
+
+        wsgi_port, asgi_port = _free_port(), _free_port()
+        return [
+            ('WSGI', f'http://127.0.0.1:{wsgi_port}', [
+                gunicorn, 'archive_system.wsgi:application', '--bind', f'127.0.0.1:{wsgi_port}',
+                '--workers', '1', '--worker-class', 'gthread', '--threads', str(threads),
+                '--timeout', '300',
+            ]),
+            ('ASGI', f'http://127.0.0.1:{asgi_port}', [
+                uvicorn, 'archive_system.asgi:application', '--host', '127.0.0.1', '--port', str(asgi_port),
+                '--workers', '1', '--no-access-log',
+            ]),
+        ]
+
+    def _report(self, label, base_url, results, latencies, elapsed):
+        answered = [r for r in results if r['ttfb'] is not None]
+        ttfb = [r['ttfb'] for r in answered]
+        ok_probes = [value for value in latencies if value is not None]
+        total_bytes = sum(r['bytes'] for r in results)
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f'\n{label} ({base_url})'))
+        self.stdout.write(f"  получили ответ:     {len(answered)} из {len(results)} "
+                          f"(ошибок: {sum(r['error'] for r in results)}, "
+                          f"статусы: {sorted({r['status'] for r in answered})})")
+        self.stdout.write(f"  докачали до конца:  {sum(r['done'] for r in results)}")
+        self.stdout.write(f"  первый байт:        p50 {_ms(_percentile(ttfb, 0.5))}, "
+                          f"p95 {_ms(_percentile(ttfb, 0.95))}, max {_ms(max(ttfb) if ttfb else None)}")
+        self.stdout.write(f"  отдано:             {total_bytes / 1024 / 1024:.1f} МБ "
+                          f"({total_bytes / 1024 / 1024 / elapsed:.1f} МБ/с)")
+        self.stdout.write(f"  страница входа:     p50 {_ms(_percentile(ok_probes, 0.5))}, "
+                          f"p95 {_ms(_percentile(ok_probes, 0.95))}, "
+                          f"без ответа {len(latencies) - len(ok_probes)} из {len(latencies)}")
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from core import avatars
+from core.models import Profile
+
+
+class Command(BaseCommand):
+    help = 'Нарезает уменьшенные копии аватарок (для загруженных до появления копий или после смены AVATAR_SIZES)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Пересобрать копии у всех, а не только у профилей без копий')
+
+    def handle(self, *args, **options):
+        profiles = Profile.objects.exclude(avatar='').exclude(avatar__isnull=True)
+        if not options['all']:
+            profiles = profiles.filter(avatar_variants='')
+
+        done = failed = 0
+        for profile in profiles.iterator(chunk_size=100):
+            try:
+                avatars.process(profile)
+                done += 1
+            except (avatars.AvatarError, OSError) as e:
+                failed += 1
+                self.stdout.write(self.style.WARNING(f'{profile}: {e}'))
+
+        self.stdout.write(self.style.SUCCESS(f'Готово. Обработано аватарок: {done}, с ошибкой: {failed}'))
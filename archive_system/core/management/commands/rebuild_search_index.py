@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from core import search
+from core.models import Document
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый индекс документов (название + текст файлов)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Сколько документов индексировать в одной транзакции')
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            self.stdout.write(self.style.WARNING('Полнотекстовый индекс поддерживается только на SQLite.'))
+            return
+
+        batch_size = options['batch_size']
+        # Индекс строится рядом с рабочим, поиск пока работает по старому
+        search.start_rebuild()
+
+        # iterator() не держит в памяти все документы сразу
+        docs = Document.objects.only('id', 'title', 'file').order_by('id').iterator(chunk_size=batch_size)
+        total = 0
+        batch = []
+        for doc in docs:
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                total += self._index_batch(batch)
+                batch = []
+                self.stdout.write(f'Проиндексировано: {total}')
+        total += self._index_batch(batch)
+
+        search.finish_rebuild()
+        search.optimize_index()
+        self.stdout.write(self.style.SUCCESS(f'Индекс перестроен. Документов: {total}'))
+
+    def _index_batch(self, batch):
+        # Короткие транзакции на пачку — не держим блокировку базы на всю переиндексацию
+        with transaction.atomic():
+            for doc in batch:
+                search.rebuild_document(doc)
+        return len(batch)
@@ -0,0 +1,76 @@
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from core.models import ScheduledJob
+from core.scheduler import active_jobs, claim_job, run_job, seconds_until_next, sync_jobs
+
+
+class Command(BaseCommand):
+    help = 'Запускает планировщик периодических заданий (очистка журнала, кэши, индекс поиска)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2,
+                            help='Сколько заданий выполнять одновременно')
+        parser.add_argument('--once', action='store_true',
+                            help='Выполнить задания, у которых подошло время, и выйти (для cron)')
+        parser.add_argument('--run', metavar='JOB',
+                            help='Выполнить одно задание прямо сейчас, не дожидаясь расписания')
+        parser.add_argument('--list', action='store_true',
+                            help='Показать задания, следующий запуск и итог последнего')
+
+    def handle(self, *args, **options):
+        jobs = active_jobs()
+        sync_jobs(jobs)
+        worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+        if options['list']:
+            return self.print_jobs(jobs)
+
+        if options['run']:
+            name = options['run']
+            if name not in jobs:
+                raise CommandError(f'Нет такого задания: {name}. Есть: {", ".join(sorted(jobs))}')
+            func, schedule, timeout = jobs[name]
+            if not claim_job(name, schedule, timeout, worker_id, force=True):
+                raise CommandError(f'Задание {name} сейчас выполняется другим планировщиком')
+            run_job(name, func, worker_id)
+            return self.print_jobs({name: jobs[name]})
+
+        self.stdout.write(f'⏳ Планировщик {worker_id} запущен. Задания: {", ".join(sorted(jobs))}')
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+            try:
+                while True:
+                    futures = []
+                    for name, (func, schedule, timeout) in jobs.items():
+                        if claim_job(name, schedule, timeout, worker_id):
+                            self.stdout.write(f'[{time.strftime("%H:%M:%S")}] ▶ {name}')
+                            futures.append(pool.submit(run_job, name, func, worker_id))
+
+                    if options['once']:
+                        for future in futures:
+                            future.result()
+                        break
+                    time.sleep(seconds_until_next(jobs))
+            except KeyboardInterrupt:
+                self.stdout.write('Остановка: дожидаемся текущих заданий...')
+
+        if options['once']:
+            self.print_jobs(jobs)
+
+    def print_jobs(self, jobs):
+        for row in ScheduledJob.objects.filter(name__in=list(jobs)).order_by('name'):
+            if row.last_status == 'failed':
+                status = self.style.ERROR('ошибка')
+            elif row.last_status == 'ok':
+                status = self.style.SUCCESS('ok')
+            else:
+                status = '—'
+            duration = f'{row.last_duration:.2f} с' if row.last_duration is not None else ''
+            self.stdout.write(
+                f'{row.name:30} {row.schedule:16} след.: {timezone.localtime(row.next_run_at):%d.%m %H:%M}  '
+                f'итог: {status} {duration} {row.last_result}'
+            )
@@ -0,0 +1,61 @@
+import os
+import socket
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from core.tasks import claim_tasks, heartbeat, requeue_stale_tasks, run_task_in_thread
+
+
+class Command(BaseCommand):
+    help = 'Запускает воркер фоновых задач (обработка загруженных файлов и т.п.)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=2,
+                            help='Сколько задач выполнять одновременно')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Пауза (сек) между проверками пустой очереди')
+        parser.add_argument('--once', action='store_true',
+                            help='Выполнить все готовые задачи и выйти (для cron и отладки)')
+
+    def handle(self, *args, **options):
+        concurrency = max(1, options['concurrency'])
+        worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+        self.stdout.write(f'⏳ Воркер {worker_id} запущен (потоков: {concurrency})')
+        done = failed = 0
+        running = set()
+        last_stale_check = None
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            try:
+                while True:
+                    # Раз в минуту продлеваем аренду своих задач и подбираем задачи упавших воркеров
+                    if last_stale_check is None or time.monotonic() - last_stale_check > 60:
+                        heartbeat(worker_id)
+                        requeued = requeue_stale_tasks()
+                        if requeued:
+                            self.stdout.write(self.style.WARNING(f'Возвращено в очередь зависших задач: {requeued}'))
+                        last_stale_check = time.monotonic()
+
+                    free = concurrency - len(running)
+                    tasks = claim_tasks(worker_id, free) if free else []
+                    for task in tasks:
+                        running.add(pool.submit(run_task_in_thread, task))
+
+                    if not running:
+                        if options['once']:
+                            break
+                        time.sleep(options['poll_interval'])
+                        continue
+
+                    finished, running = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        if future.result():
+                            done += 1
+                        else:
+                            failed += 1
+            except KeyboardInterrupt:
+                self.stdout.write('Остановка: дожидаемся текущих задач...')
+
+        self.stdout.write(self.style.SUCCESS(f'Воркер остановлен. Выполнено: {done}, с ошибкой: {failed}'))
@@ -0,0 +1,37 @@
+from django.db import migrations
+
+
+# Виртуальная таблица FTS5 для полнотекстового поиска (core/search.py).
+# rowid = id документа. На не-SQLite базах миграция ничего не делает,
+# а поиск работает по названию.
+
+def create_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS core_document_fts USING fts5("
+        "title, content, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    )
+    # Уже загруженные документы попадают в индекс по названию;
+    # текст файлов добавит команда rebuild_search_index
+    schema_editor.execute(
+        "INSERT INTO core_document_fts (rowid, title, content) "
+        "SELECT id, title, '' FROM core_document"
+    )
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS core_document_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_document_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.10 on 2026-10-18 19:51
+
+import os
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Копия Document.FILE_KIND_EXTENSIONS на момент миграции
+FILE_KIND_EXTENSIONS = {
+    '.pdf': 'pdf',
+    '.doc': 'word', '.docx': 'word',
+    '.xls': 'excel', '.xlsx': 'excel', '.csv': 'excel',
+    '.jpg': 'image', '.jpeg': 'image', '.png': 'image', '.gif': 'image', '.webp': 'image',
+    '.zip': 'archive', '.rar': 'archive',
+}
+
+
+def backfill_file_kind(apps, schema_editor):
+    # Заполняем новые колонки у уже загруженных документов пачками
+    Document = apps.get_model('core', 'Document')
+    batch = []
+    for doc in Document.objects.only('id', 'file').order_by('id').iterator(chunk_size=1000):
+        doc.extension = os.path.splitext(doc.file.name or '')[1].lower()
+        doc.file_kind = FILE_KIND_EXTENSIONS.get(doc.extension, 'other')
+        batch.append(doc)
+        if len(batch) >= 1000:
+            Document.objects.bulk_update(batch, ['extension', 'file_kind'])
+            batch = []
+    Document.objects.bulk_update(batch, ['extension', 'file_kind'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_document_fts'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='extension',
+            field=models.CharField(blank=True, default='', editable=False, max_length=16),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='file_kind',
+            field=models.CharField(choices=[('pdf', 'PDF'), ('word', 'Word'), ('excel', 'Excel'), ('image', 'Картинка'), ('archive', 'Архив'), ('other', 'Другое')], default='other', editable=False, max_length=10),
+        ),
+        migrations.RunPython(backfill_file_kind, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['category', 'file_kind', 'uploaded_at'], name='doc_cat_kind_uploaded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['file_kind', 'uploaded_at'], name='doc_kind_uploaded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['security_level', 'uploaded_at'], name='doc_security_uploaded_idx'),
+        ),
+    ]
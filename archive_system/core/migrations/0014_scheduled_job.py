@@ -0,0 +1,31 @@
+# Generated by Django 5.2.10 on 2026-10-18 20:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_auditlog_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduledJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True, verbose_name='Задание')),
+                ('schedule', models.CharField(max_length=100, verbose_name='Расписание (cron)')),
+                ('next_run_at', models.DateTimeField(blank=True, null=True, verbose_name='Следующий запуск')),
+                ('locked_by', models.CharField(blank=True, max_length=100)),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('last_started_at', models.DateTimeField(blank=True, null=True, verbose_name='Последний запуск')),
+                ('last_duration', models.FloatField(blank=True, null=True, verbose_name='Длительность, с')),
+                ('last_status', models.CharField(blank=True, choices=[('ok', 'Успешно'), ('failed', 'Ошибка')], max_length=10, verbose_name='Итог')),
+                ('last_result', models.TextField(blank=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('run_count', models.PositiveIntegerField(default=0)),
+                ('failure_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.10 on 2026-10-18 20:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_scheduled_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sharelink',
+            name='download_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Скачиваний'),
+        ),
+        migrations.AddField(
+            model_name='sharelink',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Действует до'),
+        ),
+        migrations.AddField(
+            model_name='sharelink',
+            name='max_downloads',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Лимит скачиваний'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.10 on 2026-10-18 20:21
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_sharelink_limits'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedblob',
+            name='last_accessed_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='storedblob',
+            name='tier',
+            field=models.CharField(choices=[('hot', 'Локальный диск'), ('cold', 'Холодное хранилище')], default='hot', max_length=4),
+        ),
+        migrations.AddIndex(
+            model_name='storedblob',
+            index=models.Index(fields=['tier', 'last_accessed_at'], name='blob_tier_accessed_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.10 on 2026-10-18 20:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_storage_tiers'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='document',
+            name='category',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='core.category'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-18 20:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_category_protect'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='avatar_variants',
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+    ]
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.db import migrations
+
+
+# Профили для пользователей, созданных без профиля (до сигнала или в обход
+# него). Дальше профиль создается только при создании пользователя, и
+# остальной код рассчитывает, что он есть у всех.
+
+def create_missing_profiles(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    Profile = apps.get_model('core', 'Profile')
+    user_ids = User.objects.filter(profile__isnull=True).values_list('pk', flat=True).iterator(chunk_size=1000)
+    Profile.objects.bulk_create((Profile(user_id=user_id) for user_id in user_ids), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_profile_avatar_variants'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(create_missing_profiles, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-18 20:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_backfill_profiles'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedblob',
+            name='pinned_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
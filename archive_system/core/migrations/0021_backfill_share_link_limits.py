@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations
+from django.utils import timezone
+
+
+# Ссылки, выданные до появления срока и лимита (0015), остались бы
+# бессрочными и безлимитными навсегда. Даем им те же ограничения, что
+# и новым: срок — от момента миграции (от даты создания старые ссылки
+# истекли бы сразу, без предупреждения), лимит — из настроек.
+
+def limit_legacy_links(apps, schema_editor):
+    ShareLink = apps.get_model('core', 'ShareLink')
+    days = settings.SHARE_LINK_TTL_DAYS
+    if days:
+        ShareLink.objects.filter(expires_at__isnull=True).update(
+            expires_at=timezone.now() + timedelta(days=days),
+        )
+    if settings.SHARE_LINK_MAX_DOWNLOADS is not None:
+        ShareLink.objects.filter(max_downloads__isnull=True).update(
+            max_downloads=settings.SHARE_LINK_MAX_DOWNLOADS,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_storedblob_pinned_until'),
+    ]
+
+    operations = [
+        migrations.RunPython(limit_legacy_links, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.10 on 2026-10-18 20:48
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_backfill_share_link_limits'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['category', 'uploaded_at', 'id'], name='doc_cat_uploaded_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['category', 'title', 'id'], name='doc_cat_title_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['file_kind', 'title', 'id'], name='doc_kind_title_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['category', 'file_kind', 'title', 'id'], name='doc_cat_kind_title_id_idx'),
+        ),
+    ]
@@ -1,10 +1,18 @@
 import os
+import time
 import uuid
-from django.db import models
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.utils import timezone
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_init, post_save, post_delete
 from django.dispatch import receiver
 
+from . import search
+from .storage import get_document_storage, is_blob_name
+
 
 class Category(models.Model):
     name = models.CharField(max_length=100)
@@ -20,64 +28,451 @@ class Document(models.Model):
         ('secret', 'Секретно'),
     ]
 
+    # Тип файла для фильтра "Все типы" на главной
+    FILE_KIND_CHOICES = [
+        ('pdf', 'PDF'),
+        ('word', 'Word'),
+        ('excel', 'Excel'),
+        ('image', 'Картинка'),
+        ('archive', 'Архив'),
+        ('other', 'Другое'),
+    ]
+    FILE_KIND_EXTENSIONS = {
+        '.pdf': 'pdf',
+        '.doc': 'word', '.docx': 'word',
+        '.xls': 'excel', '.xlsx': 'excel', '.csv': 'excel',
+        '.jpg': 'image', '.jpeg': 'image', '.png': 'image', '.gif': 'image', '.webp': 'image',
+        '.zip': 'archive', '.rar': 'archive',
+    }
+
     title = models.CharField(max_length=200)
-    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True)
+    # PROTECT: категорию удаляют только через bulk.reassign_category / delete_category_documents —
+    # каскад Django загрузил бы в память все документы категории разом
+    category = models.ForeignKey(Category, on_delete=models.PROTECT, null=True, blank=True)
     security_level = models.CharField(max_length=20, choices=SECURITY_CHOICES, default='public')
-    file = models.FileField(upload_to='documents/')
+    # Файлы хранятся по хэшу содержимого (core/storage.py), дубликаты не копятся
+    file = models.FileField(upload_to='documents/', storage=get_document_storage)
     uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
+    # Хранятся в базе, чтобы фильтр по типу шел по индексу, а не LIKE по имени файла.
+    # Заполняются в save()
+    extension = models.CharField(max_length=16, blank=True, default='', editable=False)
+    file_kind = models.CharField(max_length=10, choices=FILE_KIND_CHOICES, default='other', editable=False)
+
+    class Meta:
+        indexes = [
+            # Индексы под keyset-пагинацию списка (сортировка по дате и по имени)
+            models.Index(fields=['uploaded_at', 'id'], name='doc_uploaded_at_id_idx'),
+            models.Index(fields=['title', 'id'], name='doc_title_id_idx'),
+            # Фильтры главной: категория + тип + сортировка по дате
+            models.Index(fields=['category', 'file_kind', 'uploaded_at'], name='doc_cat_kind_uploaded_idx'),
+            models.Index(fields=['file_kind', 'uploaded_at'], name='doc_kind_uploaded_idx'),
+            models.Index(fields=['security_level', 'uploaded_at'], name='doc_security_uploaded_idx'),
+            # Фильтр по категории или типу + сортировка: строки идут сразу в порядке
+            # страницы, без сортировки всей категории во временном B-дереве
+            models.Index(fields=['category', 'uploaded_at', 'id'], name='doc_cat_uploaded_id_idx'),
+            models.Index(fields=['category', 'title', 'id'], name='doc_cat_title_id_idx'),
+            models.Index(fields=['file_kind', 'title', 'id'], name='doc_kind_title_id_idx'),
+            models.Index(fields=['category', 'file_kind', 'title', 'id'], name='doc_cat_kind_title_id_idx'),
+        ]
+
     def __str__(self):
         return self.title
 
+    def fill_file_info(self):
+        # Вызывается из save(); bulk_create save() не вызывает — там зовем вручную
+        self.extension = os.path.splitext(self.file.name or '')[1].lower()
+        self.file_kind = self.FILE_KIND_EXTENSIONS.get(self.extension, 'other')
+
+    def save(self, *args, **kwargs):
+        self.fill_file_info()
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'file' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'extension', 'file_kind'}
+
+        super().save(*args, **kwargs)
+
     # 👇 НОВАЯ ФУНКЦИЯ: возвращает расширение файла (например: .docx)
     def get_extension(self):
-        name, extension = os.path.splitext(self.file.name)
-        return extension.lower()
+        return self.extension
 
     # 👇 НОВАЯ ФУНКЦИЯ: проверяет, картинка это или нет (для превью)
     def is_image(self):
-        return self.get_extension() in ['.jpg', '.jpeg', '.png', '.gif', '.webp']
+        return self.file_kind == 'image'
+
+# 👇 Поисковый индекс обновляется вместе с документом
+@receiver(post_save, sender=Document)
+def index_document_for_search(sender, instance, created, **kwargs):
+    # Название индексируем сразу (дешево), а текст файла и миниатюры
+    # делает фоновый воркер — загрузка не ждет тяжелой обработки
+    search.index_document(instance, extract=False)
+    # Файл заменили — текст и миниатюру надо сделать заново. Снимок имени файла
+    # обновляет acquire_document_blob, он подключен ниже и срабатывает позже
+    old_name = None if created else instance._stored_file_name
+    if created or (old_name is not None and old_name != instance.file.name):
+        Task.enqueue('index_document', document=instance)
+        Task.enqueue('generate_previews', document=instance)
+
+@receiver(post_delete, sender=Document)
+def remove_document_from_search(sender, instance, **kwargs):
+    search.remove_document(instance.pk)
+
+# 👇 Учет ссылок на файлы в хранилище (одинаковые файлы хранятся один раз)
+def _loaded_file_name(instance):
+    # Без обращения к instance.file: если поле отложено (.only()), это был бы лишний запрос
+    value = instance.__dict__.get('file')
+    return getattr(value, 'name', value)
+
+@receiver(post_init, sender=Document)
+def remember_document_file(sender, instance, **kwargs):
+    # Каким был файл при загрузке из базы — чтобы заметить замену файла в save()
+    instance._stored_file_name = _loaded_file_name(instance)
+
+@receiver(post_save, sender=Document)
+def acquire_document_blob(sender, instance, created, **kwargs):
+    new_name = instance.file.name
+    old_name = None if created else instance._stored_file_name
+    if created or (old_name is not None and old_name != new_name):
+        StoredBlob.acquire(new_name, instance.file.storage)
+        if old_name:
+            # Файл заменили (админка, форма): старый blob больше не нужен этому документу
+            StoredBlob.release(old_name, instance.file.storage)
+    instance._stored_file_name = new_name
+
+@receiver(post_delete, sender=Document)
+def release_document_blob(sender, instance, **kwargs):
+    StoredBlob.release(instance.file.name, instance.file.storage)
+
+
+class StoredBlob(models.Model):
+    # Файл в хранилище blobs/ и число документов, которые на него ссылаются
+    name = models.CharField(max_length=255, unique=True)
+    sha256 = models.CharField(max_length=64, db_index=True)
+    size = models.BigIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # 👇 Где лежит файл: на локальном диске или только в холодном хранилище (core/tiering.py)
+    TIER_CHOICES = [
+        ('hot', 'Локальный диск'),
+        ('cold', 'Холодное хранилище'),
+    ]
+    tier = models.CharField(max_length=4, choices=TIER_CHOICES, default='hot')
+    last_accessed_at = models.DateTimeField(default=timezone.now)
+    # 👇 Файл только что положили в хранилище, а документ еще не сослался на него:
+    # до этого времени запись и файл не удаляются, даже если ссылок 0 (см. pin)
+    pinned_until = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Поиск давно не открытых файлов для вытеснения
+            models.Index(fields=['tier', 'last_accessed_at'], name='blob_tier_accessed_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count})"
+
+    @staticmethod
+    def _replicate(names):
+        # Копия нового файла в холодном хранилище — другие серверы достанут его оттуда
+        if settings.DOCUMENT_COLD_STORAGE and settings.TIERING_REPLICATE_UPLOADS:
+            for name in names:
+                Task.enqueue('replicate_blob', blob=name)
+
+    @classmethod
+    def pin(cls, name, size):
+        """
+        Вызывается хранилищем до того, как оно решит, класть файл или взять уже лежащий.
+        Пока действует пин, release() не удалит ни запись, ни файл — иначе параллельное
+        удаление последнего документа с тем же файлом могло стереть blob, на который
+        вот-вот сошлется новый документ.
+        """
+        until = timezone.now() + timedelta(seconds=settings.BLOB_PIN_SECONDS)
+        if cls.objects.filter(name=name).update(pinned_until=until):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(
+                    name=name,
+                    sha256=os.path.splitext(os.path.basename(name))[0],
+                    size=size,
+                    ref_count=0,
+                    pinned_until=until,
+                )
+        except IntegrityError:
+            cls.objects.filter(name=name).update(pinned_until=until)
+
+    @classmethod
+    def acquire(cls, name, storage, count=1):
+        """+count ссылок на файл. Файлы старого формата (documents/...) не учитываются."""
+        if not is_blob_name(name):
+            return
+        # Повторная загрузка того же файла — обращение к нему, и файл снова на локальном диске
+        if cls.objects.filter(name=name).update(
+            ref_count=F('ref_count') + count, tier='hot', last_accessed_at=timezone.now(),
+        ):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(
+                    name=name,
+                    sha256=os.path.splitext(os.path.basename(name))[0],
+                    size=storage.size(name),
+                    ref_count=count,
+                )
+            cls._replicate([name])
+        except IntegrityError:
+            # Параллельная загрузка того же файла успела создать запись
+            cls.objects.filter(name=name).update(ref_count=F('ref_count') + count)
+
+    @classmethod
+    def acquire_many(cls, counts, storage):
+        """acquire() для многих файлов сразу: {имя: число ссылок} (массовая загрузка)."""
+        counts = {name: count for name, count in counts.items() if is_blob_name(name)}
+        existing = set(cls.objects.filter(name__in=list(counts)).values_list('name', flat=True))
+
+        # Уже известные файлы: один UPDATE на каждое "число ссылок" (обычно это 1)
+        by_count = {}
+        for name in existing:
+            by_count.setdefault(counts[name], []).append(name)
+        for count, names in by_count.items():
+            cls.objects.filter(name__in=names).update(
+                ref_count=F('ref_count') + count, tier='hot', last_accessed_at=timezone.now(),
+            )
+
+        new = [
+            cls(name=name, sha256=os.path.splitext(os.path.basename(name))[0],
+                size=storage.size(name), ref_count=count)
+            for name, count in counts.items() if name not in existing
+        ]
+        try:
+            with transaction.atomic():
+                cls.objects.bulk_create(new, batch_size=500)
+            cls._replicate([blob.name for blob in new])
+        except IntegrityError:
+            # Кто-то параллельно загрузил те же файлы — по одному, как обычно
+            for blob in new:
+                cls.acquire(blob.name, storage, count=blob.ref_count)
+
+    @classmethod
+    def release(cls, name, storage):
+        """-1 ссылка. Когда ссылок не осталось — удаляем файл (после коммита)."""
+        if not is_blob_name(name):
+            return
+        cls.objects.filter(name=name, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+        deleted, _ = cls._unreferenced().filter(name=name).delete()
+        if deleted:
+            transaction.on_commit(lambda: cls._delete_file(name, storage))
+
+    @classmethod
+    def _unreferenced(cls):
+        return cls.objects.filter(ref_count=0).filter(
+            models.Q(pinned_until__isnull=True) | models.Q(pinned_until__lt=timezone.now())
+        )
+
+    @classmethod
+    def _delete_file(cls, name, storage):
+        # Файл сначала убирается в сторону, и только потом перепроверяется запись:
+        # если тот же файл успели загрузить снова (pin), он возвращается на место.
+        # Хранилище делает pin до проверки "файл уже есть" — так кто-то один из
+        # двоих обязательно увидит другого
+        path = storage.path(name)
+        aside = f"{path}.{time.time_ns()}.deleting"
+        try:
+            os.replace(path, aside)
+        except FileNotFoundError:
+            aside = None
+        if cls.objects.filter(name=name).exists():
+            if aside:
+                if os.path.exists(path):
+                    os.remove(aside)  # загрузка уже положила свою копию
+                else:
+                    os.replace(aside, path)
+            return
+        if aside:
+            os.remove(aside)
+        storage.delete(name)  # копия в холодном хранилище
+
+    @classmethod
+    def purge_unreferenced(cls):
+        """Удаляет записи и файлы без ссылок с истекшим пином (загрузка не дошла до документа)."""
+        names = list(cls._unreferenced().values_list('name', flat=True))
+        storage = get_document_storage()
+        for name in names:
+            if cls._unreferenced().filter(name=name).delete()[0]:
+                cls._delete_file(name, storage)
+        return len(names)
 
 # Модель для журнала действий
 class AuditLog(models.Model):
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, verbose_name="Пользователь")
     action = models.CharField(max_length=50, verbose_name="Действие")  # Например: "Загрузка", "Удаление"
     document_title = models.CharField(max_length=255, verbose_name="Документ")
-    timestamp = models.DateTimeField(auto_now_add=True, verbose_name="Время")
+    # Не auto_now_add: записи пишутся в базу пачками (core/audit.py), время — момента действия
+    timestamp = models.DateTimeField(default=timezone.now, verbose_name="Время")
 
     def __str__(self):
         return f"{self.user} - {self.action} - {self.timestamp}"
 
     class Meta:
         ordering = ['-timestamp']  # Сначала новые записи
+        indexes = [
+            # Ключ пагинации журнала + фильтры по пользователю/действию с сортировкой по времени
+            models.Index(fields=['timestamp', 'id'], name='audit_timestamp_id_idx'),
+            models.Index(fields=['user', 'timestamp', 'id'], name='audit_user_timestamp_idx'),
+            models.Index(fields=['action', 'timestamp', 'id'], name='audit_action_timestamp_idx'),
+        ]
 
 # 👇 НОВАЯ МОДЕЛЬ ПРОФИЛЯ
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     avatar = models.ImageField(upload_to='avatars/', blank=True, null=True, verbose_name="Аватар")
+    # Каталог уменьшенных копий аватарки: "avatars/<хэш>" (core/avatars.py)
+    avatar_variants = models.CharField(max_length=100, blank=True, editable=False)
 
     def __str__(self):
         return f"Профиль {self.user.username}"
 
+    # Адреса копий для шапки (32 px, на ретине 64) и страницы профиля
+    @property
+    def avatar_small(self):
+        from .avatars import urls
+        return urls(self, 32, retina_size=64)
+
+    @property
+    def avatar_large(self):
+        from .avatars import urls
+        return urls(self, 256)
+
 # 👇 МАГИЯ (Сигналы)
-# Это нужно, чтобы профиль создавался автоматически при создании пользователя
+# Профиль создается ровно один раз — вместе с пользователем. Старым
+# пользователям профили добавила миграция 0019_backfill_profiles, поэтому
+# остальные сохранения User (в том числе last_login при каждом входе)
+# профиль не трогают
 @receiver(post_save, sender=User)
-def create_user_profile(sender, instance, created, **kwargs):
-    if created:
+def create_user_profile(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
         Profile.objects.create(user=instance)
 
-@receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    # Эта строчка нужна для старых пользователей, у которых еще нет профиля
-    Profile.objects.get_or_create(user=instance)
-    instance.profile.save()
-
 # Модель для публичных ссылок
 class ShareLink(models.Model):
     document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='share_links')
     token = models.UUIDField(default=uuid.uuid4, unique=True, editable=False) # Секретный код
     created_at = models.DateTimeField(auto_now_add=True)
+    # 👇 Ограничения ссылки (пусто — без ограничений), проверяет core/sharing.py
+    expires_at = models.DateTimeField(null=True, blank=True, verbose_name="Действует до")
+    max_downloads = models.PositiveIntegerField(null=True, blank=True, verbose_name="Лимит скачиваний")
+    # Пишется в фоне пачками — может отставать на SHARE_LINK_FLUSH_INTERVAL
+    download_count = models.PositiveIntegerField(default=0, verbose_name="Скачиваний")
+
+    def __str__(self):
+        return f"Link for {self.document.title}"
+
+# 👇 Очередь фоновых задач (обработка после загрузки и т.п.)
+# Задачи выполняет воркер: python manage.py run_worker (см. core/tasks.py)
+class Task(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'В очереди'),
+        ('running', 'Выполняется'),
+        ('done', 'Готово'),
+        ('failed', 'Ошибка'),
+    ]
+
+    name = models.CharField(max_length=64, verbose_name="Задача")
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, null=True, blank=True,
+                                 related_name='tasks', verbose_name="Документ")
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending', verbose_name="Статус")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Попыток")
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)  # для повторов с задержкой
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)  # какой воркер взял задачу
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            # Воркер выбирает "pending, у которых подошло время"
+            models.Index(fields=['status', 'run_after'], name='task_status_run_after_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
+
+    @classmethod
+    def enqueue(cls, name, document=None, max_attempts=3, **payload):
+        task = cls.objects.create(name=name, document=document, payload=payload, max_attempts=max_attempts)
+        if settings.TASKS_RUN_EAGERLY:
+            # Режим без воркера (тесты, локальная отладка): выполняем сразу после коммита
+            from .tasks import run_task
+            transaction.on_commit(lambda: run_task(task))
+        return task
+
+    @classmethod
+    def enqueue_many(cls, name, documents, max_attempts=3):
+        """Одна задача на каждый документ — одним INSERT (массовая загрузка)."""
+        tasks = cls.objects.bulk_create(
+            [cls(name=name, document=doc, max_attempts=max_attempts) for doc in documents],
+            batch_size=500,
+        )
+        if settings.TASKS_RUN_EAGERLY:
+            from .tasks import run_task
+            for task in tasks:
+                transaction.on_commit(lambda task=task: run_task(task))
+        return tasks
+
+# 👇 Сеанс докачиваемой загрузки больших файлов (core/uploads.py)
+class UploadSession(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+
+    # То же, что в форме обычной загрузки
+    title = models.CharField(max_length=200)
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True)
+    security_level = models.CharField(max_length=20, choices=Document.SECURITY_CHOICES, default='public')
+
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()                  # полный размер файла
+    sha256 = models.CharField(max_length=64, blank=True)  # ожидаемый хэш (если клиент его знает)
+    offset = models.BigIntegerField(default=0)       # сколько байт уже принято
+    locked_at = models.DateTimeField(null=True, blank=True)  # идет запись куска
+    # 👇 Завершение идет фоновой задачей: хэш файла в несколько ГБ не считается в запросе
+    finalize_task = models.ForeignKey(Task, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    digest = models.CharField(max_length=64, blank=True)  # посчитанный хэш (повтор задачи не считает заново)
+    error = models.CharField(max_length=255, blank=True)  # почему файл не принят — загружать заново
+    document = models.ForeignKey(Document, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.size})"
+
+# 👇 Периодические задания планировщика (python manage.py run_scheduler, core/scheduler.py)
+# Строка на задание: когда запускать в следующий раз, "замок" и итог прошлого запуска
+class ScheduledJob(models.Model):
+    STATUS_CHOICES = [
+        ('ok', 'Успешно'),
+        ('failed', 'Ошибка'),
+    ]
+
+    name = models.CharField(max_length=64, unique=True, verbose_name="Задание")
+    schedule = models.CharField(max_length=100, verbose_name="Расписание (cron)")
+    next_run_at = models.DateTimeField(null=True, blank=True, verbose_name="Следующий запуск")
+
+    # Замок: пока locked_until в будущем, задание выполняет locked_by
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+
+    last_started_at = models.DateTimeField(null=True, blank=True, verbose_name="Последний запуск")
+    last_duration = models.FloatField(null=True, blank=True, verbose_name="Длительность, с")
+    last_status = models.CharField(max_length=10, choices=STATUS_CHOICES, blank=True, verbose_name="Итог")
+    last_result = models.TextField(blank=True)
+    last_error = models.TextField(blank=True)
+    run_count = models.PositiveIntegerField(default=0)
+    failure_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
-        return f"Link for {self.document.title}"
\ No newline at end of file
+        return f"{self.name} ({self.schedule})"
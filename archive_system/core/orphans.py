@@ -0,0 +1,200 @@
+import hashlib
+import logging
+import math
+import os
+import shutil
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+
+from . import avatars
+from .models import Document, Profile, StoredBlob
+
+logger = logging.getLogger(__name__)
+
+
+# ==========================================
+# СБОРКА ОСИРОТЕВШИХ ФАЙЛОВ
+# ==========================================
+# Файлы в MEDIA_ROOT, на которые не ссылается ни один Document.file,
+# Profile.avatar или StoredBlob: старые documents/ удаленных документов,
+# замененные аватарки, недописанные временные файлы.
+#
+# Ссылок и файлов может быть миллионы, поэтому:
+#   1. ссылки из базы складываются в фильтр Блума (≈2 байта на ссылку,
+#      ошибается только в сторону "есть ссылка" — такой файл просто
+#      останется до следующего раза);
+#   2. каталоги обходятся os.scandir по одному, список файлов в память
+#      целиком не попадает;
+#   3. файлы, которых нет в фильтре, пачками перепроверяются точным
+#      запросом к базе — так ссылки, появившиеся во время обхода, не
+#      теряются — и удаляются или уезжают в карантин.
+# Файлы моложе ORPHAN_GRACE_HOURS не трогаем: это могут быть загрузки,
+# которые еще не успели записать свою строку в базу.
+#
+# Карантин — ORPHAN_QUARANTINE_DIR/ГГГГ-ММ-ДД/<путь в MEDIA_ROOT>;
+# через ORPHAN_QUARANTINE_DAYS дней папка дня удаляется целиком.
+
+
+class BloomFilter:
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(capacity, 1000)
+        self.size = int(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+# Где в базе хранятся имена файлов. Копии аватарок учитываются по каталогу
+# (Profile.avatar_variants, см. avatars.reference_name)
+REFERENCES = [(Document, 'file'), (Profile, 'avatar'), (Profile, 'avatar_variants'), (StoredBlob, 'name')]
+
+
+def _names(model, field):
+    return model.objects.exclude(**{f'{field}__isnull': True}).exclude(**{field: ''}).values_list(field, flat=True)
+
+
+def build_reference_index():
+    """Фильтр Блума по всем именам файлов, на которые есть ссылки в базе."""
+    querysets = [_names(model, field) for model, field in REFERENCES]
+    # Запас на ссылки, добавленные, пока строим фильтр
+    index = BloomFilter(int(sum(qs.count() for qs in querysets) * 1.1))
+    for queryset in querysets:
+        for name in queryset.iterator(chunk_size=5000):
+            index.add(name)
+    return index
+
+
+def referenced(names):
+    """Какие из имен упоминаются в базе (точная проверка пачки)."""
+    names = list(names)
+    found = set()
+    for model, field in REFERENCES:
+        found.update(_names(model, field).filter(**{f'{field}__in': names}))
+    return found
+
+
+def iter_files(directory):
+    """(имя относительно MEDIA_ROOT, путь, stat) — обход в глубину без списка всех файлов."""
+    root = str(settings.MEDIA_ROOT)
+    stack = [os.path.join(root, directory)]
+    while stack:
+        current = stack.pop()
+        try:
+            entries = os.scandir(current)
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    name = os.path.relpath(entry.path, root).replace(os.sep, '/')
+                    yield name, entry.path, entry.stat(follow_symlinks=False)
+
+
+def _quarantine(name, path, day_dir):
+    target = os.path.join(day_dir, *name.split('/'))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    shutil.move(path, target)
+
+
+def _process(batch, action, day_dir, stats):
+    # batch — [(имя, путь, размер)], которых нет в фильтре; перепроверяем точно
+    alive = referenced(avatars.reference_name(name) for name, _, _ in batch)
+    for name, path, size in batch:
+        if avatars.reference_name(name) in alive:
+            continue
+        stats['orphans'] += 1
+        stats['bytes'] += size
+        top = name.split('/', 1)[0]
+        stats['by_dir'][top] = stats['by_dir'].get(top, 0) + size
+        if action is None:
+            continue
+        try:
+            if action == 'delete':
+                os.remove(path)
+            else:
+                _quarantine(name, path, day_dir)
+            stats['removed'] += 1
+        except FileNotFoundError:
+            pass  # уже удалили (например, освободился blob)
+        except OSError:
+            logger.exception("Не удалось убрать осиротевший файл %s", name)
+
+
+def purge_quarantine(days=None):
+    """Удаляет папки карантина старше days дней. Возвращает число удаленных папок."""
+    days = settings.ORPHAN_QUARANTINE_DAYS if days is None else days
+    root = str(settings.ORPHAN_QUARANTINE_DIR)
+    threshold = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+    removed = 0
+    try:
+        entries = list(os.scandir(root))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        # Папки дней называются ГГГГ-ММ-ДД — строки сравниваются как даты
+        if entry.is_dir(follow_symlinks=False) and len(entry.name) == 10 and entry.name < threshold:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+    return removed
+
+
+def collect_orphans(dry_run=False, action=None, grace_hours=None, batch_size=None):
+    """
+    Ищет файлы без ссылок в каталогах ORPHAN_SCAN_DIRS.
+    action — 'delete' или 'quarantine' (по умолчанию ORPHAN_ACTION); dry_run — только посчитать.
+    Возвращает {'scanned', 'orphans', 'bytes', 'removed', 'by_dir', 'seconds'}.
+    """
+    action = None if dry_run else (action or settings.ORPHAN_ACTION)
+    if action not in (None, 'delete', 'quarantine'):
+        raise ValueError(f"Неизвестное действие: {action!r}")
+    grace_hours = settings.ORPHAN_GRACE_HOURS if grace_hours is None else grace_hours
+    batch_size = batch_size or settings.ORPHAN_BATCH_SIZE
+
+    started = time.monotonic()
+    stats = {'scanned': 0, 'orphans': 0, 'bytes': 0, 'removed': 0, 'by_dir': {}, 'seconds': 0.0}
+    newest_allowed = time.time() - grace_hours * 3600
+    day_dir = os.path.join(str(settings.ORPHAN_QUARANTINE_DIR), datetime.now().strftime('%Y-%m-%d'))
+
+    if action is not None:
+        # Blob-ы, которые сохранили, но так и не привязали к документу (пин истек)
+        StoredBlob.purge_unreferenced()
+    index = build_reference_index()
+    batch = []
+    for directory in settings.ORPHAN_SCAN_DIRS:
+        for name, path, stat in iter_files(directory):
+            stats['scanned'] += 1
+            if stat.st_mtime > newest_allowed or avatars.reference_name(name) in index:
+                continue
+            batch.append((name, path, stat.st_size))
+            if len(batch) >= batch_size:
+                _process(batch, action, day_dir, stats)
+                batch = []
+    if batch:
+        _process(batch, action, day_dir, stats)
+
+    if action == 'quarantine':
+        purge_quarantine()
+
+    stats['seconds'] = time.monotonic() - started
+    logger.info(
+        "Осиротевшие файлы: %s из %s (%.1f МБ), убрано %s, за %.1f с",
+        stats['orphans'], stats['scanned'], stats['bytes'] / 1024 / 1024, stats['removed'], stats['seconds'],
+    )
+    return stats
@@ -0,0 +1,116 @@
+import base64
+import json
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+# ==========================================
+# KEYSET (CURSOR) ПАГИНАЦИЯ
+# ==========================================
+# Вместо OFFSET мы запоминаем ключ последней строки страницы
+# (например, дату загрузки + id) и следующую страницу берем
+# условием "строго после этого ключа". Такой запрос идет по индексу
+# и стоит одинаково и на первой, и на тысячной странице.
+
+def _json_default(value):
+    # Дату пишем с микросекундами: DjangoJSONEncoder обрезает их до миллисекунд,
+    # и строки с одинаковыми миллисекундами терялись бы между страницами
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def encode_cursor(values):
+    """Упаковывает значения ключа в короткую строку для URL."""
+    raw = json.dumps(list(values), default=_json_default, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    """Распаковывает курсор. Битый курсор -> None (начинаем с первой страницы)."""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    return values
+
+
+def _after(ordering, values):
+    """Строит условие "строка идет после ключа values" для сортировки ordering."""
+    condition = Q()
+    for i, field in enumerate(ordering):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        step = Q(**{f'{name}__{lookup}': values[i]})
+        for prev_field, prev_value in zip(ordering[:i], values[:i]):
+            step &= Q(**{prev_field.lstrip('-'): prev_value})
+        condition |= step
+    return condition
+
+
+def _keyset_queryset(queryset, ordering, cursor):
+    values = decode_cursor(cursor, len(ordering))
+    queryset = queryset.order_by(*ordering)
+    if values is not None:
+        try:
+            queryset = queryset.filter(_after(ordering, values))
+        except (ValidationError, ValueError, TypeError):
+            # Курсор подделан (мусор вместо даты или id, список вместо числа, null) —
+            # отдаем первую страницу
+            pass
+    return queryset
+
+
+def _split_page(items, ordering, page_size):
+    if len(items) <= page_size:
+        return items, None
+
+    items = items[:page_size]
+    last = items[-1]
+    next_cursor = encode_cursor(getattr(last, field.lstrip('-')) for field in ordering)
+    return items, next_cursor
+
+
+def keyset_page(queryset, ordering, cursor=None, page_size=50):
+    """
+    Возвращает (список объектов, курсор следующей страницы или None).
+    ordering — кортеж полей, последним должно идти уникальное поле (id).
+    """
+    queryset = _keyset_queryset(queryset, ordering, cursor)
+    # Берем на одну запись больше, чтобы понять, есть ли следующая страница
+    return _split_page(list(queryset[:page_size + 1]), ordering, page_size)
+
+
+async def akeyset_page(queryset, ordering, cursor=None, page_size=50):
+    """keyset_page для асинхронных представлений (асинхронная итерация ORM)."""
+    queryset = _keyset_queryset(queryset, ordering, cursor)
+    return _split_page([obj async for obj in queryset[:page_size + 1]], ordering, page_size)
+
+
+def ranked_page(queryset, ranked_ids, cursor=None, page_size=50):
+    """
+    Пагинация по готовому порядку (например, по релевантности из поиска).
+    ranked_ids уже ограничен сверху, поэтому курсор — просто позиция в нем.
+    queryset может дополнительно отсеять часть id (фильтры категории/типа).
+    """
+    values = decode_cursor(cursor, 1)
+    start = values[0] if values and isinstance(values[0], int) and values[0] > 0 else 0
+
+    allowed = set(queryset.filter(id__in=ranked_ids).values_list('id', flat=True))
+    ordered_ids = [doc_id for doc_id in ranked_ids if doc_id in allowed]
+    page_ids = ordered_ids[start:start + page_size]
+
+    by_id = queryset.in_bulk(page_ids)
+    items = [by_id[doc_id] for doc_id in page_ids if doc_id in by_id]
+
+    next_cursor = None
+    if start + page_size < len(ordered_ids):
+        next_cursor = encode_cursor([start + page_size])
+    return items, next_cursor
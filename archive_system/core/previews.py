@@ -0,0 +1,376 @@
+import csv
+import hashlib
+import html
+import io
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+import zipfile
+from xml.etree import ElementTree
+
+from django.conf import settings
+from django.urls import reverse
+from PIL import Image, ImageOps
+
+try:
+    import fitz  # PyMuPDF — если установлен, рисуем первую страницу PDF без внешних программ
+except ImportError:
+    fitz = None
+
+from . import tiering
+from .search import SHEET_NS, WORD_NS
+from .storage import is_blob_name
+
+
+# ==========================================
+# ПРЕДПРОСМОТР НА СЕРВЕРЕ + КЭШ
+# ==========================================
+# Превью делаются один раз на версию файла и складываются в
+# MEDIA_ROOT/previews/<ab>/<ключ>.<расширение>. Ключ — хэш от
+# (имя файла, размер, время изменения, вариант превью), поэтому новая
+# версия файла автоматически получает новые превью, а старые
+# вытесняются по LRU (время последнего доступа), когда кэш превышает
+# PREVIEW_CACHE_MAX_BYTES. Вытеснение — задание планировщика
+# enforce_preview_cache_limit: обход всего кэша на каждом промахе
+# стоил бы дороже самого превью.
+
+# Поднять, если поменялся формат превью — старые станут недостижимы и уйдут по LRU
+PREVIEW_VERSION = 1
+
+THUMBNAIL_TYPES = {'WEBP': ('webp', 'image/webp'), 'PNG': ('png', 'image/png')}
+
+_COLUMN_RE = re.compile(r'[A-Z]+')
+
+
+def cache_dir():
+    return os.path.join(settings.MEDIA_ROOT, 'previews')
+
+
+def _cache_key(doc, variant):
+    if is_blob_name(doc.file.name):
+        # Имя blob-а — хэш содержимого, под этим именем файл не меняется. Так
+        # готовое превью отдается, даже когда сам файл в холодном хранилище
+        identity = f"{doc.file.name}:{variant}:{PREVIEW_VERSION}"
+    else:
+        stat = os.stat(doc.file.path)
+        identity = f"{doc.file.name}:{stat.st_size}:{stat.st_mtime_ns}:{variant}:{PREVIEW_VERSION}"
+    return hashlib.sha256(identity.encode()).hexdigest()
+
+
+def _docx_page_key(doc, number):
+    # В страницу вшиты ссылки навигации с doc.pk — у одинаковых по
+    # содержимому документов (общий blob) страницы свои
+    return _cache_key(doc, f'docx-page-{doc.pk}-{number}')
+
+
+def _cache_path(key, extension):
+    return os.path.join(cache_dir(), key[:2], f"{key}.{extension}")
+
+
+def _cache_get(path):
+    # Отмечаем использование через atime. mtime не трогаем — от него зависит ETag превью
+    try:
+        os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+    except FileNotFoundError:
+        return None
+    return path
+
+
+def _cache_put(path, data):
+    # Пишем во временный файл и атомарно переименовываем — читатель не увидит половину
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def enforce_cache_limit(max_bytes=None):
+    """Удаляет давно не использованные превью, пока кэш не влезет в лимит. Возвращает число удаленных."""
+    max_bytes = settings.PREVIEW_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    root = cache_dir()
+    if not os.path.isdir(root):
+        return 0
+
+    entries = []
+    total = 0
+    for bucket in os.scandir(root):
+        if not bucket.is_dir():
+            continue
+        for entry in os.scandir(bucket.path):
+            if entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_atime, stat.st_size, entry.path))
+                total += stat.st_size
+
+    removed = 0
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    return removed
+
+
+# ------------------------------------------
+# 1. МИНИАТЮРЫ (картинки + первая страница PDF)
+# ------------------------------------------
+
+def _render_pdf_first_page(path):
+    """Возвращает PIL.Image первой страницы или None, если нечем рисовать PDF."""
+    if fitz is not None:
+        with fitz.open(path) as pdf:
+            if pdf.page_count == 0:
+                return None
+            pixmap = pdf[0].get_pixmap(dpi=72)
+            return Image.frombytes('RGB', (pixmap.width, pixmap.height), pixmap.samples)
+
+    pdftoppm = shutil.which('pdftoppm')
+    if pdftoppm is None:
+        return None
+    size = str(settings.PREVIEW_THUMBNAIL_SIZE)
+    with tempfile.TemporaryDirectory() as tmp:
+        prefix = os.path.join(tmp, 'page')
+        subprocess.run(
+            [pdftoppm, '-f', '1', '-l', '1', '-png', '-singlefile', '-scale-to', size, path, prefix],
+            check=True, timeout=30, capture_output=True,
+        )
+        with Image.open(prefix + '.png') as page:
+            page.load()
+            return page.copy()
+
+
+def _make_thumbnail(doc):
+    if doc.file_kind == 'image':
+        with Image.open(tiering.hot_path(doc)) as source:
+            image = ImageOps.exif_transpose(source)
+            image.load()
+    elif doc.file_kind == 'pdf':
+        image = _render_pdf_first_page(tiering.hot_path(doc))
+        if image is None:
+            return None
+    else:
+        return None
+
+    size = settings.PREVIEW_THUMBNAIL_SIZE
+    image.thumbnail((size, size))
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+    output = io.BytesIO()
+    image.save(output, format=settings.PREVIEW_THUMBNAIL_FORMAT)
+    return output.getvalue()
+
+
+def thumbnail(doc):
+    """Путь к миниатюре документа и ее MIME-тип, или (None, None)."""
+    extension, content_type = THUMBNAIL_TYPES[settings.PREVIEW_THUMBNAIL_FORMAT]
+    path = _cache_path(_cache_key(doc, f'thumb-{settings.PREVIEW_THUMBNAIL_SIZE}'), extension)
+    if _cache_get(path):
+        return path, content_type
+
+    try:
+        data = _make_thumbnail(doc)
+    except Exception:
+        # Битый файл — просто нет миниатюры, список все равно покажет иконку
+        data = None
+    if data is None:
+        return None, None
+
+    _cache_put(path, data)
+    return path, content_type
+
+
+# ------------------------------------------
+# 2. HTML-ПРЕВЬЮ: DOCX по страницам, таблицы — первые N строк
+# ------------------------------------------
+
+def _docx_paragraphs(path):
+    """Отдает (текст абзаца, был ли перед ним разрыв страницы) потоком."""
+    page_break = False
+    parts = []
+    with zipfile.ZipFile(path) as archive, archive.open('word/document.xml') as stream:
+        for _, element in ElementTree.iterparse(stream):
+            tag = element.tag
+            if tag == f'{WORD_NS}t':
+                parts.append(element.text or '')
+            elif tag == f'{WORD_NS}tab':
+                parts.append('\t')
+            elif tag == f'{WORD_NS}br' and element.get(f'{WORD_NS}type') == 'page':
+                page_break = True
+            elif tag == f'{WORD_NS}p':
+                yield ''.join(parts), page_break
+                parts = []
+                page_break = False
+            element.clear()
+
+
+def _docx_pages(path):
+    pages = [[]]
+    for text, page_break in _docx_paragraphs(path):
+        if page_break or len(pages[-1]) >= settings.PREVIEW_DOCX_PARAGRAPHS_PER_PAGE:
+            if len(pages) >= settings.PREVIEW_DOCX_MAX_PAGES:
+                break
+            pages.append([])
+        pages[-1].append(text)
+    return pages
+
+
+def _render_docx_page(doc, paragraphs, number, total):
+    body = ''.join(f'<p>{html.escape(text)}</p>' if text else '<p>&nbsp;</p>' for text in paragraphs)
+    nav = ''
+    if total > 1:
+        url = reverse('document_preview', args=[doc.pk, 'html'])
+        prev_button = (f'<button class="btn btn-sm btn-outline-secondary" data-preview-url="{url}?page={number - 1}">⬅️</button>'
+                       if number > 1 else '')
+        next_button = (f'<button class="btn btn-sm btn-outline-secondary" data-preview-url="{url}?page={number + 1}">➡️</button>'
+                       if number < total else '')
+        nav = (f'<div class="d-flex justify-content-between align-items-center p-2 border-bottom">'
+               f'{prev_button}<span class="small text-muted">Страница {number} из {total}</span>{next_button}</div>')
+    return (f'{nav}<div class="p-4 bg-white" style="overflow-y: auto; max-height: 80vh;">{body}</div>').encode()
+
+
+def _xlsx_rows(path, max_rows, max_cols):
+    """Первые строки первого листа. Из общей таблицы строк читаем только нужные."""
+    rows = []
+    shared_needed = set()
+    with zipfile.ZipFile(path) as archive:
+        sheets = sorted(name for name in archive.namelist()
+                        if name.startswith('xl/worksheets/sheet') and name.endswith('.xml'))
+        if not sheets:
+            return []
+
+        with archive.open(sheets[0]) as stream:
+            row = None
+            cell_ref, cell_type, cell_value = None, None, None
+            for event, element in ElementTree.iterparse(stream, events=('start', 'end')):
+                tag = element.tag
+                if event == 'start':
+                    if tag == f'{SHEET_NS}row':
+                        row = {}
+                    elif tag == f'{SHEET_NS}c':
+                        cell_ref, cell_type, cell_value = element.get('r', ''), element.get('t'), None
+                    continue
+
+                if tag in (f'{SHEET_NS}v', f'{SHEET_NS}t'):
+                    cell_value = element.text or ''
+                elif tag == f'{SHEET_NS}c' and row is not None:
+                    column = _column_index(cell_ref) if cell_ref else len(row)
+                    if column < max_cols and cell_value is not None:
+                        if cell_type == 's':
+                            cell_value = int(cell_value)
+                            shared_needed.add(cell_value)
+                            row[column] = ('s', cell_value)
+                        else:
+                            row[column] = ('v', cell_value)
+                elif tag == f'{SHEET_NS}row':
+                    rows.append(row)
+                    row = None
+                    if len(rows) >= max_rows:
+                        break
+                element.clear()
+
+        shared = {}
+        if shared_needed and 'xl/sharedStrings.xml' in archive.namelist():
+            last_needed = max(shared_needed)
+            with archive.open('xl/sharedStrings.xml') as stream:
+                index, parts = 0, []
+                for _, element in ElementTree.iterparse(stream):
+                    if element.tag == f'{SHEET_NS}t':
+                        parts.append(element.text or '')
+                    elif element.tag == f'{SHEET_NS}si':
+                        if index in shared_needed:
+                            shared[index] = ''.join(parts)
+                        index += 1
+                        parts = []
+                        if index > last_needed:
+                            break
+                    element.clear()
+
+    result = []
+    for row in rows:
+        width = max(row) + 1 if row else 0
+        cells = [''] * width
+        for column, (kind, value) in row.items():
+            cells[column] = shared.get(value, '') if kind == 's' else value
+        result.append(cells)
+    return result
+
+
+def _column_index(cell_ref):
+    letters = _COLUMN_RE.match(cell_ref)
+    index = 0
+    for letter in letters.group() if letters else 'A':
+        index = index * 26 + (ord(letter) - ord('A') + 1)
+    return index - 1
+
+
+def _csv_rows(path, max_rows, max_cols):
+    rows = []
+    with open(path, newline='', encoding='utf-8', errors='replace') as f:
+        for row in csv.reader(f):
+            rows.append(row[:max_cols])
+            if len(rows) >= max_rows:
+                break
+    return rows
+
+
+def _render_table(rows):
+    body = ''.join(
+        '<tr>' + ''.join(f'<td>{html.escape(str(cell))}</td>' for cell in row) + '</tr>'
+        for row in rows
+    )
+    note = (f'<p class="small text-muted px-3">Показаны первые {settings.PREVIEW_TABLE_ROWS} строк. '
+            f'Полная таблица — в скачанном файле.</p>' if len(rows) >= settings.PREVIEW_TABLE_ROWS else '')
+    return (
+        '<style>'
+        '.preview-table { width: 100%; border-collapse: collapse; }'
+        '.preview-table td { border: 1px solid #dee2e6; padding: 8px; font-family: monospace; }'
+        '</style>'
+        f'<div class="p-3 bg-white" style="overflow: auto; max-height: 80vh;">'
+        f'<table class="preview-table">{body}</table></div>{note}'
+    ).encode()
+
+
+def html_preview(doc, page=1):
+    """Путь к HTML-фрагменту превью (DOCX — страница page, таблицы — первые строки) или None."""
+    if doc.extension == '.docx':
+        path = _cache_path(_docx_page_key(doc, page), 'html')
+        if _cache_get(path):
+            return path
+        # Страницы генерируются все разом: номер последней известен только в конце
+        try:
+            pages = _docx_pages(tiering.hot_path(doc))
+        except Exception:
+            # Битый или необычный файл — как с миниатюрой: превью нет, файл можно скачать
+            return None
+        if not 1 <= page <= len(pages):
+            return None
+        for number, paragraphs in enumerate(pages, start=1):
+            _cache_put(
+                _cache_path(_docx_page_key(doc, number), 'html'),
+                _render_docx_page(doc, paragraphs, number, len(pages)),
+            )
+        return _cache_get(path)
+
+    if doc.extension in ('.xlsx', '.csv'):
+        path = _cache_path(_cache_key(doc, f'table-{settings.PREVIEW_TABLE_ROWS}'), 'html')
+        if _cache_get(path):
+            return path
+        reader = _xlsx_rows if doc.extension == '.xlsx' else _csv_rows
+        try:
+            rows = reader(tiering.hot_path(doc), settings.PREVIEW_TABLE_ROWS, settings.PREVIEW_TABLE_COLUMNS)
+        except Exception:
+            return None
+        _cache_put(path, _render_table(rows))
+        return path
+
+    return None
@@ -0,0 +1,116 @@
+import gzip
+import json
+import logging
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import AuditLog
+
+logger = logging.getLogger(__name__)
+
+
+# ==========================================
+# СРОК ХРАНЕНИЯ ЖУРНАЛА АУДИТА
+# ==========================================
+# Старые записи удаляются пачками по диапазону id (id BETWEEN a AND b),
+# каждая пачка — в своей короткой транзакции, с паузой между ними.
+# Так SQLite держит блокировку на запись миллисекунды, а не все время
+# очистки, и загрузки документов не ждут.
+#
+# Перед удалением записи можно сложить в архив: по файлу на месяц,
+# <AUDIT_ARCHIVE_DIR>/audit-ГГГГ-ММ.jsonl.gz. Каждая пачка дописывается
+# отдельным gzip-блоком — такой файл читают и zcat, и gzip.open.
+# Если упасть между архивом и удалением, при следующем запуске пачка
+# попадет в архив второй раз (дубль лучше потери).
+
+ARCHIVE_FIELDS = ('id', 'timestamp', 'user_id', 'user__username', 'action', 'document_title')
+
+
+def _archive_rows(archive_dir, rows):
+    by_month = {}
+    for row in rows:
+        by_month.setdefault(timezone.localtime(row['timestamp']).strftime('%Y-%m'), []).append(row)
+
+    os.makedirs(archive_dir, exist_ok=True)
+    for month, month_rows in by_month.items():
+        path = os.path.join(archive_dir, f"audit-{month}.jsonl.gz")
+        with open(path, 'ab') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb') as f:
+                for row in month_rows:
+                    f.write((json.dumps({
+                        'id': row['id'],
+                        'timestamp': row['timestamp'].isoformat(),
+                        'user_id': row['user_id'],
+                        'user': row['user__username'],
+                        'action': row['action'],
+                        'document': row['document_title'],
+                    }, ensure_ascii=False) + '\n').encode('utf-8'))
+            # Архив должен лечь на диск раньше, чем строки исчезнут из базы
+            raw.flush()
+            os.fsync(raw.fileno())
+
+
+def purge_audit_log(older_than=None, batch_size=None, archive_dir=None, dry_run=False):
+    """
+    Удаляет записи журнала старше older_than (timedelta, по умолчанию AUDIT_RETENTION_DAYS).
+    archive_dir — куда сложить их перед удалением (None — не архивировать).
+    Возвращает метрики: {'deleted', 'archived', 'batches', 'seconds'}.
+    """
+    if older_than is None:
+        older_than = timedelta(days=settings.AUDIT_RETENTION_DAYS)
+    batch_size = batch_size or settings.AUDIT_RETENTION_BATCH_SIZE
+    threshold = timezone.now() - older_than
+    expired = AuditLog.objects.filter(timestamp__lt=threshold)
+
+    started = time.monotonic()
+    stats = {'deleted': 0, 'archived': 0, 'batches': 0, 'seconds': 0.0}
+
+    if dry_run:
+        stats['deleted'] = expired.count()
+        stats['seconds'] = time.monotonic() - started
+        return stats
+
+    last_id = 0
+    while True:
+        batch = expired.filter(id__gt=last_id).order_by('id')
+        if archive_dir:
+            rows = list(batch.values(*ARCHIVE_FIELDS)[:batch_size])
+            ids = [row['id'] for row in rows]
+        else:
+            ids = list(batch.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            break
+
+        if archive_dir:
+            _archive_rows(archive_dir, rows)
+            stats['archived'] += len(rows)
+
+        # Новые записи получают id больше существующих, поэтому в диапазон
+        # [ids[0], ids[-1]] попадают ровно выбранные строки.
+        # У AuditLog нет сигналов и зависимых моделей — Django выполнит один
+        # DELETE ... WHERE, не загружая строки
+        with transaction.atomic():
+            deleted, _ = AuditLog.objects.filter(
+                id__gte=ids[0], id__lte=ids[-1], timestamp__lt=threshold,
+            ).delete()
+
+        stats['deleted'] += deleted
+        stats['batches'] += 1
+        last_id = ids[-1]
+
+        if len(ids) < batch_size:
+            break
+        # Даем вклиниться запросам приложения
+        time.sleep(settings.AUDIT_RETENTION_BATCH_PAUSE)
+
+    stats['seconds'] = time.monotonic() - started
+    logger.info(
+        "Очистка журнала аудита: удалено %s (в архив %s) за %.2f с, пачек: %s",
+        stats['deleted'], stats['archived'], stats['seconds'], stats['batches'],
+    )
+    return stats
@@ -0,0 +1,247 @@
+import logging
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import audit, orphans, previews, retention, search, tasks, tiering, uploads
+from .models import ScheduledJob
+
+logger = logging.getLogger(__name__)
+
+
+# ==========================================
+# ПЛАНИРОВЩИК ПЕРИОДИЧЕСКИХ ЗАДАНИЙ
+# ==========================================
+# Задание — функция, зарегистрированная через @job('имя', 'cron-расписание').
+# Расписание можно переопределить (или отключить, указав None) в
+# settings.SCHEDULER_JOBS. Запускает их python manage.py run_scheduler:
+# Django загружается один раз, задания выполняются в пуле потоков.
+#
+# Каждому заданию соответствует строка ScheduledJob. Запуск — условный
+# UPDATE "подошло время и замок свободен": если планировщиков запущено
+# несколько (или на нескольких серверах), задание выполнит только один,
+# и следующий запуск не начнется, пока не закончился предыдущий.
+
+REGISTRY = {}
+
+
+def job(name, schedule, timeout=3600):
+    """
+    Регистрирует периодическое задание.
+    timeout — через сколько секунд замок считается брошенным (планировщик упал).
+    """
+    def decorator(func):
+        REGISTRY[name] = (func, schedule, timeout)
+        return func
+    return decorator
+
+
+# ------------------------------------------
+# 1. РАСПИСАНИЕ В ФОРМАТЕ CRON
+# ------------------------------------------
+# "минуты часы дни_месяца месяцы дни_недели", например "*/20 * * * *"
+# или "30 3 * * 1-5". Поддерживаются *, */n, a-b, a-b/n и списки через запятую.
+# День недели: 0 или 7 — воскресенье. Время — локальное (TIME_ZONE).
+
+_FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+
+def _parse_field(text, low, high):
+    values = set()
+    for part in text.split(','):
+        step = 1
+        if '/' in part:
+            part, step_text = part.split('/', 1)
+            step = int(step_text)
+            if step < 1:
+                raise ValueError(f"Шаг должен быть больше нуля: {text}")
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = (int(x) for x in part.split('-', 1))
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end:
+            raise ValueError(f"Значение вне диапазона {low}-{high}: {text}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule:
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"В расписании должно быть 5 полей: {expression!r}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            _parse_field(text, low, high) for text, (low, high) in zip(fields, _FIELD_RANGES)
+        )
+        # 7 — тоже воскресенье; приводим к нумерации Python (пн=0 ... вс=6)
+        self.weekdays = {(d - 1) % 7 for d in weekdays}
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def _day_matches(self, dt):
+        # Как в cron: если заданы и число, и день недели — подходит любое из двух
+        in_month = dt.day in self.days
+        in_week = dt.weekday() in self.weekdays
+        if self.any_day or self.any_weekday:
+            return in_month and in_week
+        return in_month or in_week
+
+    def next_after(self, moment):
+        """Ближайший момент строго после moment, подходящий под расписание."""
+        dt = timezone.localtime(moment).replace(second=0, microsecond=0, tzinfo=None) + timedelta(minutes=1)
+        limit = dt + timedelta(days=366 * 5)
+        while dt < limit:
+            if dt.month not in self.months:
+                dt = (dt.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0)
+            elif not self._day_matches(dt):
+                dt = (dt + timedelta(days=1)).replace(hour=0, minute=0)
+            elif dt.hour not in self.hours:
+                dt = (dt + timedelta(hours=1)).replace(minute=0)
+            elif dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+            else:
+                return timezone.make_aware(dt)
+        raise ValueError(f"Расписание никогда не срабатывает: {self.expression!r}")
+
+
+# ------------------------------------------
+# 2. ЗАДАНИЯ
+# ------------------------------------------
+
+@job('cleanup_logs', '*/20 * * * *')
+def cleanup_logs():
+    # Срок хранения журнала аудита (раньше — run_scheduler.py + manage.py cleanup_logs)
+    return retention.purge_audit_log(archive_dir=settings.AUDIT_ARCHIVE_DIR)
+
+
+@job('recover_audit_journal', '*/5 * * * *', timeout=600)
+def recover_audit_journal():
+    # Записи аудита из журналов упавших процессов веб-сервера
+    return audit.writer.recover()
+
+
+@job('cleanup_upload_sessions', '15 * * * *')
+def cleanup_upload_sessions():
+    # Брошенные докачки и их недокачанные .part-файлы
+    return uploads.cleanup_stale_sessions()
+
+
+@job('purge_finished_tasks', '45 3 * * *', timeout=3600)
+def purge_finished_tasks():
+    # Строки выполненных фоновых задач (по одной на каждый загруженный файл)
+    return tasks.purge_finished_tasks()
+
+
+@job('enforce_preview_cache_limit', '*/5 * * * *')
+def enforce_preview_cache_limit():
+    return previews.enforce_cache_limit()
+
+
+@job('optimize_search_index', '30 3 * * *')
+def optimize_search_index():
+    search.optimize_index()
+
+
+@job('demote_idle_documents', '0 4 * * *', timeout=6 * 3600)
+def demote_idle_documents():
+    # Давно не открытые файлы — с локального диска в холодное хранилище
+    return tiering.demote_idle()
+
+
+@job('collect_orphan_files', '30 2 * * 0', timeout=6 * 3600)
+def collect_orphan_files():
+    # Файлы без ссылок из базы (удаленные документы, старые аватарки) — в карантин
+    return orphans.collect_orphans()
+
+
+# ------------------------------------------
+# 3. ЗАПУСК
+# ------------------------------------------
+
+def active_jobs():
+    """{имя: (функция, CronSchedule, timeout)} с учетом settings.SCHEDULER_JOBS."""
+    overrides = getattr(settings, 'SCHEDULER_JOBS', {})
+    jobs = {}
+    for name, (func, schedule, timeout) in REGISTRY.items():
+        schedule = overrides.get(name, schedule)
+        if schedule:
+            jobs[name] = (func, CronSchedule(schedule), timeout)
+    return jobs
+
+
+def sync_jobs(jobs):
+    """Создает строки ScheduledJob для новых заданий и пересчитывает время при смене расписания."""
+    now = timezone.now()
+    for name, (func, schedule, timeout) in jobs.items():
+        row, created = ScheduledJob.objects.get_or_create(
+            name=name, defaults={'schedule': schedule.expression, 'next_run_at': schedule.next_after(now)},
+        )
+        if not created and (row.schedule != schedule.expression or row.next_run_at is None):
+            ScheduledJob.objects.filter(pk=row.pk).update(
+                schedule=schedule.expression, next_run_at=schedule.next_after(now),
+            )
+
+
+def claim_job(name, schedule, timeout, worker_id, force=False):
+    """
+    Занимает задание, если подошло время и его никто не выполняет.
+    Сразу переносит next_run_at на следующий слот — второй планировщик
+    этот запуск уже не увидит.
+    """
+    now = timezone.now()
+    due = Q() if force else Q(next_run_at__lte=now)
+    free = Q(locked_until__isnull=True) | Q(locked_until__lt=now)
+    return bool(ScheduledJob.objects.filter(due, free, name=name).update(
+        next_run_at=schedule.next_after(now),
+        locked_by=worker_id,
+        locked_until=now + timedelta(seconds=timeout),
+        last_started_at=now,
+    ))
+
+
+def run_job(name, func, worker_id):
+    """Выполняет занятое задание и записывает длительность и итог. Возвращает True при успехе."""
+    started = time.monotonic()
+    result, error = None, ''
+    try:
+        result = func()
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning("Задание %s упало", name)
+    finally:
+        duration = time.monotonic() - started
+        ScheduledJob.objects.filter(name=name, locked_by=worker_id).update(
+            locked_by='', locked_until=None,
+            last_duration=duration,
+            last_status='failed' if error else 'ok',
+            last_result='' if result is None else str(result)[:1000],
+            last_error=error,
+            run_count=F('run_count') + 1,
+            failure_count=F('failure_count') + (1 if error else 0),
+        )
+        # Поток пула живет долго — соединение с базой закрываем сами
+        close_old_connections()
+    return not error
+
+
+def seconds_until_next(jobs):
+    """Сколько спать до ближайшего запуска (не больше минуты)."""
+    upcoming = (ScheduledJob.objects
+                .filter(name__in=list(jobs), next_run_at__isnull=False)
+                .order_by('next_run_at')
+                .values_list('next_run_at', flat=True)
+                .first())
+    if upcoming is None:
+        return 60.0
+    return min(max((upcoming - timezone.now()).total_seconds(), 0.5), 60.0)
+
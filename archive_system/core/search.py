@@ -0,0 +1,298 @@
+import csv
+import html
+import os
+import re
+import zipfile
+from xml.etree import ElementTree
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.safestring import mark_safe
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # pypdf не установлен — PDF индексируем только по названию
+    PdfReader = None
+
+
+# ==========================================
+# ПОЛНОТЕКСТОВЫЙ ПОИСК (SQLite FTS5)
+# ==========================================
+# Индекс — виртуальная таблица core_document_fts (см. миграцию 0007),
+# rowid в ней совпадает с id документа. В индекс попадает название
+# и текст, извлеченный из самого файла.
+#
+# Полная перестройка (manage.py rebuild_search_index) собирает индекс в
+# отдельной таблице REBUILD_TABLE и подменяет ею рабочую одной короткой
+# транзакцией: поиск все это время работает по старому индексу, а
+# упавшая перестройка его не трогает. Пока идет перестройка, изменения
+# документов пишутся в обе таблицы.
+
+FTS_TABLE = 'core_document_fts'
+REBUILD_TABLE = 'core_document_fts_rebuild'
+FTS_COLUMNS = "title, content, tokenize='unicode61 remove_diacritics 2', prefix='2 3'"
+
+# Маркеры подсветки: символы, которых не бывает в тексте.
+# Потом текст экранируется, а маркеры меняются на <mark>.
+_MARK_START = '\x02'
+_MARK_END = '\x03'
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+SHEET_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+
+def is_available():
+    """FTS5 есть только в SQLite. На других базах остается поиск по названию."""
+    return connection.vendor == 'sqlite'
+
+
+# ------------------------------------------
+# 1. ИЗВЛЕЧЕНИЕ ТЕКСТА ИЗ ФАЙЛОВ
+# ------------------------------------------
+
+class _TextLimit:
+    """Собирает куски текста, пока не наберется лимит символов."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.size = 0
+        self.parts = []
+
+    @property
+    def full(self):
+        return self.size >= self.limit
+
+    def add(self, text):
+        if text and not self.full:
+            text = text[:self.limit - self.size]
+            self.parts.append(text)
+            self.size += len(text)
+
+    def result(self):
+        return ' '.join(self.parts)
+
+
+def _iter_xml_text(archive, member, tag):
+    # iterparse + clear(): большие документы не собираются в дерево целиком
+    with archive.open(member) as stream:
+        for _, element in ElementTree.iterparse(stream):
+            if element.tag == tag:
+                yield element.text
+            element.clear()
+
+
+def _extract_docx(path, text):
+    with zipfile.ZipFile(path) as archive:
+        for chunk in _iter_xml_text(archive, 'word/document.xml', f'{WORD_NS}t'):
+            text.add(chunk)
+            if text.full:
+                return
+
+
+def _extract_xlsx(path, text):
+    # Весь текст ячеек Excel хранит в общей таблице строк
+    with zipfile.ZipFile(path) as archive:
+        if 'xl/sharedStrings.xml' not in archive.namelist():
+            return
+        for chunk in _iter_xml_text(archive, 'xl/sharedStrings.xml', f'{SHEET_NS}t'):
+            text.add(chunk)
+            if text.full:
+                return
+
+
+def _extract_csv(path, text):
+    with open(path, newline='', encoding='utf-8', errors='ignore') as f:
+        for row in csv.reader(f):
+            text.add(' '.join(row))
+            if text.full:
+                return
+
+
+def _extract_pdf(path, text):
+    if PdfReader is None:
+        return
+    for page in PdfReader(path).pages:
+        text.add(page.extract_text())
+        if text.full:
+            return
+
+
+EXTRACTORS = {
+    '.pdf': _extract_pdf,
+    '.docx': _extract_docx,
+    '.xlsx': _extract_xlsx,
+    '.csv': _extract_csv,
+    '.txt': _extract_csv,
+}
+
+
+def extract_text(path):
+    """Достает текст из файла. Неизвестный формат или битый файл -> пустая строка."""
+    extractor = EXTRACTORS.get(os.path.splitext(path)[1].lower())
+    if extractor is None:
+        return ''
+
+    text = _TextLimit(settings.SEARCH_MAX_TEXT_LENGTH)
+    try:
+        extractor(path, text)
+    except Exception:
+        # Битый/зашифрованный файл не должен ломать загрузку — ищем хотя бы по названию
+        pass
+    return text.result()
+
+
+def _document_text(doc):
+    # Импорт здесь: models импортирует search
+    from . import tiering
+    try:
+        # Файл из холодного хранилища читаем из временной копии, на диск не возвращаем
+        with tiering.readable_path(doc) as path:
+            return extract_text(path) if path else ''
+    except (ValueError, NotImplementedError):
+        # Нет файла или хранилище без локального пути
+        return ''
+
+
+# ------------------------------------------
+# 2. СИНХРОНИЗАЦИЯ ИНДЕКСА
+# ------------------------------------------
+
+def _live_tables(cursor):
+    # Рабочий индекс и, если сейчас идет перестройка, строящийся
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [REBUILD_TABLE])
+    return [FTS_TABLE, REBUILD_TABLE] if cursor.fetchone() else [FTS_TABLE]
+
+
+def _index_row(cursor, table, doc, content, extract):
+    if not extract:
+        cursor.execute(f'UPDATE {table} SET title = %s WHERE rowid = %s', [doc.title, doc.pk])
+        if cursor.rowcount:
+            return
+    cursor.execute(f'DELETE FROM {table} WHERE rowid = %s', [doc.pk])
+    cursor.execute(
+        f'INSERT INTO {table} (rowid, title, content) VALUES (%s, %s, %s)',
+        [doc.pk, doc.title, content],
+    )
+
+
+def index_document(doc, extract=True):
+    """
+    Добавляет/обновляет документ в индексе.
+    extract=False обновляет только название (при редактировании без замены файла);
+    текст файла нового или замененного файла извлекается фоновой задачей.
+    """
+    if not is_available():
+        return
+
+    content = _document_text(doc) if extract else ''
+    with connection.cursor() as cursor:
+        for table in _live_tables(cursor):
+            _index_row(cursor, table, doc, content, extract)
+
+
+def index_titles(docs):
+    """Названия новых документов одним запросом (массовая загрузка). Текст — фоновой задачей."""
+    if not is_available() or not docs:
+        return
+    with connection.cursor() as cursor:
+        for table in _live_tables(cursor):
+            cursor.executemany(
+                f'INSERT INTO {table} (rowid, title, content) VALUES (%s, %s, %s)',
+                [(doc.pk, doc.title, '') for doc in docs],
+            )
+
+
+def remove_document(doc_id):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        for table in _live_tables(cursor):
+            cursor.execute(f'DELETE FROM {table} WHERE rowid = %s', [doc_id])
+
+
+# ------------------------------------------
+# 3. ПЕРЕСТРОЙКА ИНДЕКСА
+# ------------------------------------------
+
+def start_rebuild():
+    """Создает пустой строящийся индекс (остатки прошлой упавшей перестройки удаляются)."""
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {REBUILD_TABLE}')
+        cursor.execute(f'CREATE VIRTUAL TABLE {REBUILD_TABLE} USING fts5({FTS_COLUMNS})')
+
+
+def rebuild_document(doc):
+    """Название и текст документа — только в строящийся индекс."""
+    with connection.cursor() as cursor:
+        _index_row(cursor, REBUILD_TABLE, doc, _document_text(doc), extract=True)
+
+
+def finish_rebuild():
+    """Подменяет рабочий индекс построенным — одной транзакцией."""
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Документы, удаленные, пока строки уже были в новом индексе
+        cursor.execute(f'DELETE FROM {REBUILD_TABLE} WHERE rowid NOT IN (SELECT id FROM core_document)')
+        cursor.execute(f'DROP TABLE {FTS_TABLE}')
+        cursor.execute(f'ALTER TABLE {REBUILD_TABLE} RENAME TO {FTS_TABLE}')
+
+
+def optimize_index():
+    """Сливает сегменты FTS5 в один — запросы после массовой переиндексации быстрее."""
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+
+
+# ------------------------------------------
+# 4. ПОИСК
+# ------------------------------------------
+
+def build_match_expression(query):
+    """
+    Превращает ввод пользователя в безопасное выражение FTS5:
+    каждое слово в кавычках (никакого синтаксиса FTS от пользователя)
+    и с * — поиск по началу слова. Слова объединяются через И.
+    """
+    words = _WORD_RE.findall(query)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def _highlight(snippet):
+    escaped = html.escape(snippet)
+    return mark_safe(escaped.replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>'))
+
+
+def search(query, limit=None, documents=None):
+    """
+    Возвращает список (id документа, подсвеченный фрагмент) по убыванию релевантности.
+    Название весит больше, чем текст файла.
+    documents — queryset документов, среди которых искать (категория, тип,
+    допуск): условия применяются в том же запросе до LIMIT, поэтому
+    совпадения вне фильтра не вытесняют подходящие из первых limit.
+    """
+    expression = build_match_expression(query)
+    if not expression:
+        return []
+
+    limit = limit or settings.SEARCH_MAX_RESULTS
+    scope, scope_params = '', []
+    if documents is not None:
+        subquery, scope_params = documents.order_by().values('id').query.sql_with_params()
+        scope = f'AND rowid IN ({subquery})'
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT rowid,
+                   snippet({FTS_TABLE}, -1, %s, %s, '…', %s)
+            FROM {FTS_TABLE}
+            WHERE {FTS_TABLE} MATCH %s {scope}
+            ORDER BY bm25({FTS_TABLE}, 10.0, 1.0)
+            LIMIT %s
+            """,
+            [_MARK_START, _MARK_END, settings.SEARCH_SNIPPET_WORDS, expression, *scope_params, limit],
+        )
+        return [(doc_id, _highlight(snippet)) for doc_id, snippet in cursor.fetchall()]
@@ -0,0 +1,248 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import caching
+from .models import ShareLink
+
+logger = logging.getLogger(__name__)
+
+
+# ==========================================
+# ПУБЛИЧНЫЕ ССЫЛКИ: СРОК, ЛИМИТ, ЧАСТОТА
+# ==========================================
+# Ссылку открывают без входа, поэтому утекшую ссылку может долбить
+# кто угодно. На каждое обращение:
+#   1. ссылка и документ — один запрос с select_related, горячие ссылки
+#      (и несуществующие токены) — из кэша на SHARE_LINK_CACHE_SECONDS;
+#   2. срок действия (expires_at) — 410;
+#   3. частота — token bucket на ссылку в кэше: SHARE_LINK_BURST
+#      скачиваний подряд, дальше SHARE_LINK_RATE в минуту — иначе 429;
+#   4. лимит скачиваний (max_downloads) — счетчик в кэше, 410 при исчерпании.
+#
+# Счетчик скачиваний в базе (download_count) обновляется не на каждое
+# скачивание, а в фоне: раз в SHARE_LINK_FLUSH_INTERVAL одним UPDATE на
+# пачку ссылок. Засчитывается каждый отданный GET (200/206), в том числе
+# докачка — иначе лимит обходился бы запросами с Range.
+#
+# С locmem-кэшем ведра и счетчики у каждого процесса свои: при N процессах
+# частота может быть до N раз выше заданной. Лимит скачиваний сверяется с
+# базой при первом обращении процесса к ссылке.
+
+
+def _link_key(token, version):
+    return f"share:link:{token}:{version}"
+
+
+def _used_key(link_id):
+    return f"share:used:{link_id}"
+
+
+def _bucket_key(token):
+    return f"share:bucket:{token}"
+
+
+# ------------------------------------------
+# 1. ПОИСК ССЫЛКИ
+# ------------------------------------------
+
+async def aresolve(token):
+    """ShareLink с загруженным document или None. Ключ зависит от версии документов."""
+    key = _link_key(token, await caching.aget_version('documents'))
+    link = await cache.aget(key)
+    if link is None:
+        try:
+            link = await ShareLink.objects.select_related('document').aget(token=token)
+        except ShareLink.DoesNotExist:
+            # Несуществующий токен тоже кэшируем — перебор токенов не доходит до базы
+            link = False
+        await cache.aset(key, link, settings.SHARE_LINK_CACHE_SECONDS)
+    return link or None
+
+
+def is_expired(link, now=None):
+    return link.expires_at is not None and link.expires_at <= (now or timezone.now())
+
+
+def get_or_create_link(document):
+    """
+    Действующая ссылка на документ или новая — со сроком и лимитом из настроек.
+    Переиспользуются только ссылки с ограничениями, как у новых: бессрочная
+    ссылка (выданная вручную в админке) не раздается повторно.
+    """
+    now = timezone.now()
+    days = settings.SHARE_LINK_TTL_DAYS
+    max_downloads = settings.SHARE_LINK_MAX_DOWNLOADS
+    links = ShareLink.objects.filter(document=document)
+    if days:
+        links = links.filter(expires_at__gt=now)
+    else:
+        links = links.filter(expires_at__isnull=True)
+    if max_downloads is not None:
+        links = links.filter(max_downloads__isnull=False, download_count__lt=F('max_downloads'))
+    else:
+        links = links.filter(max_downloads__isnull=True)
+
+    link = links.order_by('-created_at').first()
+    if link is None:
+        link = ShareLink.objects.create(
+            document=document,
+            expires_at=now + timedelta(days=days) if days else None,
+            max_downloads=max_downloads,
+        )
+    return link
+
+
+@receiver(post_save, sender=ShareLink)
+@receiver(post_delete, sender=ShareLink)
+def share_link_changed(sender, instance, **kwargs):
+    # Поменяли срок или лимит (или сбросили счетчик в админке) — забываем копии в кэше
+    cache.delete_many([_link_key(instance.token, caching.get_version('documents')), _used_key(instance.pk)])
+
+
+# ------------------------------------------
+# 2. ЧАСТОТА (TOKEN BUCKET)
+# ------------------------------------------
+
+async def athrottle(token):
+    """0 — запрос можно выполнить; иначе сколько секунд подождать."""
+    rate = settings.SHARE_LINK_RATE
+    if not rate:
+        return 0
+    per_second = rate / 60
+    burst = settings.SHARE_LINK_BURST
+    key = _bucket_key(token)
+    now = time.time()
+
+    tokens, stamp = await cache.aget(key) or (burst, now)
+    tokens = min(burst, tokens + (now - stamp) * per_second)
+    if tokens < 1:
+        # Ведро не трогаем: пополнение и так считается от stamp
+        return (1 - tokens) / per_second
+    # Ключ живет, пока ведро не наполнится снова, — дальше его отсутствие и есть "полное ведро"
+    await cache.aset(key, (tokens - 1, now), int(burst / per_second) + 1)
+    return 0
+
+
+# ------------------------------------------
+# 3. ЛИМИТ И СЧЕТЧИК СКАЧИВАНИЙ
+# ------------------------------------------
+
+async def areserve_download(link):
+    """Занимает одно скачивание из лимита. False — лимит исчерпан."""
+    if link.max_downloads is None:
+        return True
+    key = _used_key(link.pk)
+    if await cache.aget(key) is None:
+        # Процесс впервые видит ссылку (или счетчик вытеснили) — берем свежее значение из базы
+        used = await ShareLink.objects.filter(pk=link.pk).values_list('download_count', flat=True).afirst()
+        await cache.aadd(key, (used or 0) + counter.pending(link.pk), None)
+    try:
+        used = await cache.aincr(key)
+    except ValueError:
+        # Ключ вытеснили между add и incr — пропускаем, сверимся в следующий раз
+        return True
+    if used > link.max_downloads:
+        await cache.adecr(key)
+        return False
+    return True
+
+
+async def afinish_download(link, served):
+    """served — файл действительно отдан (200/206): засчитываем; иначе возвращаем занятое."""
+    if served:
+        counter.add(link.pk)
+    elif link.max_downloads is not None:
+        try:
+            await cache.adecr(_used_key(link.pk))
+        except ValueError:
+            pass
+
+
+class DownloadCounter:
+    """Копит скачивания в памяти процесса и пишет их в базу пачкой из фонового потока."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._counts = Counter()
+        self._thread = None
+        self._pid = None
+
+    def add(self, link_id):
+        with self._lock:
+            self._ensure_started()
+            self._counts[link_id] += 1
+
+    def pending(self, link_id):
+        with self._lock:
+            return self._counts.get(link_id, 0)
+
+    def _ensure_started(self):
+        # После fork у дочернего процесса свой поток (счетчики родителя он не наследует)
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        self._pid = os.getpid()
+        self._counts = Counter()
+        self._thread = threading.Thread(target=self._run, name='share-counter', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                self._wakeup.wait(timeout=settings.SHARE_LINK_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Не удалось записать счетчики скачиваний, повторим позже")
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        """Пишет накопленные счетчики в базу. Возвращает число засчитанных скачиваний."""
+        with self._flush_lock:
+            with self._lock:
+                counts, self._counts = self._counts, Counter()
+            if not counts:
+                return 0
+
+            # Один UPDATE на каждое встретившееся приращение, а не на каждую ссылку
+            by_increment = {}
+            for link_id, increment in counts.items():
+                by_increment.setdefault(increment, []).append(link_id)
+            try:
+                with transaction.atomic():
+                    for increment, link_ids in by_increment.items():
+                        ShareLink.objects.filter(pk__in=link_ids).update(
+                            download_count=F('download_count') + increment,
+                        )
+            except Exception:
+                # Вернем в очередь — запишем при следующем сбросе
+                with self._lock:
+                    self._counts.update(counts)
+                raise
+            return sum(counts.values())
+
+
+counter = DownloadCounter()
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        counter.flush()
+    except Exception:
+        logger.exception("Счетчики скачиваний по ссылкам не записаны при выходе")
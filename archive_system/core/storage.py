@@ -0,0 +1,252 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import FileSystemStorage
+
+try:
+    import boto3  # только для холодного хранилища в S3 / MinIO
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+
+
+# ==========================================
+# ХРАНИЛИЩЕ С ДЕДУПЛИКАЦИЕЙ (по SHA-256)
+# ==========================================
+# Файл документа сохраняется как blobs/ab/cd/<sha256><.расширение>.
+# Одинаковые файлы (повторная загрузка того же скана) ложатся в один
+# и тот же blob, а сколько документов на него ссылается, считает
+# модель StoredBlob — файл удаляется, когда уходит последняя ссылка.
+
+BLOB_PREFIX = 'blobs/'
+
+
+def blob_name(digest, extension):
+    # Расширение оставляем: по нему определяются MIME-тип и тип документа
+    return f"{BLOB_PREFIX}{digest[:2]}/{digest[2:4]}/{digest}{extension[:10]}"
+
+
+def is_blob_name(name):
+    return bool(name) and name.startswith(BLOB_PREFIX)
+
+
+def hash_file(fileobj, chunk_size=1024 * 1024):
+    """SHA-256 файла потоком, без чтения целиком в память."""
+    sha = hashlib.sha256()
+    for chunk in iter(lambda: fileobj.read(chunk_size), b''):
+        sha.update(chunk)
+    return sha.hexdigest()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def get_available_name(self, name, max_length=None):
+        # Имя все равно будет заменено на хэш в _save, подбирать свободное не нужно
+        return name
+
+    def _save(self, name, content):
+        tmp_dir = self.path(BLOB_PREFIX + 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+
+        # Пишем во временный файл и одновременно считаем хэш
+        sha = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                for chunk in content.chunks():
+                    sha.update(chunk)
+                    tmp.write(chunk)
+            return self.store_local_file(tmp_path, name, sha.hexdigest())
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def store_local_file(self, path, name, digest):
+        """
+        Забирает готовый файл с диска (хэш уже посчитан) в хранилище без повторного
+        чтения: переименованием, если blob новый, или удалением, если такой уже есть.
+        path должен лежать на той же файловой системе, что и MEDIA_ROOT.
+        """
+        from .models import StoredBlob
+
+        final_name = blob_name(digest, os.path.splitext(name)[1].lower())
+        final_path = self.path(final_name)
+        # Сначала пин в базе, потом проверка файла: удаление последней ссылки на
+        # этот же blob (StoredBlob.release) после пина файл не тронет
+        StoredBlob.pin(final_name, os.path.getsize(path))
+        if os.path.exists(final_path):
+            # Такой файл уже есть — дубликат не храним
+            os.remove(path)
+        else:
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(path, final_path)
+            if self.file_permissions_mode is not None:
+                os.chmod(final_path, self.file_permissions_mode)
+            StoredBlob._replicate([final_name])
+        return final_name
+
+    # Файлы, вытесненные в холодное хранилище (core/tiering.py), на диске
+    # отсутствуют, но для Django они по-прежнему существуют
+
+    def exists(self, name):
+        if super().exists(name):
+            return True
+        cold = get_cold_storage()
+        return cold is not None and is_blob_name(name) and cold.exists(name)
+
+    def size(self, name):
+        try:
+            return super().size(name)
+        except FileNotFoundError:
+            cold = get_cold_storage()
+            if cold is None or not is_blob_name(name):
+                raise
+            return cold.size(name)
+
+    def delete(self, name):
+        super().delete(name)
+        cold = get_cold_storage()
+        if cold is not None and is_blob_name(name):
+            cold.delete(name)
+
+
+# Без явного location следует за settings.MEDIA_ROOT
+document_storage = ContentAddressedStorage()
+
+
+def get_document_storage():
+    """Хранилище для Document.file (вызываемое — чтобы в миграции попала ссылка, а не объект)."""
+    return document_storage
+
+
+# ==========================================
+# ХОЛОДНОЕ ХРАНИЛИЩЕ (settings.DOCUMENT_COLD_STORAGE)
+# ==========================================
+# Копии blob-ов вне сервера приложения: давно не открытые файлы живут
+# только там, а на локальном диске — то, что открывают (см. core/tiering.py).
+# Бэкенд умеет немногое: положить файл, достать файл, проверить, удалить.
+# Время изменения файла сохраняется — от него зависит ETag при отдаче.
+#   {'BACKEND': 'filesystem', 'LOCATION': '/mnt/cold'}
+#   {'BACKEND': 's3', 'BUCKET': 'docuguard', 'PREFIX': 'blobs-cold/',
+#    'ENDPOINT_URL': 'http://minio:9000', 'ACCESS_KEY': '...', 'SECRET_KEY': '...', 'REGION': None}
+
+class FileSystemColdStorage:
+    """Холодный слой в каталоге (другой диск, смонтированный бакет, тестовый стенд)."""
+
+    def __init__(self, location):
+        self.location = str(location)
+
+    def _path(self, name):
+        return os.path.join(self.location, *name.split('/'))
+
+    def exists(self, name):
+        return os.path.isfile(self._path(name))
+
+    def size(self, name):
+        return os.path.getsize(self._path(name))
+
+    def upload(self, local_path, name):
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        os.close(fd)
+        try:
+            shutil.copy2(local_path, tmp_path)
+            with open(tmp_path, 'rb') as f:
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def download(self, name, local_path):
+        shutil.copy2(self._path(name), local_path)
+
+    def delete(self, name):
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            pass
+
+
+class S3ColdStorage:
+    """Холодный слой в S3-совместимом хранилище (AWS S3, MinIO, Ceph RGW)."""
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, access_key=None, secret_key=None, region=None):
+        if boto3 is None:
+            raise ImproperlyConfigured("Для DOCUMENT_COLD_STORAGE 's3' нужен пакет boto3")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client(
+            's3', endpoint_url=endpoint_url, region_name=region,
+            aws_access_key_id=access_key, aws_secret_access_key=secret_key,
+        )
+
+    def _key(self, name):
+        return self.prefix + name
+
+    def _head(self, name):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(name))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                raise FileNotFoundError(name)
+            raise
+
+    def exists(self, name):
+        try:
+            self._head(name)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def size(self, name):
+        return self._head(name)['ContentLength']
+
+    def upload(self, local_path, name):
+        mtime_ns = os.stat(local_path).st_mtime_ns
+        self.client.upload_file(local_path, self.bucket, self._key(name),
+                                ExtraArgs={'Metadata': {'mtime-ns': str(mtime_ns)}})
+
+    def download(self, name, local_path):
+        head = self._head(name)
+        self.client.download_file(self.bucket, self._key(name), local_path)
+        mtime_ns = head.get('Metadata', {}).get('mtime-ns')
+        if mtime_ns:
+            os.utime(local_path, ns=(int(mtime_ns), int(mtime_ns)))
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(name))
+
+
+_cold_storages = {}
+
+
+def get_cold_storage():
+    """Бэкенд холодного хранилища по settings.DOCUMENT_COLD_STORAGE или None, если его нет."""
+    config = getattr(settings, 'DOCUMENT_COLD_STORAGE', None)
+    if not config:
+        return None
+    key = repr(sorted(config.items()))
+    if key not in _cold_storages:
+        backend = config.get('BACKEND')
+        if backend == 'filesystem':
+            _cold_storages[key] = FileSystemColdStorage(config['LOCATION'])
+        elif backend == 's3':
+            _cold_storages[key] = S3ColdStorage(
+                config['BUCKET'],
+                prefix=config.get('PREFIX', ''),
+                endpoint_url=config.get('ENDPOINT_URL'),
+                access_key=config.get('ACCESS_KEY'),
+                secret_key=config.get('SECRET_KEY'),
+                region=config.get('REGION'),
+            )
+        else:
+            raise ImproperlyConfigured(f"Неизвестный BACKEND холодного хранилища: {backend!r}")
+    return _cold_storages[key]
@@ -0,0 +1,201 @@
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import bulk, previews, search, tiering, uploads
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+
+# ==========================================
+# ФОНОВЫЕ ЗАДАЧИ
+# ==========================================
+# Задача ставится в очередь через Task.enqueue('имя', document=doc, ...),
+# а выполняется воркером (python manage.py run_worker) — функцией,
+# зарегистрированной под этим именем через @register.
+#
+# started_at у выполняющейся задачи — "аренда": воркер продлевает ее
+# (heartbeat) раз в минуту, пока задача идет. Задачу без продления дольше
+# TASKS_STALE_AFTER_SECONDS requeue_stale_tasks считает брошенной — ее
+# воркер упал. Она возвращается в очередь, а если попытки кончились
+# (задача раз за разом роняет воркер) — помечается 'failed'. Выполненные задачи удаляет задание планировщика
+# purge_finished_tasks через TASKS_KEEP_DONE_DAYS / TASKS_KEEP_FAILED_DAYS.
+
+REGISTRY = {}
+
+
+def register(name, concurrency=None):
+    """
+    Регистрирует обработчик задачи.
+    concurrency — сколько таких задач может выполняться одновременно (None — без ограничения).
+    """
+    def decorator(func):
+        REGISTRY[name] = (func, concurrency)
+        return func
+    return decorator
+
+
+# ------------------------------------------
+# 1. ОБРАБОТЧИКИ
+# ------------------------------------------
+
+@register('index_document')
+def index_document(task):
+    # Извлечение текста из файла для полнотекстового поиска
+    if task.document is not None:
+        search.index_document(task.document)
+
+
+@register('generate_previews', concurrency=2)
+def generate_previews(task):
+    # Миниатюра готова заранее — первый просмотр списка не ждет Pillow/PDF
+    doc = task.document
+    if doc is not None and doc.file_kind in ('image', 'pdf'):
+        previews.thumbnail(doc)
+
+
+@register('replicate_blob', concurrency=4)
+def replicate_blob(task):
+    # Копия нового файла в холодном хранилище (core/tiering.py)
+    tiering.replicate(task.payload['blob'])
+
+
+@register('finalize_upload', concurrency=2)
+def finalize_upload(task):
+    # Проверка хэша и перенос докачанного файла в хранилище (core/uploads.py)
+    uploads.finalize(task.payload['session'])
+
+
+@register('delete_category', concurrency=1)
+def delete_category(task):
+    # Удаление категории вместе с документами, пачками (core/bulk.py)
+    bulk.delete_category_documents(task)
+
+
+# ------------------------------------------
+# 2. ВЫПОЛНЕНИЕ
+# ------------------------------------------
+
+def run_task(task):
+    """Выполняет задачу и записывает результат. При ошибке — повтор с задержкой или 'failed'."""
+    handler = REGISTRY.get(task.name)
+    # Итог пишем, только если задача все еще наша: ее могли вернуть в очередь и отдать другому воркеру
+    ours = Task.objects.filter(pk=task.pk, locked_by=task.locked_by)
+    try:
+        if handler is None:
+            raise LookupError(f"Неизвестная задача: {task.name}")
+        handler[0](task)
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning("Задача %s #%s упала (попытка %s)", task.name, task.pk, task.attempts)
+        if handler is not None and task.attempts < task.max_attempts:
+            delay = settings.TASKS_RETRY_DELAY_SECONDS * 2 ** max(task.attempts - 1, 0)
+            ours.update(
+                status='pending', run_after=timezone.now() + timedelta(seconds=delay),
+                last_error=error, locked_by='',
+            )
+        else:
+            ours.update(status='failed', finished_at=timezone.now(), last_error=error)
+        return False
+
+    ours.update(status='done', finished_at=timezone.now(), last_error='')
+    return True
+
+
+def run_task_in_thread(task):
+    # У каждого потока воркера свое соединение с базой — закрываем, чтобы не копились
+    try:
+        return run_task(task)
+    finally:
+        close_old_connections()
+
+
+def claim_tasks(worker_id, limit):
+    """
+    Забирает до limit готовых к выполнению задач.
+    Захват — условный UPDATE "pending -> running": если задачу уже взял
+    другой воркер, rowcount будет 0 и мы ее пропустим.
+    """
+    now = timezone.now()
+    candidates = (Task.objects
+                  .filter(status='pending', run_after__lte=now)
+                  .order_by('run_after', 'id')
+                  .values_list('id', 'name')[:limit * 4])
+
+    claimed = []
+    running = {}
+    for task_id, name in candidates:
+        if len(claimed) >= limit:
+            break
+
+        concurrency = REGISTRY.get(name, (None, None))[1]
+        if concurrency is not None:
+            if name not in running:
+                running[name] = Task.objects.filter(name=name, status='running').count()
+            if running[name] >= concurrency:
+                continue
+
+        updated = Task.objects.filter(pk=task_id, status='pending').update(
+            status='running', locked_by=worker_id, started_at=now, attempts=F('attempts') + 1,
+        )
+        if updated:
+            if name in running:
+                running[name] += 1
+            claimed.append(task_id)
+
+    return list(Task.objects.filter(pk__in=claimed).select_related('document'))
+
+
+def heartbeat(worker_id):
+    """Продлевает аренду задач, которые сейчас выполняет этот воркер. Возвращает их число."""
+    return Task.objects.filter(status='running', locked_by=worker_id).update(started_at=timezone.now())
+
+
+def requeue_stale_tasks():
+    """
+    Возвращает в очередь задачи, аренду которых давно не продлевали (воркер упал).
+    Задачи без оставшихся попыток помечает 'failed'. Возвращает число возвращенных.
+    """
+    now = timezone.now()
+    threshold = now - timedelta(seconds=settings.TASKS_STALE_AFTER_SECONDS)
+    stale = Task.objects.filter(status='running', started_at__lt=threshold)
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status='failed', finished_at=now, locked_by='',
+        last_error=f"Воркер не продлевал аренду дольше {settings.TASKS_STALE_AFTER_SECONDS} с, попытки исчерпаны",
+    )
+    if failed:
+        logger.error("Зависшие задачи без оставшихся попыток помечены как упавшие: %s", failed)
+    return stale.update(status='pending', locked_by='')
+
+
+# ------------------------------------------
+# 3. ОЧИСТКА
+# ------------------------------------------
+
+def purge_finished_tasks(batch_size=1000):
+    """
+    Удаляет выполненные задачи старше TASKS_KEEP_DONE_DAYS и упавшие старше
+    TASKS_KEEP_FAILED_DAYS — пачками, каждая в своей короткой транзакции.
+    Возвращает число удаленных.
+    """
+    now = timezone.now()
+    expired = (
+        Q(status='done', finished_at__lt=now - timedelta(days=settings.TASKS_KEEP_DONE_DAYS))
+        | Q(status='failed', finished_at__lt=now - timedelta(days=settings.TASKS_KEEP_FAILED_DAYS))
+    )
+    deleted = 0
+    while True:
+        ids = list(Task.objects.filter(expired).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            break
+        with transaction.atomic():
+            deleted += Task.objects.filter(expired, id__in=ids).delete()[0]
+        if len(ids) < batch_size:
+            break
+    return deleted
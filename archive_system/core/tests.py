@@ -1,3 +1,1566 @@
-from django.test import TestCase
+import gzip
+import importlib
+import importlib.util
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from datetime import datetime, timedelta
+from unittest import mock
+from urllib.parse import unquote
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.models import ProtectedError
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+
+from . import (
+    access, audit, avatars, bulk, caching, checks, delivery, orphans, previews, retention, scheduler, search,
+    tasks, tiering, uploads,
+)
+from .backends import ProfileBackend
+from .models import AuditLog, Category, Document, Profile, ScheduledJob, ShareLink, StoredBlob, Task, UploadSession
+from .pagination import encode_cursor, keyset_page
+from .sharing import get_or_create_link
+from .storage import get_document_storage
+
+
+class MediaTestCase(TestCase):
+    """Отдельный MEDIA_ROOT на каждый тест, журнал аудита — сразу в базу."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        overrides = override_settings(MEDIA_ROOT=self.media_root, AUDIT_SYNC=True)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        # Кэш процесса общий для всех тестов — версии и фрагменты прошлого теста не нужны
+        cache.clear()
+        self.user = User.objects.create_user('user', password='pw')
+
+    def make_document(self, content=b'content', filename='file.txt', **fields):
+        fields.setdefault('title', os.path.splitext(filename)[0])
+        return Document.objects.create(uploaded_by=self.user, file=SimpleUploadedFile(filename, content), **fields)
+
+    def blob_path(self, name):
+        return get_document_storage().path(name)
+
+
+# ==========================================
+# УЧЕТ ССЫЛОК НА ФАЙЛЫ (StoredBlob)
+# ==========================================
+
+class StoredBlobTests(MediaTestCase):
+
+    def unpin(self):
+        StoredBlob.objects.update(pinned_until=None)
+
+    def test_create_acquires_blob(self):
+        doc = self.make_document(b'one')
+        self.assertTrue(doc.file.name.startswith('blobs/'))
+        self.assertEqual(StoredBlob.objects.get(name=doc.file.name).ref_count, 1)
+        self.assertTrue(os.path.isfile(self.blob_path(doc.file.name)))
+
+    def test_same_content_is_stored_once(self):
+        first = self.make_document(b'same', 'a.txt')
+        second = self.make_document(b'same', 'b.txt')
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertEqual(StoredBlob.objects.get(name=first.file.name).ref_count, 2)
+        files = [name for _, _, names in os.walk(os.path.join(self.media_root, 'blobs'))
+                 for name in names if not name.startswith('tmp')]
+        self.assertEqual(len(files), 1)
+
+    def test_delete_removes_file_with_last_reference(self):
+        first = self.make_document(b'same')
+        second = self.make_document(b'same')
+        name = first.file.name
+        self.unpin()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(StoredBlob.objects.get(name=name).ref_count, 1)
+        self.assertTrue(os.path.isfile(self.blob_path(name)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(StoredBlob.objects.filter(name=name).exists())
+        self.assertFalse(os.path.exists(self.blob_path(name)))
+
+    def test_replacing_file_moves_reference(self):
+        doc = self.make_document(b'old')
+        old_name = doc.file.name
+        self.unpin()
+
+        doc = Document.objects.get(pk=doc.pk)
+        doc.file = SimpleUploadedFile('new.txt', b'new')
+        with self.captureOnCommitCallbacks(execute=True):
+            doc.save()
+
+        self.assertEqual(StoredBlob.objects.get(name=doc.file.name).ref_count, 1)
+        self.assertFalse(StoredBlob.objects.filter(name=old_name).exists())
+        self.assertFalse(os.path.exists(self.blob_path(old_name)))
+
+    def test_saving_without_file_change_keeps_references(self):
+        doc = self.make_document(b'content')
+        doc = Document.objects.only('id', 'title').get(pk=doc.pk)
+        doc.title = 'renamed'
+        doc.save(update_fields=['title'])
+        self.assertEqual(StoredBlob.objects.get().ref_count, 1)
+
+    def test_pinned_blob_survives_release_of_last_reference(self):
+        doc = self.make_document(b'racy')
+        name = doc.file.name
+        self.unpin()
+
+        # Последний документ удаляется, а тот же файл тем временем загружают снова:
+        # удаление файла после коммита должно увидеть пин и оставить файл
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            doc.delete()
+        stored = get_document_storage().save('again.txt', ContentFile(b'racy'))
+        for callback in callbacks:
+            callback()
+
+        self.assertEqual(stored, name)
+        self.assertTrue(os.path.isfile(self.blob_path(name)))
+        Document.objects.create(title='again', uploaded_by=self.user, file=stored)
+        self.assertEqual(StoredBlob.objects.get(name=name).ref_count, 1)
+
+    def test_purge_removes_expired_unreferenced_blobs(self):
+        name = get_document_storage().save('lost.txt', ContentFile(b'lost'))
+        self.assertEqual(StoredBlob.purge_unreferenced(), 0)  # пин еще действует
+        self.unpin()
+        self.assertEqual(StoredBlob.purge_unreferenced(), 1)
+        self.assertFalse(os.path.exists(self.blob_path(name)))
+
+
+# ==========================================
+# KEYSET-ПАГИНАЦИЯ
+# ==========================================
+
+MALFORMED_CURSORS = [
+    encode_cursor(['2020-01-01T00:00:00', 'abc']),
+    encode_cursor([[1], [2]]),
+    encode_cursor([None, None]),
+    encode_cursor(['не дата', 1]),
+    encode_cursor([1]),
+    'не-base64!!',
+]
+
+
+class KeysetPaginationTests(MediaTestCase):
+    ordering = ('-uploaded_at', '-id')
+
+    def setUp(self):
+        super().setUp()
+        self.docs = [self.make_document(f'doc {i}'.encode(), f'doc{i}.txt') for i in range(5)]
+
+    def test_pages_cover_all_rows_once(self):
+        seen, cursor = [], None
+        while True:
+            items, cursor = keyset_page(Document.objects.all(), self.ordering, cursor, page_size=2)
+            seen.extend(doc.pk for doc in items)
+            if cursor is None:
+                break
+        self.assertEqual(sorted(seen), sorted(doc.pk for doc in self.docs))
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_malformed_cursor_falls_back_to_first_page(self):
+        first, _ = keyset_page(Document.objects.all(), self.ordering, None, page_size=2)
+        for cursor in MALFORMED_CURSORS:
+            with self.subTest(cursor=cursor):
+                items, _ = keyset_page(Document.objects.all(), self.ordering, cursor, page_size=2)
+                self.assertEqual(items, first)
+
+    def test_views_ignore_malformed_cursor(self):
+        admin = User.objects.create_superuser('admin', password='pw')
+        AuditLog.objects.create(user=admin, action='Загрузка файла', document_title='x')
+        self.client.force_login(admin)
+        for cursor in MALFORMED_CURSORS:
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.client.get('/', {'cursor': cursor}, secure=True).status_code, 200)
+                self.assertEqual(self.client.get('/audit/', {'cursor': cursor}, secure=True).status_code, 200)
+
+
+# ==========================================
+# ТИП ФАЙЛА (колонки extension / file_kind)
+# ==========================================
+
+class FileKindTests(MediaTestCase):
+
+    def test_save_fills_kind_from_extension(self):
+        doc = self.make_document(b'x', 'Scan.JPEG')
+        self.assertEqual((doc.extension, doc.file_kind), ('.jpeg', 'image'))
+        self.assertEqual(self.make_document(b'y', 'notes.md').file_kind, 'other')
+
+    def test_replacing_file_updates_kind(self):
+        doc = self.make_document(b'x', 'report.pdf')
+        doc.file = SimpleUploadedFile('report.xlsx', b'new')
+        doc.save(update_fields=['file'])
+        self.assertEqual(Document.objects.values_list('extension', 'file_kind').get(), ('.xlsx', 'excel'))
+
+    def test_list_filters_by_kind(self):
+        self.make_document(b'1', 'a.pdf', title='PDF-отчет')
+        self.make_document(b'2', 'b.docx', title='Приказ')
+        self.client.force_login(self.user)
+        response = self.client.get('/', {'type': 'pdf'}, secure=True)
+        self.assertEqual([doc.title for doc in response.context['docs']], ['PDF-отчет'])
+
+    def test_migration_backfills_kind(self):
+        migration = importlib.import_module('core.migrations.0008_document_file_kind')
+        doc = self.make_document(b'x', 'table.csv')
+        Document.objects.update(extension='', file_kind='other')
+        migration.backfill_file_kind(apps, None)
+        self.assertEqual(Document.objects.values_list('extension', 'file_kind').get(pk=doc.pk), ('.csv', 'excel'))
+
+
+# ==========================================
+# ПОЛНОТЕКСТОВЫЙ ПОИСК
+# ==========================================
+
+class SearchTests(MediaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_superuser('admin', password='pw')
+        self.reports = Category.objects.create(name='Отчеты')
+        self.archive = Category.objects.create(name='Архив')
+
+    def flood(self, count, **fields):
+        # Много совпадений вне нужного фильтра, без файлов — только строки и индекс названий
+        docs = Document.objects.bulk_create([
+            Document(title=f'бюджет {i}', file=f'flood/{i}.txt', uploaded_by=self.admin, **fields)
+            for i in range(count)
+        ])
+        search.index_titles(docs)
+
+    def titles(self, response):
+        return [doc.title for doc in response.context['docs']]
+
+    def test_content_is_searchable(self):
+        doc = self.make_document('квартальный баланс склада'.encode(), 'report.txt', title='Отчет')
+        search.index_document(doc)
+        self.assertEqual([doc_id for doc_id, _ in search.search('баланс')], [doc.pk])
+        self.assertEqual([doc_id for doc_id, _ in search.search('балан')], [doc.pk])  # по началу слова
+        self.assertEqual(search.search('"; DROP TABLE'), search.search('DROP TABLE'))
+
+    def test_rebuild_keeps_old_index_until_swap(self):
+        doc = self.make_document('квартальный баланс'.encode(), 'report.txt', title='Отчет')
+        search.index_document(doc)
+
+        search.start_rebuild()
+        # Перестройка идет: поиск по старому индексу, новый документ попадает в оба
+        self.assertEqual([doc_id for doc_id, _ in search.search('баланс')], [doc.pk])
+        late = self.make_document(b'x', 'late.txt', title='Поздний')
+        search.rebuild_document(doc)
+        search.finish_rebuild()
+
+        self.assertEqual([doc_id for doc_id, _ in search.search('баланс')], [doc.pk])
+        self.assertEqual([doc_id for doc_id, _ in search.search('поздний')], [late.pk])
+
+    def test_rebuild_command(self):
+        doc = self.make_document('квартальный баланс'.encode(), 'report.txt', title='Отчет')
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        self.assertEqual([doc_id for doc_id, _ in search.search('баланс')], [doc.pk])
+
+    def test_replacing_file_requeues_extraction(self):
+        doc = self.make_document(b'old', 'a.txt')
+        Task.objects.all().delete()
+        doc = Document.objects.get(pk=doc.pk)
+        doc.title = 'renamed'
+        doc.save()
+        self.assertFalse(Task.objects.exists())
+
+        doc.file = SimpleUploadedFile('b.txt', b'new')
+        doc.save()
+        self.assertEqual(sorted(Task.objects.values_list('name', flat=True)), ['generate_previews', 'index_document'])
+
+    def test_out_of_scope_hits_do_not_hide_category_match(self):
+        self.flood(settings.SEARCH_MAX_RESULTS + 1, category=self.archive)
+        wanted = self.make_document(b'x', 'a.txt', title='бюджет отдела', category=self.reports)
+
+        hits = search.search('бюджет', documents=Document.objects.filter(category=self.reports))
+        self.assertEqual([doc_id for doc_id, _ in hits], [wanted.pk])
+
+        self.client.force_login(self.user)
+        response = self.client.get('/', {'q': 'бюджет', 'category': self.reports.pk}, secure=True)
+        self.assertEqual(self.titles(response), ['бюджет отдела'])
+
+    def test_secret_hits_do_not_hide_visible_match(self):
+        self.flood(settings.SEARCH_MAX_RESULTS + 1, security_level='secret')
+        self.make_document(b'x', 'a.txt', title='бюджет общий', security_level='public')
+
+        self.client.force_login(self.user)
+        response = self.client.get('/', {'q': 'бюджет'}, secure=True)
+        self.assertEqual(self.titles(response), ['бюджет общий'])
+
+
+# ==========================================
+# ПРАВА ДОСТУПА (гриф и допуск)
+# ==========================================
+
+def png_bytes(color='red'):
+    output = io.BytesIO()
+    Image.new('RGB', (40, 40), color).save(output, format='PNG')
+    return output.getvalue()
+
+
+class AccessTests(MediaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user('owner', password='pw')
+        self.docs = {
+            level: Document.objects.create(
+                title=level, security_level=level, uploaded_by=self.owner,
+                file=SimpleUploadedFile(f'{level}.png', png_bytes(color)),
+            )
+            for level, color in (('public', 'red'), ('internal', 'green'), ('secret', 'blue'))
+        }
+        self.client.force_login(self.user)
+
+    def listed(self):
+        response = self.client.get('/', secure=True)
+        return sorted(doc.title for doc in response.context['docs'])
+
+    def zipped(self):
+        response = self.client.get('/documents/download.zip', secure=True)
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as archive:
+            return sorted(archive.namelist())
+
+    def status(self, url):
+        return self.client.get(url, secure=True).status_code
+
+    def test_default_clearance_hides_secret_everywhere(self):
+        secret = self.docs['secret'].pk
+        self.assertEqual(self.listed(), ['internal', 'public'])
+        self.assertEqual(self.zipped(), ['internal.png', 'public.png'])
+        self.assertEqual(self.status(f'/document/{secret}/open/'), 404)
+        self.assertEqual(self.status(f'/document/{secret}/preview/thumb/'), 404)
+        self.assertEqual(self.status(f'/document/{secret}/preview/html/'), 404)
+        # Для сравнения: доступный документ открывается
+        self.assertEqual(self.status(f"/document/{self.docs['internal'].pk}/open/"), 200)
+        self.assertEqual(self.status(f"/document/{self.docs['internal'].pk}/preview/thumb/"), 200)
+
+    def test_external_user_sees_only_public(self):
+        self.user.groups.add(Group.objects.create(name='Внешние пользователи'))
+        self.assertEqual(self.listed(), ['public'])
+        self.assertEqual(self.zipped(), ['public.png'])
+        self.assertEqual(self.status(f"/document/{self.docs['internal'].pk}/open/"), 404)
+
+    def test_clearance_change_applies_without_waiting_for_cache(self):
+        self.assertEqual(self.listed(), ['internal', 'public'])
+        group = Group.objects.create(name='Секретный допуск')
+        self.user.groups.add(group)
+        self.assertEqual(self.listed(), ['internal', 'public', 'secret'])
+        self.assertEqual(self.status(f"/document/{self.docs['secret'].pk}/open/"), 200)
+
+        group.user_set.clear()
+        self.assertEqual(self.status(f"/document/{self.docs['secret'].pk}/open/"), 404)
+        self.assertEqual(self.zipped(), ['internal.png', 'public.png'])
+
+    def test_author_always_sees_own_documents(self):
+        self.client.force_login(self.owner)
+        self.owner.groups.add(Group.objects.create(name='Внешние пользователи'))
+        self.assertEqual(self.listed(), ['internal', 'public', 'secret'])
+        self.assertEqual(self.status(f"/document/{self.docs['secret'].pk}/open/"), 200)
+
+    def test_only_author_or_admin_can_manage(self):
+        doc = self.docs['public']
+        self.assertTrue(access.can_view(self.user, doc))
+        self.assertFalse(access.can_manage(self.user, doc))
+        self.assertTrue(access.can_manage(self.owner, doc))
+        self.client.post(f'/delete/{doc.pk}/', secure=True)
+        self.assertTrue(Document.objects.filter(pk=doc.pk).exists())
+        self.client.force_login(self.owner)
+        self.client.post(f'/delete/{doc.pk}/', secure=True)
+        self.assertFalse(Document.objects.filter(pk=doc.pk).exists())
+
+
+# ==========================================
+# КЭШ СПИСКА ДОКУМЕНТОВ И КАТЕГОРИЙ
+# ==========================================
+
+class CachingTests(MediaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def page(self, **params):
+        return self.client.get('/', params, secure=True).content.decode()
+
+    def test_categories_are_cached_until_changed(self):
+        Category.objects.create(name='Отчеты')
+        self.assertEqual([c.name for c in caching.get_categories()], ['Отчеты'])
+        with self.assertNumQueries(0):
+            caching.get_categories()
+        Category.objects.create(name='Приказы')
+        self.assertEqual(sorted(c.name for c in caching.get_categories()), ['Отчеты', 'Приказы'])
+
+    def test_table_is_served_from_cache_until_documents_change(self):
+        doc = self.make_document(title='Старое название')
+        self.assertIn('Старое название', self.page())
+
+        # UPDATE мимо save() версию не меняет — таблица из кэша
+        Document.objects.filter(pk=doc.pk).update(title='Тихая правка')
+        self.assertIn('Старое название', self.page())
+        # Другие фильтры — другой ключ
+        self.assertIn('Тихая правка', self.page(sort='name_asc'))
+
+        doc = Document.objects.get(pk=doc.pk)
+        doc.title = 'Новое название'
+        doc.save()
+        self.assertIn('Новое название', self.page())
+
+    def test_table_key_follows_categories(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        access_info = access.get_access(self.user)
+        key = caching.document_table_key(request, access_info)
+        category = Category.objects.create(name='Отчеты')
+        self.assertNotEqual(caching.document_table_key(request, access_info), key)
+        key = caching.document_table_key(request, access_info)
+        category.name = 'Акты'
+        category.save()
+        self.assertNotEqual(caching.document_table_key(request, access_info), key)
+
+    def test_search_results_are_not_cached(self):
+        doc = self.make_document(title='бюджет')
+        search.index_document(doc)
+        self.assertIn('бюджет', self.page(q='бюджет'))
+        Document.objects.filter(pk=doc.pk).update(title='бюджет 2')
+        self.assertIn('бюджет 2', self.page(q='бюджет'))
+
+
+# ==========================================
+# ПУБЛИЧНЫЕ ССЫЛКИ
+# ==========================================
+
+@override_settings(SHARE_LINK_TTL_DAYS=7, SHARE_LINK_MAX_DOWNLOADS=100)
+class ShareLinkTests(MediaTestCase):
+
+    def test_new_link_gets_limits(self):
+        link = get_or_create_link(self.make_document())
+        self.assertIsNotNone(link.expires_at)
+        self.assertEqual(link.max_downloads, 100)
+
+    def test_link_is_reused(self):
+        doc = self.make_document()
+        self.assertEqual(get_or_create_link(doc), get_or_create_link(doc))
+
+    def test_unlimited_link_is_not_reused(self):
+        doc = self.make_document()
+        legacy = ShareLink.objects.create(document=doc)
+        link = get_or_create_link(doc)
+        self.assertNotEqual(link, legacy)
+        self.assertEqual(link.max_downloads, 100)
+
+    def test_migration_backfills_legacy_links(self):
+        migration = importlib.import_module('core.migrations.0021_backfill_share_link_limits')
+
+        legacy = ShareLink.objects.create(document=self.make_document())
+        # Ссылка выдана давно — срок все равно отсчитывается от миграции
+        ShareLink.objects.filter(pk=legacy.pk).update(created_at=timezone.now() - timedelta(days=30))
+        before = timezone.now()
+        migration.limit_legacy_links(apps, None)
+        legacy.refresh_from_db()
+        self.assertEqual(legacy.max_downloads, 100)
+        self.assertGreaterEqual(legacy.expires_at, before + timedelta(days=7))
+        self.assertLessEqual(legacy.expires_at, timezone.now() + timedelta(days=7))
+
+
+# ==========================================
+# ПРЕДПРОСМОТР
+# ==========================================
+
+def make_docx(paragraphs):
+    body = ''.join(f'<w:p><w:r><w:t>{text}</w:t></w:r></w:p>' for text in paragraphs)
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, 'w') as archive:
+        archive.writestr('word/document.xml', (
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+            f'<w:body>{body}</w:body></w:document>'
+        ))
+    return output.getvalue()
+
+
+@override_settings(PREVIEW_DOCX_PARAGRAPHS_PER_PAGE=1)
+class PreviewTests(MediaTestCase):
+
+    def test_docx_pages_link_to_own_document(self):
+        content = make_docx(['первая', 'вторая'])
+        first = self.make_document(content, 'a.docx')
+        second = self.make_document(content, 'b.docx')
+        self.assertEqual(first.file.name, second.file.name)
+
+        for doc in (first, second):
+            with open(previews.html_preview(doc, 1), encoding='utf-8') as f:
+                page = f.read()
+            self.assertIn(f'/document/{doc.pk}/preview/html/?page=2', page)
+
+    def test_unexpected_parser_error_means_no_preview(self):
+        docx = self.make_document(make_docx(['первая']), 'a.docx')
+        table = self.make_document(b'a;b\n1;2\n', 'a.csv')
+        with mock.patch.object(previews, '_docx_pages', side_effect=RuntimeError), \
+                mock.patch.object(previews, '_csv_rows', side_effect=RuntimeError):
+            self.assertIsNone(previews.html_preview(docx, 1))
+            self.assertIsNone(previews.html_preview(table))
+
+
+# ==========================================
+# МАССОВАЯ ЗАГРУЗКА ИЗ ZIP
+# ==========================================
+
+def make_zip(files, **header_fields):
+    """
+    ZIP с файлами files. header_fields — поля, которые надо подменить в
+    заголовках каждого файла (flag_bits, compress_type): так получаются
+    архивы, которые zipfile сам записать не даст.
+    """
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in files.items():
+            archive.writestr(name, content)
+    data = bytearray(output.getvalue())
+
+    # Смещения полей: в локальном заголовке и в центральном каталоге
+    offsets = {'flag_bits': (6, 8), 'compress_type': (8, 10)}
+    for field, value in header_fields.items():
+        for signature, offset in zip((b'PK\x03\x04', b'PK\x01\x02'), offsets[field]):
+            position = data.find(signature)
+            while position != -1:
+                data[position + offset:position + offset + 2] = value.to_bytes(2, 'little')
+                position = data.find(signature, position + 1)
+    return bytes(data)
+
+
+class BulkZipTests(MediaTestCase):
+
+    def upload(self, data):
+        return bulk.store_files(bulk.iter_zip_files(io.BytesIO(data)))
+
+    def assertBulkError(self, data, message):
+        with self.assertRaisesMessage(bulk.BulkError, message):
+            self.upload(data)
+
+    def test_good_archive(self):
+        stored = self.upload(make_zip({'a.txt': b'a', 'b.txt': b'b'}))
+        self.assertEqual([name for name, _ in stored], ['a.txt', 'b.txt'])
+
+    def test_encrypted_member(self):
+        self.assertBulkError(make_zip({'secret.txt': b'x'}, flag_bits=0x1), 'secret.txt» в архиве защищен паролем')
+
+    def test_unsupported_compression(self):
+        self.assertBulkError(make_zip({'a.txt': b'a'}, compress_type=99), 'a.txt» сжат неподдерживаемым методом')
+
+    def test_bad_crc(self):
+        content = b'hello ' * 1000
+        data = bytearray(make_zip({'a.txt': content}))
+        crc = zipfile.crc32(content).to_bytes(4, 'little')
+        data[:] = data.replace(crc, bytes(4))
+        self.assertBulkError(bytes(data), 'a.txt» в архиве поврежден')
+
+    def test_view_reports_error(self):
+        self.client.force_login(self.user)
+        archive = SimpleUploadedFile('docs.zip', make_zip({'secret.txt': b'x'}, flag_bits=0x1))
+        response = self.client.post('/upload/bulk/', {'archive': archive, 'security_level': 'public'},
+                                    headers={'Accept': 'application/json'}, secure=True)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('защищен паролем', response.json()['error'])
+        self.assertFalse(Document.objects.exists())
+
+
+# ==========================================
+# ЖУРНАЛ АУДИТА
+# ==========================================
+
+class AuditJournalTests(MediaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.journal_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.journal_dir, ignore_errors=True)
+        overrides = override_settings(AUDIT_SYNC=False, AUDIT_JOURNAL_DIR=self.journal_dir, AUDIT_BATCH_SIZE=1000)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        # Писатель без фонового потока: сбрасываем в базу сами
+        self.writer = audit.AuditWriter()
+        self.writer._pid = os.getpid()
+        self.writer._thread = True
+        self.addCleanup(lambda: self.writer._journal and self.writer._journal.close())
+
+    def journal(self, pid, age=0):
+        path = os.path.join(self.journal_dir, f'audit-{pid}.jsonl')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('{"user_id": null, "action": "Загрузка файла", "document_title": "x", '
+                    '"timestamp": "2026-01-01T00:00:00+00:00"}\n')
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_failed_rename_keeps_writing(self):
+        self.writer.log(self.user, 'Загрузка файла', 'first')
+        with mock.patch('core.audit.os.replace', side_effect=OSError('disk')):
+            with self.assertRaises(OSError):
+                self.writer.flush()
+        self.assertFalse(self.writer._journal.closed)
+
+        self.writer.log(self.user, 'Загрузка файла', 'second')
+        self.assertEqual(self.writer.flush(), 2)
+        self.assertEqual(sorted(AuditLog.objects.values_list('document_title', flat=True)), ['first', 'second'])
+
+    def test_recover_skips_recently_updated_journals(self):
+        # Номер родительского процесса заведомо занят живым процессом
+        fresh = self.journal(os.getppid())
+        self.assertEqual(self.writer.recover(), 0)
+        self.assertTrue(os.path.exists(fresh))
+
+    def test_recover_picks_up_stale_journal_of_live_pid(self):
+        stale = self.journal(os.getppid(), age=3600)
+        with self.assertLogs('core.audit', 'WARNING'):
+            self.assertEqual(self.writer.recover(), 1)
+        self.assertFalse(os.path.exists(stale))
+        self.assertEqual(AuditLog.objects.get().document_title, 'x')
+
+    def test_bad_batch_is_set_aside(self):
+        bad = os.path.join(self.journal_dir, f'audit-{os.getpid()}.jsonl.1.flushing')
+        with open(bad, 'w', encoding='utf-8') as f:
+            # Строка читается, но записи без обязательных полей в базу не попадут
+            f.write('{"user_id": null, "action": "Загрузка файла"}\n')
+        self.writer.log(self.user, 'Загрузка файла', 'good')
+        with self.assertLogs('core.audit', 'ERROR'):
+            self.assertEqual(self.writer.flush(), 1)
+        self.assertTrue(os.path.exists(bad + '.failed'))
+        self.assertEqual(AuditLog.objects.get().document_title, 'good')
+        # Отложенный файл больше не мешает ни сбросу, ни подбору
+        self.assertEqual(self.writer.flush(), 0)
+        self.assertEqual(self.writer.recover(force=True), 0)
+
+    def test_deleted_user_is_kept_as_null(self):
+        gone = User.objects.create_user('gone', password='x')
+        self.writer.log(gone, 'Удаление файла', 'report')
+        gone.delete()
+        self.assertEqual(self.writer.flush(), 1)
+        self.assertIsNone(AuditLog.objects.get().user_id)
+
+    def test_recover_claims_journal_before_replay(self):
+        stale = self.journal(os.getppid(), age=3600)
+        seen = []
+        replay_file = audit.replay_file
+
+        def replay(path):
+            # Во время записи в базу другой процесс файла под старым именем уже не найдет
+            seen.append(os.path.exists(stale))
+            return replay_file(path)
+
+        # Второй процесс получил тот же список файлов, но первый уже забрал файл
+        with mock.patch('core.audit.glob.glob', return_value=[stale, stale]), \
+                mock.patch('core.audit.replay_file', side_effect=replay), \
+                self.assertLogs('core.audit', 'WARNING'):
+            self.assertEqual(self.writer.recover(), 1)
+        self.assertEqual(seen, [False])
+        self.assertEqual(AuditLog.objects.count(), 1)
+        self.assertEqual(os.listdir(self.journal_dir), [])
+
+
+# ==========================================
+# ПРОСМОТР ЖУРНАЛА АУДИТА
+# ==========================================
+
+@override_settings(AUDIT_LOG_PAGE_SIZE=2)
+class AuditLogViewTests(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', password='pw')
+        self.other = User.objects.create_user('other', password='pw')
+        now = timezone.now()
+        AuditLog.objects.bulk_create([
+            AuditLog(user=self.admin, action='Загрузка файла', document_title='a', timestamp=now - timedelta(days=10)),
+            AuditLog(user=self.other, action='Удаление файла', document_title='b', timestamp=now - timedelta(days=2)),
+            AuditLog(user=self.admin, action='Редактирование', document_title='c', timestamp=now - timedelta(days=1)),
+            AuditLog(user=self.other, action='Загрузка файла', document_title='d', timestamp=now),
+        ])
+        self.client.force_login(self.admin)
+
+    def titles(self, params=None):
+        response = self.client.get('/audit/', params or {}, secure=True)
+        return [log.document_title for log in response.context['logs']], response.context['next_page_url']
+
+    def test_only_superuser_sees_log(self):
+        self.client.force_login(self.other)
+        self.assertEqual(self.client.get('/audit/', secure=True).status_code, 302)
+
+    def test_pages_go_newest_first(self):
+        titles, next_page_url = self.titles()
+        self.assertEqual(titles, ['d', 'c'])
+        response = self.client.get('/audit/' + next_page_url, secure=True)
+        self.assertEqual([log.document_title for log in response.context['logs']], ['b', 'a'])
+        self.assertIsNone(response.context['next_page_url'])
+
+    def test_filters(self):
+        self.assertEqual(self.titles({'user': self.other.pk})[0], ['d', 'b'])
+        self.assertEqual(self.titles({'action': 'Загрузка файла'})[0], ['d', 'a'])
+        week_ago = (timezone.localdate() - timedelta(days=7)).isoformat()
+        self.assertEqual(self.titles({'date_to': week_ago})[0], ['a'])
+        # Чужие фильтры (текст вместо id, кривая дата) не ломают страницу
+        self.assertEqual(self.titles({'user': 'x', 'date_from': '2026-13-45'})[0], ['d', 'c'])
+
+    def test_export_streams_all_filtered_rows(self):
+        response = self.client.get('/audit/', {'export': 'csv', 'user': self.admin.pk}, secure=True)
+        self.assertTrue(response.streaming)
+        rows = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(len(rows), 3)
+        self.assertIn('Редактирование', rows[1])
+
+        response = self.client.get('/audit/', {'export': 'jsonl'}, secure=True)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['document'] for line in lines], ['d', 'c', 'b', 'a'])
+
+
+# ==========================================
+# СРОК ХРАНЕНИЯ ЖУРНАЛА АУДИТА
+# ==========================================
+
+@override_settings(AUDIT_RETENTION_DAYS=30, AUDIT_RETENTION_BATCH_PAUSE=0)
+class AuditRetentionTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('user', password='pw')
+        now = timezone.now()
+        AuditLog.objects.bulk_create(
+            [AuditLog(user=self.user, action='Загрузка файла', document_title=f'old {i}',
+                      timestamp=now - timedelta(days=40 + i)) for i in range(5)]
+            + [AuditLog(user=self.user, action='Загрузка файла', document_title='fresh', timestamp=now)]
+        )
+
+    def test_purge_in_batches_keeps_fresh_rows(self):
+        stats = retention.purge_audit_log(batch_size=2)
+        self.assertEqual((stats['deleted'], stats['batches']), (5, 3))
+        self.assertEqual(list(AuditLog.objects.values_list('document_title', flat=True)), ['fresh'])
+
+    def test_dry_run_deletes_nothing(self):
+        self.assertEqual(retention.purge_audit_log(dry_run=True)['deleted'], 5)
+        self.assertEqual(AuditLog.objects.count(), 6)
+
+    def test_archive_before_delete(self):
+        archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_dir, ignore_errors=True)
+        stats = retention.purge_audit_log(batch_size=2, archive_dir=archive_dir)
+        self.assertEqual(stats['archived'], 5)
+
+        archived = []
+        for name in os.listdir(archive_dir):
+            self.assertRegex(name, r'^audit-\d{4}-\d{2}\.jsonl\.gz$')
+            # Каждая пачка — отдельный gzip-блок, файл читается целиком
+            with gzip.open(os.path.join(archive_dir, name), 'rt', encoding='utf-8') as f:
+                archived.extend(json.loads(line) for line in f)
+        self.assertEqual(sorted(row['document'] for row in archived), [f'old {i}' for i in range(5)])
+        self.assertEqual({row['user'] for row in archived}, {'user'})
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('cleanup_logs', '--days', '41.5', stdout=out)
+        self.assertIn('Удалено записей: 3', out.getvalue())
+
+
+# ==========================================
+# ПЛАНИРОВЩИК
+# ==========================================
+
+def local_moment(*args):
+    return timezone.make_aware(datetime(*args))
+
+
+class CronScheduleTests(TestCase):
+
+    def test_next_after(self):
+        cases = [
+            ('*/20 * * * *', local_moment(2026, 3, 4, 10, 5), local_moment(2026, 3, 4, 10, 20)),
+            ('*/20 * * * *', local_moment(2026, 3, 4, 10, 20), local_moment(2026, 3, 4, 10, 40)),
+            ('0 3 * * *', local_moment(2026, 12, 31, 23, 59), local_moment(2027, 1, 1, 3, 0)),
+            # Суббота -> понедельник
+            ('30 3 * * 1-5', local_moment(2026, 3, 7, 12, 0), local_moment(2026, 3, 9, 3, 30)),
+            ('0 0 * * 7', local_moment(2026, 3, 4, 0, 0), local_moment(2026, 3, 8, 0, 0)),
+        ]
+        for expression, moment, expected in cases:
+            with self.subTest(expression=expression, moment=moment):
+                self.assertEqual(scheduler.CronSchedule(expression).next_after(moment), expected)
+
+    def test_invalid_expressions(self):
+        for expression in ('* * * *', '60 * * * *', '*/0 * * * *', '0 0 31 2 *'):
+            with self.subTest(expression=expression), self.assertRaises(ValueError):
+                scheduler.CronSchedule(expression).next_after(timezone.now())
+
+
+@mock.patch('core.scheduler.close_old_connections')
+class SchedulerTests(TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.jobs = {'test_job': (lambda: self.calls.append(1) or 'готово', scheduler.CronSchedule('*/5 * * * *'), 60)}
+        scheduler.sync_jobs(self.jobs)
+        ScheduledJob.objects.update(next_run_at=timezone.now() - timedelta(minutes=1))
+
+    def claim(self, worker_id, **kwargs):
+        func, schedule, timeout = self.jobs['test_job']
+        return scheduler.claim_job('test_job', schedule, timeout, worker_id, **kwargs)
+
+    def test_due_job_runs_once(self, _close):
+        self.assertTrue(self.claim('a'))
+        # Второй планировщик: задание занято, а следующий запуск уже перенесен
+        self.assertFalse(self.claim('b'))
+        self.assertTrue(scheduler.run_job('test_job', self.jobs['test_job'][0], 'a'))
+
+        row = ScheduledJob.objects.get()
+        self.assertEqual(self.calls, [1])
+        self.assertEqual((row.last_status, row.last_result, row.run_count, row.locked_by), ('ok', 'готово', 1, ''))
+        self.assertGreater(row.next_run_at, timezone.now())
+        self.assertFalse(self.claim('b'))
+        self.assertTrue(self.claim('b', force=True))
+
+    def test_stale_lock_is_taken_over(self, _close):
+        self.claim('dead')
+        ScheduledJob.objects.update(next_run_at=timezone.now(), locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertTrue(self.claim('alive'))
+
+    def test_failure_is_recorded(self, _close):
+        self.claim('a')
+        with self.assertLogs('core.scheduler', 'WARNING'):
+            self.assertFalse(scheduler.run_job('test_job', lambda: 1 / 0, 'a'))
+        row = ScheduledJob.objects.get()
+        self.assertEqual((row.last_status, row.failure_count, row.locked_until), ('failed', 1, None))
+        self.assertIn('ZeroDivisionError', row.last_error)
+
+    def test_settings_override_schedule(self, _close):
+        with override_settings(SCHEDULER_JOBS={'cleanup_logs': None, 'purge_finished_tasks': '0 4 * * *'}):
+            jobs = scheduler.active_jobs()
+        self.assertNotIn('cleanup_logs', jobs)
+        self.assertEqual(jobs['purge_finished_tasks'][1].expression, '0 4 * * *')
+
+
+# ==========================================
+# ДОКАЧИВАЕМАЯ ЗАГРУЗКА
+# ==========================================
+
+class UploadSessionTests(MediaTestCase):
+    content = b'resumable upload'
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+        response = self.client.post('/upload/sessions/', {
+            'title': 'big', 'security_level': 'public', 'filename': 'big.txt', 'size': len(self.content),
+        }, secure=True)
+        self.session = UploadSession.objects.get(pk=response.json()['id'])
+        self.client.patch(f'/upload/sessions/{self.session.pk}/', self.content, content_type='application/offset+octet-stream',
+                          headers={'Upload-Offset': '0'}, secure=True)
+
+    def finalize(self):
+        return self.client.post(f'/upload/sessions/{self.session.pk}/finalize/', secure=True)
+
+    def run_finalize_task(self):
+        task = Task.objects.get(name='finalize_upload')
+        task.attempts += 1
+        return tasks.run_task(task)
+
+    def test_finalize_creates_document_once(self):
+        # Хэш считает задача, запрос только ставит ее в очередь
+        self.assertEqual(self.finalize().status_code, 202)
+        self.assertEqual(self.finalize().status_code, 202)
+        self.assertEqual(Task.objects.filter(name='finalize_upload').count(), 1)
+        self.assertFalse(Document.objects.exists())
+
+        self.assertTrue(self.run_finalize_task())
+        first = self.finalize()
+        self.assertEqual(first.status_code, 201)
+        again = self.finalize()
+        self.assertEqual(again.json()['document_id'], first.json()['document_id'])
+
+        doc = Document.objects.get()
+        self.assertEqual(doc.uploaded_by, self.user)
+        with doc.file.open('rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertEqual(AuditLog.objects.get().action, 'Загрузка файла')
+
+    def test_concurrent_finalize_is_rejected(self):
+        # Еще пишется последний кусок — его замок на сеансе
+        UploadSession.objects.filter(pk=self.session.pk).update(locked_at=timezone.now())
+        self.assertEqual(self.finalize().status_code, 409)
+        self.assertFalse(Task.objects.filter(name='finalize_upload').exists())
+
+    def test_retry_after_file_was_moved(self):
+        # Прошлая попытка перенесла файл в хранилище и упала до создания документа
+        self.finalize()
+        with mock.patch('core.uploads.Document.save', side_effect=OSError('disk')), \
+                self.assertLogs('core.tasks', 'WARNING'):
+            self.assertFalse(self.run_finalize_task())
+        self.assertFalse(os.path.exists(uploads.part_path(self.session)))
+
+        self.assertTrue(self.run_finalize_task())
+        self.assertEqual(self.finalize().status_code, 201)
+        with Document.objects.get().file.open('rb') as f:
+            self.assertEqual(f.read(), self.content)
+
+    def test_wrong_hash_is_reported(self):
+        UploadSession.objects.filter(pk=self.session.pk).update(sha256='0' * 64)
+        self.finalize()
+        self.run_finalize_task()
+        response = self.finalize()
+        self.assertEqual(response.status_code, 422)
+        self.assertIn('Хэш', response.json()['error'])
+        self.assertFalse(os.path.exists(uploads.part_path(self.session)))
+        self.assertFalse(Document.objects.exists())
+
+    def test_lost_file_is_reported(self):
+        self.finalize()
+        os.remove(uploads.part_path(self.session))
+        self.run_finalize_task()
+        response = self.finalize()
+        self.assertEqual(response.status_code, 422)
+        self.assertIn('пропал', response.json()['error'])
+
+
+# ==========================================
+# ПРОВЕРКИ НАСТРОЕК
+# ==========================================
+
+LOCMEM = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+FILE_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': '/tmp/cache'}}
+
+
+class SharedCacheCheckTests(TestCase):
+
+    def errors(self):
+        return [error.id for error in checks.check_shared_cache(None)]
+
+    @override_settings(WEB_CONCURRENCY=1, CACHES=LOCMEM)
+    def test_single_process_may_use_locmem(self):
+        self.assertEqual(self.errors(), [])
+
+    @override_settings(WEB_CONCURRENCY=4, CACHES=LOCMEM)
+    def test_several_processes_need_shared_cache(self):
+        self.assertEqual(self.errors(), ['core.E001'])
+
+    @override_settings(WEB_CONCURRENCY=4, CACHES=FILE_CACHE)
+    def test_shared_cache_passes(self):
+        self.assertEqual(self.errors(), [])
+
+
+# ==========================================
+# АВАТАРЫ
+# ==========================================
+
+class AvatarTests(MediaTestCase):
+
+    def png(self):
+        output = io.BytesIO()
+        Image.new('RGB', (40, 40), 'red').save(output, format='PNG')
+        return SimpleUploadedFile('avatar.png', output.getvalue(), content_type='image/png')
+
+    def upload(self):
+        self.client.force_login(self.user)
+        return self.client.post('/profile/', {'update_avatar': '1', 'avatar': self.png()}, secure=True)
+
+    def test_upload_builds_variants(self):
+        self.upload()
+        profile = User.objects.get(pk=self.user.pk).profile
+        self.assertTrue(profile.avatar_variants.startswith('avatars/'))
+
+    def test_failed_processing_clears_old_variants(self):
+        self.upload()
+        with mock.patch('core.views.avatars.process', side_effect=avatars.AvatarError('broken')):
+            self.upload()
+        profile = User.objects.get(pk=self.user.pk).profile
+        self.assertFalse(profile.avatar)
+        self.assertEqual(profile.avatar_variants, '')
+
+
+# ==========================================
+# ОТДАЧА ФАЙЛОВ: ETag, 304, Range
+# ==========================================
+
+@override_settings(DOCUMENT_MAX_RANGES=4)
+class RangeHeaderTests(TestCase):
+    size = 1000
+
+    def parse(self, header):
+        return delivery.parse_range_header(header, self.size)
+
+    def test_single_ranges(self):
+        self.assertEqual(self.parse('bytes=0-99'), [(0, 99)])
+        self.assertEqual(self.parse('bytes=900-'), [(900, 999)])
+        self.assertEqual(self.parse('bytes=-100'), [(900, 999)])
+        self.assertEqual(self.parse('bytes=990-5000'), [(990, 999)])
+
+    def test_overlapping_and_adjacent_ranges_are_merged(self):
+        self.assertEqual(self.parse('bytes=0-99,50-149'), [(0, 149)])
+        self.assertEqual(self.parse('bytes=100-199,0-99'), [(0, 199)])
+        self.assertEqual(self.parse('bytes=0-0,0-0,0-0,0-0,0-0,0-0'), [(0, 0)])
+        self.assertEqual(self.parse('bytes=0-9,20-29'), [(0, 9), (20, 29)])
+
+    def test_unsatisfiable(self):
+        self.assertEqual(self.parse('bytes=1000-1099'), [])
+
+    def test_ignored(self):
+        for header in ('', 'items=0-1', 'bytes=abc', 'bytes=9-1', 'bytes=0-1,3-4,6-7,9-10,12-13'):
+            with self.subTest(header=header):
+                self.assertIsNone(self.parse(header))
+
+
+class DeliveryTests(MediaTestCase):
+    content = bytes(range(256)) * 4
+
+    def setUp(self):
+        super().setUp()
+        self.doc = self.make_document(self.content, 'data.bin', title='Отчет')
+        self.url = f'/document/{self.doc.pk}/open/'
+        self.client.force_login(self.user)
+
+    def get(self, **headers):
+        return self.client.get(self.url, headers=headers, secure=True)
+
+    def body(self, response):
+        return b''.join(response.streaming_content) if response.streaming else response.content
+
+    def test_full_response_has_validators(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.content)
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertTrue(response['ETag'].startswith('"'))
+        self.assertIn('Last-Modified', response)
+        self.assertEqual(response['Content-Disposition'], "inline; filename*=UTF-8''%D0%9E%D1%82%D1%87%D0%B5%D1%82.bin")
+
+    def test_if_none_match_returns_304(self):
+        etag = self.get()['ETag']
+        response = self.get(**{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+    def test_single_range(self):
+        response = self.get(Range='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.content)}')
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(self.body(response), self.content[10:20])
+
+    def test_unsatisfiable_range_returns_416(self):
+        response = self.get(Range=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+    def test_stale_if_range_returns_whole_file(self):
+        response = self.get(Range='bytes=10-19', **{'If-Range': '"stale"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.content)
+
+    def test_multiple_ranges(self):
+        response = self.get(Range='bytes=0-9,100-109')
+        self.assertEqual(response.status_code, 206)
+        content_type, _, boundary = response['Content-Type'].partition('; boundary=')
+        self.assertEqual(content_type, 'multipart/byteranges')
+
+        body = self.body(response)
+        self.assertEqual(response['Content-Length'], str(len(body)))
+        self.assertTrue(body.endswith(f'--{boundary}--\r\n'.encode()))
+        parts = body.split(f'--{boundary}'.encode())[1:-1]
+        self.assertEqual(len(parts), 2)
+        for part, (start, end) in zip(parts, [(0, 9), (100, 109)]):
+            headers, _, data = part.partition(b'\r\n\r\n')
+            self.assertIn(f'Content-Range: bytes {start}-{end}/{len(self.content)}'.encode(), headers)
+            self.assertEqual(data, self.content[start:end + 1] + b'\r\n')
+
+    @override_settings(DOCUMENT_DELIVERY_BACKEND='nginx', DOCUMENT_ACCEL_REDIRECT_PREFIX='/protected-media/')
+    def test_nginx_backend_offloads_file(self):
+        response = self.get()
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.doc.file.name}')
+        self.assertEqual(response.content, b'')
+        self.assertIn('Content-Disposition', response)
+        self.assertEqual(response['Cache-Control'], delivery.cache_control_for(self.doc))
+
+    async def test_async_range(self):
+        # Под ASGI тело читается асинхронным генератором (aserve_document)
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(self.url, headers={'Range': 'bytes=0-9,100-109'}, secure=True)
+        self.assertEqual(response.status_code, 206)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(response['Content-Length'], str(len(body)))
+        self.assertIn(self.content[100:110], body)
+
+
+# ==========================================
+# АСИНХРОННЫЕ ПРЕДСТАВЛЕНИЯ (ASGI)
+# ==========================================
+
+class AsyncViewTests(MediaTestCase):
+
+    async def body(self, response):
+        if response.streaming:
+            return b''.join([chunk async for chunk in response.streaming_content])
+        return response.content
+
+    async def test_anonymous_is_sent_to_login(self):
+        response = await self.async_client.get('/', secure=True)
+        self.assertEqual(response.status_code, 302)
+        response = await self.async_client.get('/document/1/open/', secure=True)
+        self.assertEqual(response.status_code, 302)
+
+    @override_settings(DOCUMENTS_PAGE_SIZE=1)
+    async def test_list_pages(self):
+        await sync_to_async(self.make_document)(b'1', 'a.txt', title='Первый')
+        await sync_to_async(self.make_document)(b'2', 'b.txt', title='Второй')
+        await self.async_client.aforce_login(self.user)
+
+        response = await self.async_client.get('/', {'sort': 'name_asc'}, secure=True)
+        self.assertEqual(response.status_code, 200)
+        page = response.content.decode()
+        self.assertIn('Второй', page)
+        self.assertNotIn('Первый', page)
+
+        cursor = response.context['next_page_url'].split('cursor=')[1]
+        response = await self.async_client.get('/', {'sort': 'name_asc', 'cursor': unquote(cursor)}, secure=True)
+        self.assertIn('Первый', response.content.decode())
+
+    async def test_open_file(self):
+        doc = await sync_to_async(self.make_document)(b'async body', 'a.txt', title='Отчет')
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(f'/document/{doc.pk}/open/', {'download': '1'}, secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Disposition'].startswith('attachment;'))
+        self.assertEqual(await self.body(response), b'async body')
+
+    @override_settings(SHARE_LINK_MAX_DOWNLOADS=1)
+    async def test_public_download_counts_limit(self):
+        doc = await sync_to_async(self.make_document)(b'shared', 'a.txt', title='Общий')
+        link = await sync_to_async(get_or_create_link)(doc)
+
+        response = await self.async_client.get(f'/s/{link.token}/', secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(await self.body(response), b'shared')
+        # Лимит исчерпан — счетчик проверяется раньше, чем фоновая запись доходит до базы
+        response = await self.async_client.get(f'/s/{link.token}/', secure=True)
+        self.assertEqual(response.status_code, 410)
+
+
+# ==========================================
+# СКАЧИВАНИЕ ВСЕХ ДОКУМЕНТОВ ПО ФИЛЬТРУ (ZIP)
+# ==========================================
+
+class ZipDownloadTests(MediaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.reports = Category.objects.create(name='Отчеты')
+        self.client.force_login(self.user)
+
+    def download(self, **params):
+        return self.client.get('/documents/download.zip', params, secure=True)
+
+    def unzip(self, response):
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as archive:
+            return {name: archive.read(name) for name in archive.namelist()}
+
+    def test_archive_follows_filters(self):
+        self.make_document(b'one', 'a.txt', title='Итоги', category=self.reports)
+        self.make_document(b'two', 'b.txt', title='Итоги', category=self.reports)
+        self.make_document(b'other', 'c.txt', title='Приказ')
+
+        response = self.download(category=self.reports.pk)
+        self.assertEqual(response['Content-Disposition'], "attachment; filename*=UTF-8''%D0%9E%D1%82%D1%87%D0%B5%D1%82%D1%8B.zip")
+        # Одинаковые названия не затирают друг друга
+        self.assertEqual(self.unzip(response), {'Итоги.txt': b'one', 'Итоги (2).txt': b'two'})
+
+    @mock.patch('core.delivery.CHUNK_SIZE', 1024)
+    def test_archive_is_streamed_in_chunks(self):
+        content = os.urandom(10 * 1024)
+        self.make_document(content, 'photo.jpg', title='Фото')
+        response = self.download()
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 5)
+        with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as archive:
+            self.assertEqual(archive.read('Фото.jpg'), content)
+            # Уже сжатые форматы кладутся как есть
+            self.assertEqual(archive.getinfo('Фото.jpg').compress_type, zipfile.ZIP_STORED)
+
+    def test_missing_file_does_not_break_archive(self):
+        lost = self.make_document(b'lost', 'lost.txt', title='Пропавший')
+        self.make_document(b'kept', 'kept.txt', title='Целый')
+        os.remove(self.blob_path(lost.file.name))
+        self.assertEqual(self.unzip(self.download()), {'Целый.txt': b'kept'})
+
+    @override_settings(DOWNLOAD_ZIP_MAX_FILES=1)
+    def test_too_many_or_no_documents_redirect(self):
+        self.assertEqual(self.download().status_code, 302)
+        self.make_document(b'1', 'a.txt')
+        self.make_document(b'2', 'b.txt')
+        self.assertEqual(self.download().status_code, 302)
+        self.assertEqual(self.download(q='a').status_code, 200)
+
+
+# ==========================================
+# ОСИРОТЕВШИЕ ФАЙЛЫ
+# ==========================================
+
+class OrphanTests(MediaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.quarantine = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.quarantine, ignore_errors=True)
+        overrides = override_settings(ORPHAN_QUARANTINE_DIR=self.quarantine, ORPHAN_GRACE_HOURS=24)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        self.doc = self.make_document(b'kept', 'kept.txt')
+        StoredBlob.objects.update(pinned_until=None)
+        self.orphan = self.media_file('documents/old.txt', b'orphan')
+        self.fresh = self.media_file('documents/new.txt', b'uploading', age=0)
+        # Все остальное тоже старое: от удаления спасает только ссылка в базе
+        self.age(self.blob_path(self.doc.file.name))
+
+    def media_file(self, name, content, age=48 * 3600):
+        path = os.path.join(self.media_root, *name.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+        self.age(path, age)
+        return path
+
+    def age(self, path, seconds=48 * 3600):
+        mtime = time.time() - seconds
+        os.utime(path, (mtime, mtime))
+
+    def test_dry_run_only_counts(self):
+        stats = orphans.collect_orphans(dry_run=True)
+        self.assertEqual((stats['orphans'], stats['bytes'], stats['removed']), (1, 6, 0))
+        self.assertEqual(stats['by_dir'], {'documents': 6})
+        self.assertTrue(os.path.exists(self.orphan))
+
+    def test_quarantine_keeps_referenced_and_fresh_files(self):
+        stats = orphans.collect_orphans(action='quarantine', batch_size=1)
+        self.assertEqual(stats['removed'], 1)
+        self.assertFalse(os.path.exists(self.orphan))
+        day = datetime.now().strftime('%Y-%m-%d')
+        with open(os.path.join(self.quarantine, day, 'documents', 'old.txt'), 'rb') as f:
+            self.assertEqual(f.read(), b'orphan')
+        self.assertTrue(os.path.exists(self.fresh))
+        self.assertTrue(os.path.exists(self.blob_path(self.doc.file.name)))
+
+    def test_delete_action(self):
+        orphans.collect_orphans(action='delete')
+        self.assertFalse(os.path.exists(self.orphan))
+        self.assertEqual(os.listdir(self.quarantine), [])
+
+    def test_old_quarantine_days_are_purged(self):
+        old_day = (datetime.now() - timedelta(days=40)).strftime('%Y-%m-%d')
+        os.makedirs(os.path.join(self.quarantine, old_day, 'documents'))
+        os.makedirs(os.path.join(self.quarantine, datetime.now().strftime('%Y-%m-%d')))
+        self.assertEqual(orphans.purge_quarantine(days=30), 1)
+        self.assertFalse(os.path.exists(os.path.join(self.quarantine, old_day)))
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        index = orphans.BloomFilter(1000)
+        names = [f'blobs/{i:064x}.pdf' for i in range(1000)]
+        for name in names:
+            index.add(name)
+        self.assertTrue(all(name in index for name in names))
+        misses = sum(f'documents/{i}.txt' in index for i in range(1000))
+        self.assertLess(misses, 10)
+
+
+# ==========================================
+# УДАЛЕНИЕ КАТЕГОРИЙ
+# ==========================================
+
+class CategoryDeletionTests(MediaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_superuser('admin', password='pw')
+        self.client.force_login(self.admin)
+        self.old = Category.objects.create(name='Старая')
+        self.new = Category.objects.create(name='Новая')
+        self.docs = [self.make_document(f'{i}'.encode(), f'{i}.txt', category=self.old) for i in range(3)]
+
+    def delete(self, category, **data):
+        return self.client.post(f'/categories/delete/{category.pk}/', data, secure=True)
+
+    def test_category_with_documents_is_protected(self):
+        with self.assertRaises(ProtectedError):
+            self.old.delete()
+
+    def test_reassign(self):
+        self.delete(self.old, mode='reassign', target=self.new.pk)
+        self.assertFalse(Category.objects.filter(pk=self.old.pk).exists())
+        self.assertEqual(Document.objects.filter(category=self.new).count(), 3)
+        self.assertIn('Старая → Новая (3)', AuditLog.objects.get().document_title)
+
+    def test_set_null(self):
+        self.delete(self.old, mode='null')
+        self.assertEqual(Document.objects.filter(category__isnull=True).count(), 3)
+
+    def test_reassign_needs_other_target(self):
+        self.delete(self.old, mode='reassign')
+        self.delete(self.old, mode='reassign', target=self.old.pk)
+        self.assertTrue(Category.objects.filter(pk=self.old.pk).exists())
+        self.assertEqual(Document.objects.filter(category=self.old).count(), 3)
+
+    @override_settings(CATEGORY_DELETE_BATCH_SIZE=2)
+    def test_delete_with_documents_in_background(self):
+        self.delete(self.old, mode='delete')
+        self.delete(self.old, mode='delete')
+        task = Task.objects.get(name='delete_category')
+        self.assertEqual(task.payload['total'], 3)
+        self.assertTrue(Category.objects.filter(pk=self.old.pk).exists())
+
+        StoredBlob.objects.update(pinned_until=None)
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk.delete_category_documents(task)
+        self.assertFalse(Category.objects.filter(pk=self.old.pk).exists())
+        self.assertFalse(Document.objects.exists())
+        self.assertFalse(StoredBlob.objects.exists())
+        self.assertEqual(Task.objects.get(pk=task.pk).payload['deleted'], 3)
+
+
+# ==========================================
+# ПРОФИЛИ ПОЛЬЗОВАТЕЛЕЙ
+# ==========================================
+
+class ProfileTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('user', password='pw')
+
+    def test_profile_created_with_user(self):
+        self.assertEqual(Profile.objects.filter(user=self.user).count(), 1)
+
+    def test_saving_user_does_not_touch_profile(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.user.first_name = 'Иван'
+            self.user.save()
+            self.assertTrue(self.client.login(username='user', password='pw'))
+        self.assertFalse([q['sql'] for q in queries if 'core_profile' in q['sql']])
+
+    def test_session_user_comes_with_profile(self):
+        with self.assertNumQueries(1):
+            user = ProfileBackend().get_user(self.user.pk)
+            self.assertEqual(user.profile.user_id, self.user.pk)
+
+    def test_migration_backfills_missing_profiles(self):
+        migration = importlib.import_module('core.migrations.0019_backfill_profiles')
+        Profile.objects.all().delete()
+        migration.create_missing_profiles(apps, None)
+        self.assertTrue(Profile.objects.filter(user=self.user).exists())
+
+
+# ==========================================
+# НАСТРОЙКИ БАЗЫ ДАННЫХ
+# ==========================================
+
+def load_settings(**env):
+    """Свежая копия settings.py с переменными окружения env (настройки процесса не трогает)."""
+    spec = importlib.util.spec_from_file_location('settings_copy', settings.BASE_DIR / 'archive_system' / 'settings.py')
+    module = importlib.util.module_from_spec(spec)
+    with mock.patch.dict(os.environ, env):
+        for name in ('DOCUGUARD_DB', 'DOCUGUARD_SQLITE_TUNING', 'DOCUGUARD_CONN_MAX_AGE', 'DOCUGUARD_ASGI'):
+            if name not in env:
+                os.environ.pop(name, None)
+        spec.loader.exec_module(module)
+    return module.DATABASES['default']
+
+
+class DatabaseSettingsTests(TestCase):
+
+    def test_sqlite_is_tuned_by_default(self):
+        db = load_settings()
+        self.assertEqual(db['ENGINE'], 'django.db.backends.sqlite3')
+        self.assertIn('PRAGMA journal_mode=WAL;', db['OPTIONS']['init_command'])
+        self.assertEqual(db['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+        self.assertEqual(db['CONN_MAX_AGE'], 60)
+
+    def test_sqlite_tuning_can_be_switched_off(self):
+        db = load_settings(DOCUGUARD_SQLITE_TUNING='0', DOCUGUARD_CONN_MAX_AGE='0')
+        self.assertEqual(db['OPTIONS'], {})
+        self.assertEqual(db['CONN_MAX_AGE'], 0)
+
+    def test_asgi_does_not_keep_connections(self):
+        self.assertEqual(load_settings(DOCUGUARD_ASGI='1')['CONN_MAX_AGE'], 0)
+        self.assertEqual(load_settings(DOCUGUARD_ASGI='1', DOCUGUARD_CONN_MAX_AGE='30')['CONN_MAX_AGE'], 30)
+
+    def test_postgres_uses_pool(self):
+        db = load_settings(DOCUGUARD_DB='postgres', DOCUGUARD_PG_POOL_MAX='20')
+        self.assertEqual(db['ENGINE'], 'django.db.backends.postgresql')
+        self.assertEqual(db['CONN_MAX_AGE'], 0)
+        self.assertEqual(db['OPTIONS']['pool']['max_size'], 20)
+
+    def test_connection_applies_pragmas(self):
+        if connection.vendor != 'sqlite' or 'init_command' not in connection.settings_dict['OPTIONS']:
+            self.skipTest('Только для настроенного SQLite')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA temp_store')
+            self.assertEqual(cursor.fetchone()[0], 2)  # MEMORY
+
+    def test_benchmark_refuses_settings_database(self):
+        with mock.patch.dict(os.environ), mock.patch('subprocess.Popen') as popen:
+            os.environ.pop('DOCUGUARD_BENCHMARK_DB', None)
+            with self.assertRaises(CommandError):
+                call_command('benchmark_db', stdout=io.StringIO())
+        popen.assert_not_called()
+        self.assertFalse(User.objects.filter(username__startswith='benchmark-db-').exists())
+
+    def test_benchmark_runs_on_test_db(self):
+        with mock.patch('subprocess.run') as run:
+            run.return_value.returncode = 0
+            run.return_value.stdout = ''
+            call_command('benchmark_db', '--test-db', '/tmp/bench.sqlite3', '--writers', '2', stdout=io.StringIO())
+        migrate, benchmark = run.call_args_list
+        self.assertIn('migrate', migrate.args[0])
+        self.assertIn('--writers', benchmark.args[0])
+        self.assertEqual(benchmark.kwargs['env']['DOCUGUARD_SQLITE_PATH'], '/tmp/bench.sqlite3')
+        self.assertEqual(benchmark.kwargs['env']['DOCUGUARD_BENCHMARK_DB'], '1')
+
+
+# ==========================================
+# ФОНОВЫЕ ЗАДАЧИ
+# ==========================================
+
+@override_settings(TASKS_STALE_AFTER_SECONDS=600, TASKS_KEEP_DONE_DAYS=7, TASKS_KEEP_FAILED_DAYS=30)
+class TaskTests(TestCase):
+
+    def setUp(self):
+        tasks.register('test_noop')(lambda task: None)
+        self.addCleanup(tasks.REGISTRY.pop, 'test_noop')
+
+    def running(self, worker_id, age):
+        return Task.objects.create(name='test_noop', status='running', locked_by=worker_id,
+                                   started_at=timezone.now() - timedelta(seconds=age))
+
+    def test_heartbeat_keeps_task_from_requeue(self):
+        alive = self.running('alive', age=3600)
+        dead = self.running('dead', age=3600)
+        self.assertEqual(tasks.heartbeat('alive'), 1)
+        self.assertEqual(tasks.requeue_stale_tasks(), 1)
+        self.assertEqual(Task.objects.get(pk=alive.pk).status, 'running')
+        self.assertEqual(Task.objects.get(pk=dead.pk).status, 'pending')
+
+    def test_stale_task_without_attempts_left_fails(self):
+        retry = self.running('dead', age=3600)
+        exhausted = self.running('dead', age=3600)
+        Task.objects.filter(pk=exhausted.pk).update(attempts=3, max_attempts=3)
+        with self.assertLogs('core.tasks', 'ERROR'):
+            self.assertEqual(tasks.requeue_stale_tasks(), 1)
+        self.assertEqual(Task.objects.get(pk=retry.pk).status, 'pending')
+        exhausted.refresh_from_db()
+        self.assertEqual(exhausted.status, 'failed')
+        self.assertIsNotNone(exhausted.finished_at)
+        self.assertIn('попытки исчерпаны', exhausted.last_error)
+
+    def test_requeued_task_result_belongs_to_new_worker(self):
+        task = self.running('old', age=3600)
+        tasks.requeue_stale_tasks()
+        claimed = tasks.claim_tasks('new', 1)
+        self.assertEqual([t.pk for t in claimed], [task.pk])
+
+        # Старый воркер все-таки дожил до конца — итог не перетирает работу нового
+        tasks.run_task(task)
+        self.assertEqual(Task.objects.get(pk=task.pk).status, 'running')
+        tasks.run_task(claimed[0])
+        self.assertEqual(Task.objects.get(pk=task.pk).status, 'done')
+
+    def test_purge_finished_tasks(self):
+        now = timezone.now()
+        Task.objects.bulk_create([
+            Task(name='test_noop', status='done', finished_at=now - timedelta(days=8)),
+            Task(name='test_noop', status='done', finished_at=now - timedelta(days=1)),
+            Task(name='test_noop', status='failed', finished_at=now - timedelta(days=8)),
+            Task(name='test_noop', status='failed', finished_at=now - timedelta(days=31)),
+            Task(name='test_noop', status='pending', run_after=now - timedelta(days=60)),
+        ])
+        self.assertEqual(tasks.purge_finished_tasks(batch_size=1), 2)
+        self.assertEqual(
+            sorted(Task.objects.values_list('status', flat=True)), ['done', 'failed', 'pending'],
+        )
+
+
+# ==========================================
+# ГОРЯЧИЙ И ХОЛОДНЫЙ СЛОИ ХРАНИЛИЩА
+# ==========================================
+
+class TieringTests(MediaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cold_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cold_root, ignore_errors=True)
+        overrides = override_settings(DOCUMENT_COLD_STORAGE={'BACKEND': 'filesystem', 'LOCATION': self.cold_root})
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.client.force_login(self.user)
+
+    def cold_path(self, name):
+        return os.path.join(self.cold_root, *name.split('/'))
+
+    def test_upload_is_replicated_once(self):
+        doc = self.make_document(b'cold copy')
+        task = Task.objects.get(name='replicate_blob')
+        self.assertEqual(task.payload, {'blob': doc.file.name})
+
+        self.assertTrue(tiering.replicate(doc.file.name))
+        with open(self.cold_path(doc.file.name), 'rb') as f:
+            self.assertEqual(f.read(), b'cold copy')
+        self.assertFalse(tiering.replicate(doc.file.name))
+
+    def test_missing_hot_file_is_retried(self):
+        doc = self.make_document(b'lost')
+        os.remove(self.blob_path(doc.file.name))
+        with self.assertRaises(FileNotFoundError):
+            tiering.replicate(doc.file.name)
+
+        task = tasks.claim_tasks('worker', 1)[0]
+        with self.assertLogs('core.tasks', 'WARNING'):
+            self.assertFalse(tasks.run_task(task))
+        task.refresh_from_db()
+        self.assertEqual(task.status, 'pending')
+        self.assertIn('FileNotFoundError', task.last_error)
+
+    def test_demote_and_promote_on_open(self):
+        doc = self.make_document(b'idle file')
+        name = doc.file.name
+        StoredBlob.objects.update(last_accessed_at=timezone.now() - timedelta(days=365))
+
+        with self.assertLogs('core.tiering', 'INFO'):
+            stats = tiering.demote_idle(days=90)
+        self.assertEqual(stats['demoted'], 1)
+        self.assertFalse(os.path.exists(self.blob_path(name)))
+        self.assertTrue(os.path.isfile(self.cold_path(name)))
+        self.assertEqual(StoredBlob.objects.get().tier, 'cold')
+
+        response = self.client.get(f'/document/{doc.pk}/open/', secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'idle file')
+        self.assertTrue(os.path.isfile(self.blob_path(name)))
+        self.assertEqual(StoredBlob.objects.get().tier, 'hot')
+
+    def test_recently_opened_file_stays_hot(self):
+        doc = self.make_document(b'busy file')
+        self.assertEqual(tiering.demote_idle(days=90)['demoted'], 0)
+        self.assertTrue(os.path.isfile(self.blob_path(doc.file.name)))
@@ -0,0 +1,222 @@
+import logging
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import StoredBlob
+from .storage import BLOB_PREFIX, get_cold_storage, get_document_storage, is_blob_name
+
+logger = logging.getLogger(__name__)
+
+
+# ==========================================
+# ГОРЯЧИЙ И ХОЛОДНЫЙ СЛОИ ХРАНИЛИЩА
+# ==========================================
+# Горячий слой — локальный диск (MEDIA_ROOT/blobs), холодный — внешнее
+# хранилище из settings.DOCUMENT_COLD_STORAGE (S3/MinIO или каталог).
+#   - новый файл сразу копируется в холодный слой фоновой задачей
+#     (TIERING_REPLICATE_UPLOADS) — его может открыть любой сервер;
+#   - файлы, которые не открывали TIERING_DEMOTE_AFTER_DAYS дней, задание
+#     demote_idle_documents удаляет с локального диска;
+#   - при открытии (open_file, публичная ссылка, превью) файла на диске
+#     нет — он прозрачно скачивается обратно (hot_path).
+# Массовое чтение (ZIP "скачать все", переиндексация) берет временную
+# копию (readable_path) и не возвращает на диск все подряд.
+#
+# Где лежит файл и когда его открывали — в StoredBlob (tier,
+# last_accessed_at). Файлы старого формата (documents/...) не вытесняются.
+# Без DOCUMENT_COLD_STORAGE все файлы просто живут на локальном диске.
+
+
+def _local_path(name):
+    return get_document_storage().path(name)
+
+
+def _download(cold, name, path):
+    # Скачиваем рядом и атомарно переименовываем: читатель не увидит половину файла.
+    # Два процесса могут скачать один файл одновременно — результат одинаковый
+    tmp_dir = get_document_storage().path(BLOB_PREFIX + 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    os.close(fd)
+    try:
+        cold.download(name, tmp_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def ensure_local(name):
+    """Локальный путь к файлу; если файл только в холодном слое — скачивает его обратно."""
+    path = _local_path(name)
+    cold = get_cold_storage()
+    if cold is None or not is_blob_name(name) or os.path.isfile(path):
+        return path
+    try:
+        _download(cold, name, path)
+    except FileNotFoundError:
+        # Нет нигде — вызывающий ответит 404, как для пропавшего файла
+        return path
+    StoredBlob.objects.filter(name=name).update(tier='hot', last_accessed_at=timezone.now())
+    logger.info("Файл %s возвращен из холодного хранилища", name)
+    return path
+
+
+def touch(name):
+    """Отмечает обращение к файлу — не чаще раза в TIERING_TOUCH_INTERVAL на файл."""
+    if not is_blob_name(name):
+        return
+    if cache.add(f"tiering:touched:{name}", 1, settings.TIERING_TOUCH_INTERVAL):
+        StoredBlob.objects.filter(name=name).update(last_accessed_at=timezone.now())
+
+
+def hot_path(doc):
+    """Путь к файлу документа для открытия пользователем: возвращает файл на диск и отмечает обращение."""
+    path = ensure_local(doc.file.name)
+    touch(doc.file.name)
+    return path
+
+
+@contextmanager
+def readable_path(doc):
+    """
+    Путь, по которому файл можно прочитать, не возвращая его на диск насовсем:
+    локальный файл или временная копия из холодного слоя. None — файла нет нигде.
+    """
+    name = doc.file.name
+    path = _local_path(name)
+    cold = get_cold_storage()
+    if os.path.isfile(path) or cold is None or not is_blob_name(name):
+        yield path if os.path.isfile(path) else None
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_path = os.path.join(tmp, os.path.basename(name))
+        try:
+            cold.download(name, tmp_path)
+        except FileNotFoundError:
+            tmp_path = None
+        yield tmp_path
+
+
+def is_stored(doc):
+    """Файл документа есть на диске или в холодном слое."""
+    if os.path.isfile(_local_path(doc.file.name)):
+        return True
+    return StoredBlob.objects.filter(name=doc.file.name, tier='cold').exists()
+
+
+# ------------------------------------------
+# 1. КОПИЯ НОВЫХ ФАЙЛОВ
+# ------------------------------------------
+
+def replicate(name):
+    """
+    Кладет копию файла в холодный слой, если ее там еще нет. True — файл скопирован.
+    FileNotFoundError — файла нет на диске и копии нет в холодном слое (задача повторится).
+    """
+    cold = get_cold_storage()
+    if cold is None:
+        return False
+    path = _local_path(name)
+    if not os.path.isfile(path):
+        # Уже вытеснен (копия есть) или удален вместе с последним документом — копировать нечего
+        if cold.exists(name) or not StoredBlob.objects.filter(name=name).exists():
+            return False
+        # Иначе копия потеряется молча: пусть задача упадет и повторит попытку
+        raise FileNotFoundError(f"Нет файла для копии в холодное хранилище: {name}")
+    if cold.exists(name) and cold.size(name) == os.path.getsize(path):
+        return False
+    cold.upload(path, name)
+    return True
+
+
+# ------------------------------------------
+# 2. ВЫТЕСНЕНИЕ
+# ------------------------------------------
+
+def demote_idle(days=None, batch_size=None, dry_run=False):
+    """
+    Удаляет с локального диска файлы, которые не открывали days дней
+    (по умолчанию TIERING_DEMOTE_AFTER_DAYS), — предварительно убедившись,
+    что копия есть в холодном слое.
+    Возвращает {'demoted', 'bytes', 'skipped', 'failed', 'seconds'}; skipped — файл открыли во время вытеснения.
+    """
+    cold = get_cold_storage()
+    days = settings.TIERING_DEMOTE_AFTER_DAYS if days is None else days
+    batch_size = batch_size or settings.TIERING_BATCH_SIZE
+    cutoff = timezone.now() - timedelta(days=days)
+    idle = StoredBlob.objects.filter(tier='hot', last_accessed_at__lt=cutoff)
+
+    started = time.monotonic()
+    stats = {'demoted': 0, 'bytes': 0, 'skipped': 0, 'failed': 0, 'seconds': 0.0}
+    if cold is None:
+        return stats
+    if dry_run:
+        totals = idle.aggregate(bytes=Sum('size'))
+        stats['demoted'] = idle.count()
+        stats['bytes'] = totals['bytes'] or 0
+        return stats
+
+    last_id = 0
+    while True:
+        batch = list(idle.filter(id__gt=last_id).order_by('id')[:batch_size])
+        if not batch:
+            break
+        for blob in batch:
+            outcome = _demote(cold, blob, cutoff)
+            stats[outcome] += 1
+            if outcome == 'demoted':
+                stats['bytes'] += blob.size
+        last_id = batch[-1].id
+        if len(batch) < batch_size:
+            break
+
+    stats['seconds'] = time.monotonic() - started
+    logger.info(
+        "Вытеснение в холодное хранилище: %s файлов (%.1f МБ), ошибок %s, за %.1f с",
+        stats['demoted'], stats['bytes'] / 1024 / 1024, stats['failed'], stats['seconds'],
+    )
+    return stats
+
+
+def _demote(cold, blob, cutoff):
+    path = _local_path(blob.name)
+    try:
+        replicate(blob.name)
+    except FileNotFoundError:
+        logger.warning("Файла %s нет ни на диске, ни в холодном хранилище", blob.name)
+        return 'failed'
+    except Exception:
+        logger.exception("Не удалось скопировать %s в холодное хранилище", blob.name)
+        return 'failed'
+
+    # Сначала убираем файл в сторону, потом помечаем "cold": кто откроет файл в
+    # этот момент, скачает его из холодного слоя (копия там уже есть)
+    aside = f"{path}.{time.time_ns()}.demoting"
+    try:
+        os.replace(path, aside)
+    except FileNotFoundError:
+        aside = None
+
+    # Пока копировали, файл могли открыть — тогда он остается на диске
+    if StoredBlob.objects.filter(pk=blob.pk, tier='hot', last_accessed_at__lt=cutoff).update(tier='cold'):
+        if aside:
+            os.remove(aside)
+        return 'demoted'
+    if aside:
+        if os.path.exists(path):
+            os.remove(aside)  # уже скачан обратно
+        else:
+            os.replace(aside, path)
+    return 'skipped'
@@ -0,0 +1,202 @@
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import audit
+from .models import Document, StoredBlob, Task, UploadSession
+from .storage import blob_name, get_document_storage, hash_file
+
+
+# ==========================================
+# ДОКАЧИВАЕМАЯ ЗАГРУЗКА (по мотивам протокола tus)
+# ==========================================
+# 1. POST   /upload/sessions/              — создать сеанс (название, размер, ...)
+# 2. PATCH  /upload/sessions/<id>/         — дописать кусок, заголовок Upload-Offset
+#    HEAD   /upload/sessions/<id>/         — узнать, сколько уже принято (после обрыва)
+# 3. POST   /upload/sessions/<id>/finalize/ — проверить хэш и создать документ
+#    (202 — задача finalize_upload в очереди, повторяем запрос, пока не 201)
+#
+# Куски пишутся прямо в MEDIA_ROOT/uploads/<id>.part, без буферизации
+# в памяти и без временных файлов Django. Готовый файл переезжает в
+# хранилище переименованием.
+
+READ_CHUNK = 1024 * 1024
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def part_path(session):
+    return os.path.join(settings.MEDIA_ROOT, 'uploads', f"{session.pk}.part")
+
+
+def _unlocked(session, **conditions):
+    # Сеанс, с которым сейчас никто не работает. Зависший замок (клиент
+    # пропал) через UPLOAD_LOCK_TIMEOUT_SECONDS можно перехватить
+    stale = timezone.now() - timedelta(seconds=settings.UPLOAD_LOCK_TIMEOUT_SECONDS)
+    return UploadSession.objects.filter(
+        Q(locked_at__isnull=True) | Q(locked_at__lt=stale), pk=session.pk, document__isnull=True, **conditions,
+    )
+
+
+def _lock(session, **conditions):
+    """
+    "Замок" на сеанс одним условным UPDATE: одновременно с сеансом работает
+    только один запрос, и пока файл завершается, дописывать его нельзя.
+    """
+    if not _unlocked(session, finalize_task__isnull=True, **conditions).update(locked_at=timezone.now()):
+        raise UploadError('Этот сеанс сейчас занят другим запросом', 409)
+
+
+def start(session):
+    path = part_path(session)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+
+
+def append_chunk(session, stream, offset, length):
+    """
+    Дописывает кусок из stream с позиции offset. Возвращает новое смещение.
+    Если клиент оборвался посреди куска, принятые байты сохраняются —
+    клиент узнает смещение через HEAD и продолжает с него.
+    """
+    if length is None:
+        raise UploadError('Нужен заголовок Content-Length', 411)
+    if offset != session.offset:
+        raise UploadError(f'Ожидалось смещение {session.offset}', 409)
+    if length > settings.UPLOAD_CHUNK_MAX_BYTES or offset + length > session.size:
+        raise UploadError('Кусок слишком большой', 413)
+
+    _lock(session, offset=offset)
+
+    written = 0
+    try:
+        with open(part_path(session), 'r+b') as f:
+            # Отрезаем хвост от прошлого оборванного куска, если он был
+            f.seek(offset)
+            f.truncate()
+            while written < length:
+                chunk = stream.read(min(READ_CHUNK, length - written))
+                if not chunk:
+                    break
+                f.write(chunk)
+                written += len(chunk)
+    finally:
+        session.offset = offset + written
+        UploadSession.objects.filter(pk=session.pk).update(
+            offset=session.offset, locked_at=None, updated_at=timezone.now(),
+        )
+
+    return session.offset
+
+
+def finish(session):
+    """
+    Ставит завершение загрузки в очередь (задача finalize_upload): хэш файла
+    в несколько ГБ считается не в запросе. Повторный вызов, пока задача идет,
+    ничего не делает. Результат — session.document или session.error.
+    """
+    if session.offset != session.size:
+        raise UploadError(f'Принято {session.offset} из {session.size} байт', 409)
+
+    # Два finalize одновременно (клиент повторил запрос) ставят одну задачу
+    with transaction.atomic():
+        task = Task.enqueue('finalize_upload', session=str(session.pk))
+        claimed = _unlocked(session, offset=session.size, finalize_task__isnull=True).update(finalize_task=task)
+        if not claimed:
+            transaction.set_rollback(True)
+    session.refresh_from_db()
+    if not claimed and session.finalize_task_id is None and session.document_id is None:
+        # Еще пишется последний кусок
+        raise UploadError('Этот сеанс сейчас занят другим запросом', 409)
+
+
+def finalize(session_id):
+    """
+    Обработчик задачи finalize_upload: проверяет файл, переносит его в хранилище
+    и создает документ (тем же путем, что и обычная загрузка: автор, журнал аудита).
+    """
+    session = UploadSession.objects.select_related('user', 'category').filter(pk=session_id).first()
+    if session is None or session.document_id is not None or session.error:
+        return None  # сеанс удален или задача уже отработала
+
+    try:
+        name = _store(session)
+    except UploadError as error:
+        # Повтор не поможет — клиент увидит ошибку и загрузит файл заново
+        _remove_part(session)
+        session.error = error.message
+        session.save(update_fields=['error', 'updated_at'])
+        return None
+
+    doc = Document(
+        title=session.title,
+        category=session.category,
+        security_level=session.security_level,
+        file=name,
+        uploaded_by=session.user,
+    )
+    with transaction.atomic():
+        doc.save()
+        session.document = doc
+        session.save(update_fields=['document', 'updated_at'])
+    audit.log(session.user, "Загрузка файла", doc.title)
+    return doc
+
+
+def _store(session):
+    # Задача может упасть на любом шаге и выполниться снова: хэш запоминаем
+    # в сеансе до переноса, а перенесенный файл находим в хранилище по хэшу
+    storage = get_document_storage()
+    path = part_path(session)
+    if not session.digest:
+        try:
+            with open(path, 'rb') as f:
+                digest = hash_file(f)
+        except FileNotFoundError:
+            raise UploadError('Принятый файл пропал, загрузите файл заново', 410)
+        if session.sha256 and digest != session.sha256:
+            # Файл испорчен в пути — начинать придется заново
+            raise UploadError('Хэш файла не совпал, загрузите файл заново', 422)
+        session.digest = digest
+        session.save(update_fields=['digest', 'updated_at'])
+
+    if os.path.exists(path):
+        return storage.store_local_file(path, session.filename, session.digest)
+
+    # Прошлая попытка успела перенести файл, но не создала документ
+    name = blob_name(session.digest, os.path.splitext(session.filename)[1].lower())
+    if not storage.exists(name):
+        raise UploadError('Принятый файл пропал, загрузите файл заново', 410)
+    StoredBlob.pin(name, storage.size(name))
+    return name
+
+
+def _remove_part(session):
+    try:
+        os.remove(part_path(session))
+    except FileNotFoundError:
+        pass
+
+
+def discard(session):
+    _remove_part(session)
+    session.delete()
+
+
+def cleanup_stale_sessions():
+    """Удаляет брошенные сеансы и их недокачанные файлы. Возвращает число удаленных."""
+    threshold = timezone.now() - timedelta(hours=settings.UPLOAD_SESSION_MAX_AGE_HOURS)
+    removed = 0
+    for session in UploadSession.objects.filter(updated_at__lt=threshold).iterator():
+        discard(session)
+        removed += 1
+    return removed
@@ -1,17 +1,31 @@
-import mimetypes
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib.auth import login, logout, update_session_auth_hash
 from django.contrib.auth.decorators import login_required, user_passes_test
+from django.urls import reverse
+from django.views.decorators.http import require_POST, require_http_methods
 from django.contrib.auth.forms import AuthenticationForm, PasswordChangeForm
 from django.contrib import messages
-from django.http import FileResponse, Http404
-from django.db.models import Q  # Для сложных фильтров (ИЛИ)
+from django.http import Http404, HttpResponse, HttpResponseGone, JsonResponse, StreamingHttpResponse
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.contrib.auth.models import User
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 from django.utils.encoding import escape_uri_path
+from django.utils.http import url_has_allowed_host_and_scheme
+from asgiref.sync import sync_to_async
+from datetime import datetime, time as datetime_time, timedelta
+import csv
+import json
+import math
 import os
 
 # Импортируем все наши модели и формы
-from .models import Document, Category, AuditLog, ShareLink, Profile
-from .forms import DocumentForm, ProfileForm
+from .models import Document, Category, AuditLog, UploadSession
+from .forms import BulkActionForm, BulkUploadForm, CategoryDeleteForm, DocumentForm, ProfileForm, UploadSessionForm
+from .pagination import akeyset_page, keyset_page, ranked_page
+from . import access, audit, avatars, bulk, caching, delivery, previews, search, sharing, tiering, uploads
 
 
 # ==========================================
@@ -39,16 +53,15 @@ def logout_view(request):
 # 2. ГЛАВНАЯ СТРАНИЦА (СПИСОК + ФИЛЬТРЫ)
 # ==========================================
 
-@login_required
-def document_list(request):
-    # Получаем параметры из URL
-    category_id = request.GET.get('category')
-    search_query = request.GET.get('q', '')
-    sort_param = request.GET.get('sort', 'date_desc')
-    file_type = request.GET.get('type')  # Тип файла (pdf, word, etc.)
-
-    # Базовый запрос: берем все документы
-    docs = Document.objects.all()
+def _filter_documents(request, category_id, search_query, file_type):
+    """
+    Документы по фильтрам главной страницы (категория, поиск, тип) с учетом допуска.
+    Возвращает (queryset, {id: фрагмент} при поиске по индексу или None).
+    """
+    # Базовый запрос: сразу подтягиваем автора и категорию одним JOIN,
+    # иначе шаблон делает по запросу на каждую строку.
+    # Документы выше допуска пользователя отсекаются здесь же, в SQL
+    docs = access.visible_documents(request.user, Document.objects.select_related('uploaded_by', 'category'))
 
     # --- ФИЛЬТРАЦИЯ ---
 
@@ -56,45 +69,148 @@ def document_list(request):
     if category_id:
         docs = docs.filter(category_id=category_id)
 
-    # 2. По Поиску (Название)
+    # 2. По Типу файла (тип хранится в отдельной колонке с индексом)
+    if file_type in dict(Document.FILE_KIND_CHOICES):
+        docs = docs.filter(file_kind=file_type)
+
+    # 3. По Поиску (Название + текст внутри файла, через FTS-индекс).
+    # Последним: индекс ищет только среди уже отфильтрованных документов
+    search_hits = None
     if search_query:
-        docs = docs.filter(title__icontains=search_query)
-
-    # 3. По Типу файла (Используем Q для логики ИЛИ)
-    if file_type == 'pdf':
-        docs = docs.filter(file__iendswith='.pdf')
-    elif file_type == 'word':
-        docs = docs.filter(Q(file__iendswith='.doc') | Q(file__iendswith='.docx'))
-    elif file_type == 'excel':
-        docs = docs.filter(Q(file__iendswith='.xls') | Q(file__iendswith='.xlsx') | Q(file__iendswith='.csv'))
-    elif file_type == 'image':
-        docs = docs.filter(Q(file__iendswith='.jpg') | Q(file__iendswith='.jpeg') | Q(file__iendswith='.png'))
-    elif file_type == 'archive':
-        docs = docs.filter(Q(file__iendswith='.zip') | Q(file__iendswith='.rar'))
-
-    # --- СОРТИРОВКА ---
+        if search.is_available():
+            # {id: подсвеченный фрагмент} — уже в порядке релевантности
+            search_hits = dict(search.search(search_query, documents=docs))
+            docs = docs.filter(id__in=list(search_hits))
+        else:
+            docs = docs.filter(title__icontains=search_query)
+
+    return docs, search_hits
+
+
+def _document_ordering(search_hits, sort_param):
+    # По умолчанию: при поиске — самые релевантные сверху (None), иначе — новые
+    if search_hits is not None and sort_param in ('', 'relevance'):
+        return None
+    # id в конце делает ключ уникальным (одинаковые даты/названия)
     if sort_param == 'name_asc':
-        docs = docs.order_by('title')
-    elif sort_param == 'name_desc':
-        docs = docs.order_by('-title')
-    elif sort_param == 'date_asc':
-        docs = docs.order_by('uploaded_at')
+        return ('title', 'id')
+    if sort_param == 'name_desc':
+        return ('-title', '-id')
+    if sort_param == 'date_asc':
+        return ('uploaded_at', 'id')
+    return ('-uploaded_at', '-id')  # По умолчанию новые сверху
+
+
+def _table_context(request, docs, next_cursor, search_hits):
+    for doc in docs:
+        # Кнопки "Редактировать/Удалить/Поделиться" в строке
+        doc.can_manage = access.can_manage(request.user, doc)
+        # Фрагмент текста с подсветкой найденных слов
+        if search_hits:
+            doc.search_snippet = search_hits.get(doc.id)
+
+    # Ссылка на следующую страницу сохраняет все текущие фильтры
+    next_page_url = None
+    if next_cursor:
+        params = request.GET.copy()
+        params['cursor'] = next_cursor
+        next_page_url = f"?{params.urlencode()}"
+
+    return {'docs': docs, 'next_page_url': next_page_url}
+
+
+def _document_table(request, category_id, search_query, sort_param, file_type):
+    """Строки таблицы документов и ссылка на следующую страницу."""
+    docs, search_hits = _filter_documents(request, category_id, search_query, file_type)
+
+    # --- СОРТИРОВКА + ПАГИНАЦИЯ ---
+    ordering = _document_ordering(search_hits, sort_param)
+    if ordering is None:
+        docs, next_cursor = ranked_page(
+            docs, list(search_hits),
+            cursor=request.GET.get('cursor'),
+            page_size=settings.DOCUMENTS_PAGE_SIZE,
+        )
     else:
-        docs = docs.order_by('-uploaded_at')  # По умолчанию новые сверху
+        docs, next_cursor = keyset_page(
+            docs, ordering,
+            cursor=request.GET.get('cursor'),
+            page_size=settings.DOCUMENTS_PAGE_SIZE,
+        )
+    return _table_context(request, docs, next_cursor, search_hits)
 
-    categories = Category.objects.all()
 
-    # Пустая форма нужна для Модального окна загрузки на главной странице
-    form = DocumentForm()
+async def _adocument_table(request, category_id, search_query, sort_param, file_type):
+    """_document_table для асинхронного document_list."""
+    if search_query:
+        # Поиск — сырой SQL к FTS-индексу (синхронный драйвер), выполняем в потоке
+        return await sync_to_async(_document_table)(request, category_id, search_query, sort_param, file_type)
 
-    return render(request, 'core/document_list.html', {
-        'docs': docs,
-        'categories': categories,
-        'form': form,  # <-- Передаем форму для модалки
+    # Без поиска _filter_documents только строит запрос (допуск уже прочитан)
+    docs, _ = _filter_documents(request, category_id, search_query, file_type)
+    docs, next_cursor = await akeyset_page(
+        docs, _document_ordering(None, sort_param),
+        cursor=request.GET.get('cursor'),
+        page_size=settings.DOCUMENTS_PAGE_SIZE,
+    )
+    return _table_context(request, docs, next_cursor, None)
+
+
+# Главная страница, открытие и скачивание файлов — асинхронные: под ASGI
+# (uvicorn) запросы к базе идут через async ORM, а файл отдается кусками
+# без занятого потока (delivery.aserve_document). Под WSGI они работают
+# как обычные представления.
+
+@login_required
+async def document_list(request):
+    # Пользователь уже загружен декоратором; кладем его в request.user,
+    # чтобы обращения к нему не ходили в базу синхронно
+    request.user = await request.auser()
+    access_info = await access.aget_access(request.user)
+
+    # Получаем параметры из URL
+    category_id = request.GET.get('category')
+    search_query = request.GET.get('q', '')
+    sort_param = request.GET.get('sort', '')
+    file_type = request.GET.get('type')  # Тип файла (pdf, word, etc.)
+
+    filters = {
         'current_category': int(category_id) if category_id else None,
         'search_query': search_query,
         'current_sort': sort_param,
-        'current_type': file_type
+        'current_type': file_type,
+        'is_first_page': not request.GET.get('cursor'),
+    }
+
+    # Таблица без поиска берется из кэша (ключ — фильтры + пользователь + версия документов).
+    # Результаты поиска не кэшируем: запросы разные, а текст в индекс дописывается в фоне
+    cache_key = None
+    document_table = None
+    if not search_query:
+        cache_key = await caching.adocument_table_key(request, access_info)
+        document_table = await cache.aget(cache_key)
+
+    if document_table is None:
+        table_context = await _adocument_table(request, category_id, search_query, sort_param, file_type)
+        document_table = await sync_to_async(render_to_string)('core/document_table.html', {
+            **filters,
+            **table_context,
+        }, request=request)
+        if cache_key:
+            await cache.aset(cache_key, document_table, settings.CACHE_FRAGMENT_SECONDS)
+
+    # Пустая форма нужна для Модального окна загрузки на главной странице
+    form = DocumentForm()
+
+    # Шаблон страницы сам ходит в базу (профиль в шапке, категории в форме) — рендерим в потоке
+    return await sync_to_async(render)(request, 'core/document_list.html', {
+        **filters,
+        'document_table': document_table,
+        # Категории — из кэша; боковая панель и списки в модалках — кэшированные фрагменты
+        'categories': await caching.aget_categories(),
+        'categories_version': await caching.aget_version('categories'),
+        'fragment_timeout': settings.CACHE_FRAGMENT_SECONDS,
+        'form': form,  # <-- Передаем форму для модалки
     })
 
 
@@ -102,22 +218,22 @@ def document_list(request):
 # 3. ДЕЙСТВИЯ С ДОКУМЕНТАМИ
 # ==========================================
 
+def save_uploaded_document(request, doc):
+    # Загрузка через форму: автор + журнал (докачка делает то же в uploads.finalize)
+    doc.uploaded_by = request.user
+    doc.save()
+
+    # 🕵️‍♂️ Лог
+    audit.log(request.user, "Загрузка файла", doc.title)
+    return doc
+
+
 @login_required
 def upload_document(request):
     if request.method == 'POST':
         form = DocumentForm(request.POST, request.FILES)
         if form.is_valid():
-            doc = form.save(commit=False)
-            doc.uploaded_by = request.user
-            doc.save()
-
-            # 🕵️‍♂️ Лог
-            AuditLog.objects.create(
-                user=request.user,
-                action="Загрузка файла",
-                document_title=doc.title
-            )
-
+            save_uploaded_document(request, form.save(commit=False))
             messages.success(request, 'Документ успешно загружен!')
             return redirect('home')
 
@@ -133,14 +249,10 @@ def delete_document(request, doc_id):
     doc = get_object_or_404(Document, pk=doc_id)
 
     # Проверка прав
-    if request.user == doc.uploaded_by or request.user.is_superuser:
+    if access.can_manage(request.user, doc):
 
         # 🕵️‍♂️ Лог (до удаления)
-        AuditLog.objects.create(
-            user=request.user,
-            action="Удаление файла",
-            document_title=doc.title
-        )
+        audit.log(request.user, "Удаление файла", doc.title)
 
         doc.delete()
         messages.success(request, 'Документ удален.')
@@ -154,7 +266,7 @@ def delete_document(request, doc_id):
 def edit_document(request, doc_id):
     doc = get_object_or_404(Document, id=doc_id)
 
-    if request.user != doc.uploaded_by and not request.user.is_superuser:
+    if not access.can_manage(request.user, doc):
         messages.error(request, "Нет прав на редактирование.")
         return redirect('home')
 
@@ -171,16 +283,12 @@ def edit_document(request, doc_id):
         doc.save()
 
         # 🕵️‍♂️ Лог
-        AuditLog.objects.create(
-            user=request.user,
-            action="Редактирование",
-            document_title=doc.title
-        )
+        audit.log(request.user, "Редактирование", doc.title)
 
         messages.success(request, 'Документ изменен!')
         return redirect('home')
 
-    categories = Category.objects.all()
+    categories = caching.get_categories()
     return render(request, 'core/edit_document.html', {'doc': doc, 'categories': categories})
 
 
@@ -190,9 +298,7 @@ def edit_document(request, doc_id):
 
 @login_required
 def profile_view(request):
-    # Гарантируем, что профиль существует
-    Profile.objects.get_or_create(user=request.user)
-
+    # Профиль уже загружен вместе с пользователем (core/backends.py)
     docs_count = Document.objects.filter(uploaded_by=request.user).count()
 
     if request.method == 'POST':
@@ -200,8 +306,17 @@ def profile_view(request):
         if 'update_avatar' in request.POST:
             avatar_form = ProfileForm(request.POST, request.FILES, instance=request.user.profile)
             if avatar_form.is_valid():
-                avatar_form.save()
-                messages.success(request, 'Аватар обновлен!')
+                profile = avatar_form.save()
+                # Один раз режем на маленькие копии — страницы грузят их, а не оригинал
+                try:
+                    avatars.process(profile)
+                    messages.success(request, 'Аватар обновлен!')
+                except avatars.AvatarError:
+                    # Без аватарки и без копий прежней — иначе страницы показали бы старую
+                    profile.avatar = None
+                    profile.avatar_variants = ''
+                    profile.save(update_fields=['avatar', 'avatar_variants'])
+                    messages.error(request, 'Не удалось прочитать изображение.')
                 return redirect('profile')
             password_form = PasswordChangeForm(request.user)
 
@@ -234,6 +349,18 @@ def profile_view(request):
 # 5. АДМИН-ПАНЕЛЬ (Категории + Логи)
 # ==========================================
 
+@login_required
+def avatar_variant(request, key, filename):
+    # Копии аватарок: имя зависит от содержимого, поэтому браузер кэширует их навсегда
+    found = avatars.variant_path(key, filename)
+    if found is None or not os.path.isfile(found[0]):
+        raise Http404("Аватар не найден")
+    path, content_type = found
+    backend = delivery.DELIVERY_BACKENDS[settings.DOCUMENT_DELIVERY_BACKEND]
+    return backend(request, path, content_type=content_type, content_disposition=None,
+                   cache_control=settings.AVATAR_CACHE_CONTROL)
+
+
 @user_passes_test(lambda u: u.is_superuser)
 def manage_categories(request):
     if request.method == 'POST':
@@ -243,22 +370,145 @@ def manage_categories(request):
             messages.success(request, f'Категория "{name}" создана!')
             return redirect('manage_categories')
 
-    categories = Category.objects.all()
-    return render(request, 'core/category_manager.html', {'categories': categories})
+    categories = caching.get_categories()
+    # Категории, которые сейчас удаляются вместе с документами, — с прогрессом
+    deleting = bulk.deletion_tasks()
+    for cat in categories:
+        cat.deletion = deleting.get(cat.id)
+    return render(request, 'core/category_manager.html', {
+        'categories': categories,
+        'delete_modes': CategoryDeleteForm.MODE_CHOICES,
+    })
 
 
 @user_passes_test(lambda u: u.is_superuser)
+@require_POST
 def delete_category(request, cat_id):
     category = get_object_or_404(Category, id=cat_id)
-    category.delete()
-    messages.success(request, 'Категория удалена!')
+    form = CategoryDeleteForm(request.POST)
+    if not form.is_valid() or form.cleaned_data['target'] == category:
+        messages.error(request, 'Выберите, что сделать с документами категории.')
+        return redirect('manage_categories')
+
+    mode = form.cleaned_data['mode']
+    if mode == 'delete':
+        task = bulk.start_category_deletion(request.user, category)
+        messages.success(request, f'Категория "{category.name}" удаляется вместе с документами '
+                                  f'({task.payload["total"]}). Прогресс — на этой странице.')
+    else:
+        target = form.cleaned_data['target'] if mode == 'reassign' else None
+        count = bulk.reassign_category(request.user, category, target)
+        messages.success(request, f'Категория удалена! Документов перенесено: {count}')
     return redirect('manage_categories')
 
 
+def _parse_day(value):
+    # 'ГГГГ-ММ-ДД' из <input type="date"> -> начало этого дня в текущем часовом поясе
+    try:
+        day = parse_date(value or '')
+    except ValueError:
+        day = None
+    if day is None:
+        return None
+    return timezone.make_aware(datetime.combine(day, datetime_time.min))
+
+
+def _filtered_audit_logs(request):
+    """Журнал с фильтрами из GET. Каждый фильтр попадает в один из индексов AuditLog."""
+    filters = {
+        'user': request.GET.get('user', ''),
+        'action': request.GET.get('action', ''),
+        'date_from': request.GET.get('date_from', ''),
+        'date_to': request.GET.get('date_to', ''),
+    }
+    logs = AuditLog.objects.all()
+
+    if filters['user'].isdigit():
+        logs = logs.filter(user_id=int(filters['user']))
+    if filters['action']:
+        logs = logs.filter(action=filters['action'])
+
+    start = _parse_day(filters['date_from'])
+    if start:
+        logs = logs.filter(timestamp__gte=start)
+    end = _parse_day(filters['date_to'])
+    if end:
+        # Включительно: до начала следующего дня
+        logs = logs.filter(timestamp__lt=end + timedelta(days=1))
+
+    return logs, filters
+
+
+def _audit_export(logs, export_format):
+    # Потоковая выгрузка: строки идут из курсора базы пачками и сразу уходят клиенту
+    rows = (logs.order_by('-timestamp', '-id')
+                .values_list('timestamp', 'user__username', 'action', 'document_title')
+                .iterator(chunk_size=2000))
+
+    if export_format == 'jsonl':
+        def stream():
+            for timestamp, username, action, title in rows:
+                yield json.dumps({
+                    'timestamp': timezone.localtime(timestamp).isoformat(),
+                    'user': username,
+                    'action': action,
+                    'document': title,
+                }, ensure_ascii=False) + '\n'
+        content_type = 'application/x-ndjson; charset=utf-8'
+    else:
+        class Echo:
+            # csv.writer пишет в "файл", который просто возвращает строку
+            def write(self, value):
+                return value
+
+        writer = csv.writer(Echo())
+
+        def stream():
+            yield '\ufeff'  # BOM — чтобы Excel открыл кириллицу без кракозябр
+            yield writer.writerow(['Время', 'Пользователь', 'Действие', 'Документ'])
+            for timestamp, username, action, title in rows:
+                yield writer.writerow([timezone.localtime(timestamp).isoformat(), username or '', action, title])
+        content_type = 'text/csv; charset=utf-8'
+        export_format = 'csv'
+
+    response = StreamingHttpResponse(stream(), content_type=content_type)
+    filename = f"audit_{timezone.localdate():%Y-%m-%d}.{export_format}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
 @user_passes_test(lambda u: u.is_superuser)
 def audit_log_view(request):
-    logs = AuditLog.objects.all()
-    return render(request, 'core/audit_log.html', {'logs': logs})
+    logs, filters = _filtered_audit_logs(request)
+
+    export_format = request.GET.get('export')
+    if export_format in ('csv', 'jsonl'):
+        return _audit_export(logs, export_format)
+
+    # Автор одним JOIN, страница — по ключу (время, id), без OFFSET
+    logs, next_cursor = keyset_page(
+        logs.select_related('user'), ('-timestamp', '-id'),
+        cursor=request.GET.get('cursor'),
+        page_size=settings.AUDIT_LOG_PAGE_SIZE,
+    )
+
+    params = request.GET.copy()
+    params.pop('cursor', None)
+    next_page_url = None
+    if next_cursor:
+        next_params = params.copy()
+        next_params['cursor'] = next_cursor
+        next_page_url = f"?{next_params.urlencode()}"
+
+    return render(request, 'core/audit_log.html', {
+        'logs': logs,
+        'filters': filters,
+        'users': User.objects.order_by('username').only('id', 'username'),
+        'actions': audit.ACTIONS,
+        'filter_query': params.urlencode(),
+        'next_page_url': next_page_url,
+        'is_first_page': not request.GET.get('cursor'),
+    })
 
 
 # ==========================================
@@ -269,68 +519,296 @@ def audit_log_view(request):
 def create_share_link(request, doc_id):
     doc = get_object_or_404(Document, id=doc_id)
 
-    if request.user != doc.uploaded_by and not request.user.is_superuser:
+    if not access.can_manage(request.user, doc):
         messages.error(request, "Нет прав делиться этим файлом.")
         return redirect('home')
 
-    share_link, created = ShareLink.objects.get_or_create(document=doc)
+    # Действующая ссылка или новая — со сроком и лимитом скачиваний из настроек
+    share_link = sharing.get_or_create_link(doc)
 
     # Формируем полный URL
     full_link = request.build_absolute_uri(f"/s/{share_link.token}/")
 
-    return render(request, 'core/share_result.html', {'full_link': full_link, 'doc': doc})
+    return render(request, 'core/share_result.html', {'full_link': full_link, 'doc': doc, 'share_link': share_link})
 
 
-def public_download(request, token):
-    # Открытый доступ без авторизации
-    share_link = get_object_or_404(ShareLink, token=token)
-    doc = share_link.document
+async def public_download(request, token):
+    # Открытый доступ без авторизации: ссылка и документ — один запрос,
+    # горячие ссылки — из кэша (см. core/sharing.py)
+    share_link = await sharing.aresolve(token)
+    if share_link is None:
+        raise Http404("Ссылка не найдена")
+    if sharing.is_expired(share_link):
+        return HttpResponseGone("Срок действия ссылки истек")
 
-    try:
-        response = FileResponse(open(doc.file.path, 'rb'))
-        # Принудительное скачивание
-        response['Content-Disposition'] = f'attachment; filename="{doc.file.name.split("/")[-1]}"'
+    retry_after = await sharing.athrottle(token)
+    if retry_after:
+        response = HttpResponse("Слишком много скачиваний по этой ссылке, попробуйте позже", status=429)
+        response['Retry-After'] = str(math.ceil(retry_after))
         return response
-    except FileNotFoundError:
-        raise Http404("Файл не найден на сервере")
+
+    # Засчитываются только GET (HEAD и 304 — нет)
+    counted = request.method == 'GET'
+    if counted and not await sharing.areserve_download(share_link):
+        return HttpResponseGone("Лимит скачиваний по ссылке исчерпан")
+
+    doc = share_link.document
+    response = None
+    try:
+        # Принудительное скачивание (Range/ETag/304 — внутри aserve_document).
+        # Имя — по названию документа (в хранилище файл лежит под хэшем), RFC 5987
+        filename = escape_uri_path(delivery.download_filename(doc))
+        response = await delivery.aserve_document(request, doc, f"attachment; filename*=UTF-8''{filename}")
+    finally:
+        if counted:
+            await sharing.afinish_download(share_link, response is not None and response.status_code in (200, 206))
+    return response
 
 
 # ==========================================
 # 7. УМНОЕ ОТКРЫТИЕ ФАЙЛА
 # ==========================================
-import mimetypes
-from django.utils.encoding import escape_uri_path
 
 @login_required
-def open_file(request, doc_id):
-    doc = get_object_or_404(Document, pk=doc_id)
-
-    if not os.path.exists(doc.file.path):
-        raise Http404("Файл не найден")
+async def open_file(request, doc_id):
+    # Документ выше допуска — 404, как будто его нет
+    user = await request.auser()
+    doc = await aget_object_or_404(await access.avisible_documents(user), pk=doc_id)
 
     # 1. Определяем: скачивать или показывать
     disposition_type = 'attachment' if request.GET.get('download') else 'inline'
 
-    # 2. Открываем файл
-    response = FileResponse(open(doc.file.path, 'rb'))
-
-    # 3. Определяем MIME-тип (PDF, JPG и т.д.)
-    content_type, _ = mimetypes.guess_type(doc.file.path)
-    if not content_type:
-        content_type = 'application/octet-stream'
-    response['Content-Type'] = content_type
+    # 2. Формируем имя файла: "Красивое Имя" + расширение (например .pdf)
+    new_filename = delivery.download_filename(doc)
 
-    # 4. Формируем имя файла
-    # Берем расширение (например .pdf)
-    ext = os.path.splitext(doc.file.name)[1]
-    # Собираем новое имя: "Красивое Имя" + ".pdf"
-    new_filename = f"{doc.title}{ext}"
-
-    # 5. МАГИЯ КОДИРОВКИ (RFC 5987)
+    # 3. МАГИЯ КОДИРОВКИ (RFC 5987)
     # Это заставляет браузер понять русские буквы и пробелы
     encoded_name = escape_uri_path(new_filename)
 
     # Заголовок выглядит так: inline; filename*=UTF-8''%D0%9E%D1%82%D1%87%D0%B5%D1%82.pdf
-    response['Content-Disposition'] = f"{disposition_type}; filename*=UTF-8''{encoded_name}"
+    content_disposition = f"{disposition_type}; filename*=UTF-8''{encoded_name}"
+
+    # 4. Отдаем файл: MIME-тип, ETag/304, Range (докачка PDF кусками)
+    return await delivery.aserve_document(request, doc, content_disposition)
+
+
+@login_required
+def download_zip(request):
+    # Те же фильтры, что на главной (категория, поиск, тип), и тот же допуск
+    category_id = request.GET.get('category')
+    docs, _ = _filter_documents(request, category_id, request.GET.get('q', ''), request.GET.get('type'))
+    docs = docs.select_related(None).only('id', 'title', 'file', 'extension').order_by('title', 'id')
+
+    count = docs.count()
+    if not count:
+        messages.error(request, 'Нет документов для скачивания.')
+        return redirect('home')
+    if count > settings.DOWNLOAD_ZIP_MAX_FILES:
+        messages.error(request, f'Слишком много документов ({count}). Уточните фильтр — не больше {settings.DOWNLOAD_ZIP_MAX_FILES}.')
+        return redirect('home')
+
+    # Имя архива — по категории, если выбрана
+    category = Category.objects.filter(pk=category_id).first() if category_id else None
+    filename = f"{category.name if category else 'Документы'}.zip"
+
+    # Документы читаются из базы пачками по ходу отдачи архива
+    return delivery.serve_zip(docs.iterator(chunk_size=200), filename)
+
+
+# ==========================================
+# 8. ПРЕДПРОСМОТР (миниатюры + HTML)
+# ==========================================
+
+@login_required
+def document_preview(request, doc_id, variant):
+    doc = get_object_or_404(access.visible_documents(request.user), pk=doc_id)
+
+    # Файл может быть в холодном хранилище: готовое превью отдается без него
+    if not tiering.is_stored(doc):
+        raise Http404("Файл не найден")
+
+    # Миниатюра для списка (картинки и первая страница PDF)
+    if variant == 'thumb':
+        path, content_type = previews.thumbnail(doc)
+    # HTML для модалки: страница DOCX или первые строки таблицы
+    elif variant == 'html':
+        try:
+            page = int(request.GET.get('page', 1))
+        except ValueError:
+            page = 1
+        path, content_type = previews.html_preview(doc, page), 'text/html; charset=utf-8'
+    else:
+        raise Http404("Неизвестный вид превью")
+
+    if path is None:
+        raise Http404("Предпросмотр недоступен")
+
+    # Превью кэшируются браузером по тем же правилам, что и сам документ
+    return delivery.serve_file(request, path, content_type, None, delivery.cache_control_for(doc))
+
+
+# ==========================================
+# 9. ДОКАЧИВАЕМАЯ ЗАГРУЗКА БОЛЬШИХ ФАЙЛОВ (API, см. core/uploads.py)
+# ==========================================
+
+def _upload_session_response(session, status=200):
+    response = JsonResponse({
+        'id': str(session.pk),
+        'offset': session.offset,
+        'size': session.size,
+        'url': reverse('upload_session', args=[session.pk]),
+        'finalize_url': reverse('upload_session_finalize', args=[session.pk]),
+    }, status=status)
+    response['Upload-Offset'] = str(session.offset)
+    response['Upload-Length'] = str(session.size)
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+@login_required
+@require_POST
+def upload_session_create(request):
+    form = UploadSessionForm(request.POST)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+
+    session = form.save(commit=False)
+    session.user = request.user
+    session.save()
+    uploads.start(session)
+
+    response = _upload_session_response(session, status=201)
+    response['Location'] = reverse('upload_session', args=[session.pk])
+    return response
+
+
+@login_required
+@require_http_methods(['GET', 'HEAD', 'PATCH', 'DELETE'])
+def upload_session_detail(request, session_id):
+    session = get_object_or_404(UploadSession, pk=session_id, user=request.user)
+
+    if request.method == 'PATCH':
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+        except ValueError:
+            return JsonResponse({'error': 'Нужен заголовок Upload-Offset'}, status=400)
+        length = request.META.get('CONTENT_LENGTH')
+        try:
+            # request.read() читает тело потоком — request.body не трогаем
+            uploads.append_chunk(session, request, offset, int(length) if length else None)
+        except uploads.UploadError as error:
+            return JsonResponse({'error': error.message, 'offset': session.offset}, status=error.status)
+
+    elif request.method == 'DELETE':
+        uploads.discard(session)
+        return HttpResponse(status=204)
+
+    return _upload_session_response(session)
 
-    return response
\ No newline at end of file
+
+@login_required
+@require_POST
+def upload_session_finalize(request, session_id):
+    session = get_object_or_404(UploadSession, pk=session_id, user=request.user)
+
+    # Повторный finalize (ответ потерялся в сети или клиент ждет задачу) ставит задачу один раз
+    if session.document_id is None and not session.error:
+        try:
+            uploads.finish(session)
+        except uploads.UploadError as error:
+            return JsonResponse({'error': error.message}, status=error.status)
+
+    if session.error:
+        return JsonResponse({'error': session.error}, status=422)
+    if session.document_id is None:
+        if session.finalize_task and session.finalize_task.status == 'failed':
+            return JsonResponse({'error': 'Не удалось сохранить файл, загрузите его заново'}, status=500)
+        # Задача еще идет — клиент повторит запрос
+        response = _upload_session_response(session, status=202)
+        response['Retry-After'] = '2'
+        return response
+
+    messages.success(request, 'Документ успешно загружен!')
+    return JsonResponse({'document_id': session.document_id, 'redirect': reverse('home')}, status=201)
+
+
+# ==========================================
+# 10. МАССОВЫЕ ОПЕРАЦИИ (папка / ZIP, удаление и перемещение пачкой)
+# ==========================================
+
+def _wants_json(request):
+    # Скрипты загрузки получают JSON, браузер — редирект с сообщением
+    return 'application/json' in request.headers.get('Accept', '')
+
+
+@login_required
+@require_POST
+def bulk_upload(request):
+    form = BulkUploadForm(request.POST)
+    files = request.FILES.getlist('files')
+    archive = request.FILES.get('archive')
+
+    error = None
+    if not form.is_valid():
+        error = 'Некорректная категория или гриф'
+    elif not files and not archive:
+        error = 'Выберите файлы или ZIP-архив'
+    elif len(files) > settings.BULK_UPLOAD_MAX_FILES:
+        error = f'Не больше {settings.BULK_UPLOAD_MAX_FILES} файлов за раз — для большего используйте ZIP'
+
+    docs = []
+    if error is None:
+        try:
+            stored = bulk.store_files((f.name, f) for f in files)
+            if archive:
+                stored += bulk.store_files(bulk.iter_zip_files(archive))
+            docs = bulk.create_documents(
+                request.user, stored,
+                category=form.cleaned_data['category'],
+                security_level=form.cleaned_data['security_level'],
+            )
+        except bulk.BulkError as e:
+            error = str(e)
+
+    if _wants_json(request):
+        if error:
+            return JsonResponse({'error': error}, status=400)
+        return JsonResponse({'created': len(docs), 'ids': [doc.pk for doc in docs]}, status=201)
+
+    if error:
+        messages.error(request, error)
+    else:
+        messages.success(request, f'Загружено документов: {len(docs)}')
+    return redirect('home')
+
+
+@login_required
+@require_POST
+def bulk_action(request):
+    form = BulkActionForm(request.POST)
+    if not form.is_valid():
+        messages.error(request, 'Отметьте документы и выберите действие.')
+        return redirect('home')
+
+    # Только те из отмеченных, которыми пользователь может управлять
+    docs = access.manageable_documents(request.user).filter(pk__in=form.cleaned_data['ids'])
+    skipped = len(set(form.cleaned_data['ids'])) - docs.count()
+
+    action = form.cleaned_data['action']
+    if action == 'delete':
+        count = bulk.delete_documents(request.user, docs)
+        messages.success(request, f'Удалено документов: {count}')
+    elif action == 'move':
+        count = bulk.update_documents(request.user, docs, category=form.cleaned_data['category'])
+        messages.success(request, f'Перемещено документов: {count}')
+    else:
+        count = bulk.update_documents(request.user, docs, security_level=form.cleaned_data['security_level'])
+        messages.success(request, f'Гриф изменен у документов: {count}')
+
+    if skipped:
+        messages.warning(request, f'Пропущено (нет прав): {skipped}')
+    # Возвращаемся на ту же страницу списка (с фильтрами), но только в пределах сайта
+    next_url = request.POST.get('next', '')
+    if url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}, require_https=request.is_secure()):
+        return redirect(next_url)
+    return redirect('home')
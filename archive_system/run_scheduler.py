@@ -1,18 +1,12 @@
-import time
 import os
-import subprocess
-from datetime import datetime
+import sys
 
-print("⏳ Запуск планировщика очистки логов (каждые 20 минут)...")
+# Раньше здесь был цикл, который каждые 20 минут запускал
+# "python manage.py cleanup_logs" отдельным процессом.
+# Теперь расписание живет в core/scheduler.py, а этот файл —
+# просто короткий путь к: python manage.py run_scheduler
 
-while True:
-    print(f"\n[{datetime.now().strftime('%H:%M:%S')}] Запускаю очистку...")
-
-    # Запускаем нашу команду Django
-    # Используем subprocess для надежности
-    subprocess.run(["python", "manage.py", "cleanup_logs"], shell=True)
-
-    print("✅ Готово. Следующая очистка через 20 минут.")
-
-    # Ждем 20 минут (1 час * 20 минут * 20 секунд)
-    time.sleep(1 * 20 * 60)
\ No newline at end of file
+if __name__ == '__main__':
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'archive_system.settings')
+    from django.core.management import execute_from_command_line
+    execute_from_command_line([sys.argv[0], 'run_scheduler', *sys.argv[1:]])